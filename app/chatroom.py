@@ -2,17 +2,111 @@
 chatroom class module.
 '''
 
+import threading
+from types import MappingProxyType
+
+from app.history import RingBuffer
+from app.ids import USER_IDS, select
+
+# shared, read-only stand-in for blocked_by until someone blocks someone
+NO_BLOCKS = MappingProxyType({})
+
+
 class Chatroom:
     '''
     chatroom class. keeps track of clients in a dictionary (key = username, value = user_socket)
+
+    every room has its own lock, so rooms can be joined, left and messaged
+    from many client threads at once without a global lock. membership
+    changes happen under the lock. broadcasts iterate Chatroom.recipients, 
+    an immutable snapshot that's replaced (never modified), so they only
+    need the lock to rebuild it. changes just mark the snapshots out of 
+    date, and the next read rebuilds them once, so a burst of joins 
+    doesn't copy the whole room for every one.
+
+    who gets a room's messages is worked out ahead of time, not per message,
+    and kept up to date as users join, leave, mute, unmute, block and 
+    unblock. every member gets a slot, a small int that's only reused once
+    they leave, and membership, mutes and blocks are bitmaps over slots 
+    (see app/ids.py):
+
+    - member_mask: slots in use
+    - muted_mask: members who muted the room
+    - blocked_by: key is a sender's user id (app.ids.USER_IDS), value is 
+      a bitmap of the members who blocked them
+
+    recipients (members who haven't muted the room) is kept as a tuple
+    too, for the common case where nobody blocked the sender. otherwise
+    the sender's recipients are one mask operation: 
+    recipient_mask & ~blocked_by[sender].
+
+    rooms also keep each member's User.curr_rooms up to date, so that's
+    always the exact list of rooms a user is in (the reverse of 
+    Chatroom.clients). never change curr_rooms anywhere else.
+
+    rooms keep their last few messages (see app/history.py) so people
+    who join can catch up.
+
+    there can be a lot of rooms, so they use __slots__, and free_slots,
+    blocked_by and history aren't made until they're needed.
     '''
 
+    __slots__ = ('name', 'prefix', 'clients', '_members', 'slot_of', 'free_slots',
+                 'slots', 'member_mask', 'muted_mask', 'blocked_by', '_view', '_recipients',
+                 'history', 'lock')
+
     def __init__(self, room_name):
         # room name
         self.name = room_name
+        # room name as it starts every message sent to this room, 
+        # encoded once here instead of once per message
+        self.prefix = f'{room_name} '.encode('ascii')
         # A dictionary of clients 
         # Key is the user name (str), value is the User() object 
         self.clients = {}  
+        # tuple of User() objects, a snapshot of self.clients.values() 
+        # that's safe to iterate from any thread. None once it's out of 
+        # date, and rebuilt when it's next read (see members)
+        self._members = ()
+        # key is user name (str), value is their slot (int)
+        self.slot_of = {}
+        # slots given up by users who left, reused first. 
+        # an empty tuple until someone leaves
+        self.free_slots = ()
+        # index is the slot, value is the User() object in it (or None).
+        # changed in place, under the lock
+        self.slots = []
+        # bitmaps over slots
+        self.member_mask = 0
+        self.muted_mask = 0
+        self.blocked_by = NO_BLOCKS
+        # snapshot of (slots, recipient_mask), slots as a tuple. kept 
+        # together so readers always see a matching pair. None when it's
+        # out of date (see view)
+        self._view = ((), 0)
+        # tuple of User() objects who haven't muted this room. same kind 
+        # of snapshot (see recipients)
+        self._recipients = ()
+        # RingBuffer() of (sender name, frame) for recent messages. 
+        # None until the first message
+        self.history = None
+        # guards everything above
+        self.lock = threading.RLock()
+
+    @property
+    def members(self):
+        '''
+        tuple of the User() objects in this room. joins and leaves only
+        mark it out of date, so it's copied once per read after a change,
+        not once per change.
+        '''
+        members = self._members
+        if members is None:
+            with self.lock:
+                if self._members is None:
+                    self._members = tuple(self.clients.values())
+                members = self._members
+        return members
 
     # returns True if a given user is in this room
     def has_user(self, user_name):
@@ -20,7 +114,8 @@ class Chatroom:
 
     # returns a list of users in this room:
     def get_users(self):
-        user_list = list(self.clients.keys())
+        with self.lock:
+            user_list = list(self.clients.keys())
         return " ".join(user_list) 
 
     # Adds a new client to a chatroom and notifies clients in that room
@@ -28,36 +123,226 @@ class Chatroom:
         '''
         add a new client. key is their username, value is the User() object
 
-        updates User() object fields curr_room and curr_rooms if this room 
-        hasn't been visited by the user yet.
+        adds this room to the User() object's curr_rooms.
+
+        returns True if they were added, False if they were already here.
 
         parameters
         ------------
         - new_user = User() object
         '''
         # add the client if they're not already here
-        if new_user.name not in self.clients.keys():
-            self.clients[new_user.name] = new_user
-            if self.name not in new_user.curr_rooms:
-                new_user.curr_rooms.append(self.name)
-        else:
-            new_user.send(f'Error: you are already in {self.name}!'.encode('ascii'))
+        with self.lock:
+            if new_user.name not in self.clients.keys():
+                self.clients[new_user.name] = new_user
+                self._members = None
+                slot = self.free_slots.pop() if self.free_slots else len(self.slots)
+                self.slot_of[new_user.name] = slot
+                self.member_mask |= 1 << slot
+                if new_user.has_muted(self.name):
+                    self.muted_mask |= 1 << slot
+                for sender in list(new_user.blocked):
+                    self._set_blocked(slot, sender, True)
+                if slot == len(self.slots):
+                    self.slots.append(new_user)
+                else:
+                    self.slots[slot] = new_user
+                self._changed()
+                if self.name not in new_user.curr_rooms:
+                    new_user.curr_rooms.append(self.name)
+                return True
+        new_user.send(f'Error: you are already in {self.name}!'.encode('ascii'))
+        return False
         
     # Removes an existing client from a chatroom and notifies the clients in that room
     def remove_client_from_room(self, user):
         '''
-        remove a client from a chatroom. 
-        
-        **does not modify users curr_room list!**
+        remove a client from a chatroom. also removes this room from
+        their User() object's curr_rooms.
 
         parameters
         -----------
         - user = '' (client to remove)
         '''
-        if user in self.clients.keys():
-            del self.clients[user]
-        else:
-            return f'ERROR: {user} is not in {self.name}!'
+        with self.lock:
+            client = self.clients.pop(user, None)
+            if client is not None:
+                self._members = None
+                slot = self.slot_of.pop(user)
+                was_recipient = not self.muted_mask >> slot & 1
+                self.member_mask &= ~(1 << slot)
+                self.muted_mask &= ~(1 << slot)
+                for sender in list(client.blocked):
+                    self._set_blocked(slot, sender, False)
+                self.slots[slot] = None
+                self._removed(client, was_recipient)
+                if not self.free_slots:
+                    self.free_slots = []
+                self.free_slots.append(slot)
+                if self.name in client.curr_rooms:
+                    client.curr_rooms.remove(self.name)
+                return
+        return f'ERROR: {user} is not in {self.name}!'
+
+    # a member muted or unmuted this room
+    def set_muted(self, user, muted):
+        '''
+        take a member out of (or put them back in) the recipients list.
+        call after User.mute() / User.unmute().
+
+        parameters
+        -----------
+        - user = User() object
+        - muted = bool
+        '''
+        with self.lock:
+            if self.clients.get(user.name) is not user:
+                return
+            slot = self.slot_of[user.name]
+            if muted:
+                self.muted_mask |= 1 << slot
+            else:
+                self.muted_mask &= ~(1 << slot)
+            self._changed()
+
+    # a member blocked or unblocked someone
+    def set_blocked(self, user, sender, blocked):
+        '''
+        add (or remove) a member from the set of users who blocked sender.
+        call after User.block() / User.unblock().
+
+        parameters
+        -----------
+        - user = User() object
+        - sender = '' (name of the user they blocked)
+        - blocked = bool
+        '''
+        with self.lock:
+            if self.clients.get(user.name) is user:
+                self._set_blocked(self.slot_of[user.name], sender, blocked)
+
+    def _set_blocked(self, slot, sender, blocked):
+        # caller holds self.lock. 
+        # every sender with an entry in blocked_by holds one reference to their id
+        id = USER_IDS.id_of(sender)
+        if blocked:
+            if id is None or id not in self.blocked_by:
+                id = USER_IDS.acquire(sender)
+                if self.blocked_by is NO_BLOCKS:
+                    self.blocked_by = {}
+                self.blocked_by[id] = 0
+            self.blocked_by[id] |= 1 << slot
+        elif id in self.blocked_by:
+            mask = self.blocked_by[id] & ~(1 << slot)
+            if mask:
+                self.blocked_by[id] = mask
+            else:
+                del self.blocked_by[id]
+                USER_IDS.release(sender)
+
+    def _changed(self):
+        # caller holds self.lock. slots or masks changed, so the snapshots
+        # are rebuilt the next time someone reads them
+        self._view = None
+        self._recipients = None
+
+    def _removed(self, client, was_recipient):
+        # caller holds self.lock. a leave doesn't change anyone else's 
+        # order, so a current recipients snapshot is patched instead of 
+        # rebuilt: one C-level copy without client, no select() over 
+        # every slot. the view is only rebuilt if something asks for it
+        self._view = None
+        recipients = self._recipients
+        if recipients is not None and was_recipient:
+            index = recipients.index(client)
+            self._recipients = recipients[:index] + recipients[index + 1:]
+
+    def _snapshot(self):
+        # rebuilds whichever snapshots are out of date. returns (view, recipients)
+        with self.lock:
+            if self._view is None:
+                self._view = (tuple(self.slots), self.member_mask & ~self.muted_mask)
+            if self._recipients is None:
+                self._recipients = tuple(select(*self._view))
+            return self._view, self._recipients
+
+    @property
+    def view(self):
+        '''
+        (slots, recipient_mask): slots is a tuple, index is the slot, value
+        is the User() object in it (or None). recipient_mask is the members
+        who haven't muted the room.
+        '''
+        view = self._view
+        return view if view is not None else self._snapshot()[0]
+
+    @property
+    def recipients(self):
+        '''
+        tuple of the User() objects who haven't muted this room
+        '''
+        recipients = self._recipients
+        return recipients if recipients is not None else self._snapshot()[1]
+
+    # members who blocked a sender
+    def blockers(self, sender):
+        '''
+        returns a tuple of the User() objects in this room who blocked sender
+        '''
+        id = USER_IDS.id_of(sender)
+        mask = self.blocked_by.get(id, 0) if id is not None else 0
+        return tuple(select(self.view[0], mask))
+
+    # who a message from sender goes to
+    def recipients_for(self, sender):
+        '''
+        returns an iterable of the User() objects that should get a message
+        from sender: members who haven't muted this room or blocked sender.
+
+        parameters
+        -----------
+        - sender = ''
+        '''
+        id = USER_IDS.id_of(sender)
+        blocked = self.blocked_by.get(id) if id is not None else None
+        if not blocked:
+            return self.recipients
+        slots, recipient_mask = self.view
+        return select(slots, recipient_mask & ~blocked)
+
+    # keep a message in this room's history
+    def record(self, sender, frame):
+        '''
+        parameters
+        -----------
+        - sender = '' (name of the user who sent it)
+        - frame = bytes (the message as it was sent to the room)
+        '''
+        history = self.history
+        if history is None:
+            with self.lock:
+                if self.history is None:
+                    self.history = RingBuffer()
+                history = self.history
+        history.append(sender, frame)
+
+    # the last few messages sent to this room
+    def recent(self, count, user=None):
+        '''
+        returns the last count messages (list of bytes), oldest first.
+        leaves out messages from anyone user has blocked.
+
+        parameters
+        -----------
+        - count = int
+        - user = User() object (optional)
+        '''
+        if self.history is None:
+            return []
+        entries = self.history.last(count)
+        if user is None:
+            return [frame for _, frame in entries]
+        return [frame for sender, frame in entries if not user.has_blocked(sender)]
 
     # send a message to all users in chatroom
     def message_all_clients(self, sender, message):
@@ -70,12 +355,10 @@ class Chatroom:
         - sender = ''
         - message = ''
         '''
-        if len(self.clients) > 0:
-            for user in self.clients:
-                if self.clients[user].has_blocked(sender):
-                    continue
-                elif self.clients[user].has_muted(self.name):
-                    continue
-                self.clients[user].send(message.encode('ascii'))
+        if len(self.recipients) > 0:
+            # encode once, every recipient gets the same bytes object
+            frame = message.encode('ascii')
+            for user in self.recipients_for(sender):
+                user.send(frame)
         else:
-            ...
\ No newline at end of file
+            ...
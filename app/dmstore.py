@@ -0,0 +1,373 @@
+'''
+dm store module. keeps direct messages for users who aren't connected.
+
+a DMStore() is a SQLite database in WAL mode. WAL lets several worker
+processes share one database file, and readers never wait for the
+writer, so every worker can point at the same store.
+
+nothing here writes to the database on the caller's thread. save() only
+adds the message to an in-memory list, and take() only asks for a
+user's messages to be handed back later. a writer thread runs
+everything asked for in the last flush_interval seconds, in order: the
+saves in between two take()s go in as one batched insert, one
+transaction, and each take() reads up to take_limit of a user's oldest
+messages and passes them to its callback (on the writer thread, or
+wherever a dispatch runs it). only the messages the callback says it
+handled are deleted, in the same transaction, so nothing is lost if the
+callback can't deliver them all.
+
+only users the store knows get messages kept for them: remember() a
+user when they connect, and save() turns down messages for anyone else.
+a name this process hasn't seen is looked up in the database (a read,
+which never waits for the writer), so users who connected to another
+process sharing the store count too. a receiver keeps at most
+max_messages, the newest ones. like an Inbox(), messages older than ttl
+seconds expire: they're never handed back, and the writer deletes them
+(and users who haven't connected for that long) at most once every
+sweep_interval seconds.
+'''
+
+import sqlite3
+import threading
+import time
+
+from app.inbox import TTL
+
+# defaults
+FLUSH_INTERVAL = 0.01
+SWEEP_INTERVAL = 60.0
+# most messages one take() hands back
+TAKE_LIMIT = 500
+# most messages kept per receiver
+MAX_MESSAGES = 1000
+# ms a writer waits for another process's transaction before giving up
+BUSY_TIMEOUT = 5000
+# seconds the writer waits before retrying a batch that failed
+RETRY_INTERVAL = 1.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dms (
+    id INTEGER PRIMARY KEY,
+    receiver TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT NOT NULL,
+    sent REAL NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS dms_receiver ON dms (receiver, id);
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    seen REAL NOT NULL
+);
+'''
+
+
+class DMStore:
+    '''
+    direct messages waiting for their receivers, in a SQLite database.
+    thread-safe, and safe to share between processes.
+
+    a stored message is (sender, message, sent, seen): sent is when it
+    was sent (seconds since the epoch) and seen is True for messages the
+    receiver already had in their inbox when they disconnected.
+
+    parameters
+    -----------
+    - path = '' (database file, created if it doesn't exist)
+    - flush_interval = float (most seconds a save() or take() waits)
+    - ttl = float (seconds a message is kept, None to keep them forever)
+    - sweep_interval = float (most seconds between deleting old messages)
+    - take_limit = int (most messages one take() hands back)
+    - max_messages = int (most messages kept per receiver)
+    - dispatch = None (optional callable. dispatch(callback, *args) runs a
+                       take() callback on the right thread, i.e. the event
+                       loop in async mode, and returns its result. default
+                       is to call it on the writer thread)
+    '''
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, ttl=TTL, sweep_interval=SWEEP_INTERVAL,
+                 take_limit=TAKE_LIMIT, max_messages=MAX_MESSAGES, dispatch=None):
+        self.path = path
+        self.dispatch = dispatch
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.take_limit = take_limit
+        self.max_messages = max_messages
+        # transactions are started by hand, see _insert() and _take()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        # WAL only syncs at checkpoints. a crash can lose the last few
+        # commits, but never corrupts the database
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+        # names of users messages are kept for. the sweep reloads it, and
+        # names other processes remembered in between are looked up with
+        # reader, a connection of its own so it never sees the writer's
+        # transactions
+        self.known = {name for name, in self.db.execute('SELECT name FROM users')}
+        self.reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.reader.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+        self.read_lock = threading.Lock()
+        # ('save', row), ('user', row) and ('take', receiver, callback)
+        # waiting for the writer
+        self.pending = []
+        # a take() is waiting, so the batch shouldn't wait to fill up
+        self.urgent = False
+        self.cond = threading.Condition()
+        # held while a batch runs, so batches run in order
+        self.write_lock = threading.Lock()
+        self.swept = time.monotonic()
+        # transactions committed, messages saved and handed back, and
+        # exceptions raised by take() callbacks and the database
+        self.commits = 0
+        self.saved = 0
+        self.taken = 0
+        self.errors = []
+        # messages turned down for unknown receivers, and old ones dropped
+        # to keep receivers under max_messages
+        self.refused = 0
+        self.dropped = 0
+        self.closed = False
+        self.writer = threading.Thread(target=self._run, daemon=True)
+        self.writer.start()
+
+    def remember(self, user_name):
+        '''
+        let messages be kept for user_name (call it when they connect).
+        returns right away.
+        '''
+        with self.cond:
+            self.known.add(user_name)
+            self.pending.append(('user', (user_name, time.time())))
+            if len(self.pending) == 1:
+                self.cond.notify()
+
+    def is_known(self, user_name):
+        '''
+        True if messages can be kept for user_name. names this process
+        hasn't seen are looked up in the database
+        '''
+        if user_name in self.known:
+            return True
+        cutoff = time.time() - self.ttl if self.ttl is not None else float('-inf')
+        with self.read_lock:
+            found = self.reader.execute('SELECT 1 FROM users WHERE name = ? AND seen >= ?',
+                                        (user_name, cutoff)).fetchone()
+        if found is None:
+            return False
+        with self.cond:
+            self.known.add(user_name)
+        return True
+
+    def save(self, receiver, sender, message, sent=None, seen=False):
+        '''
+        store a message for receiver. returns right away: True if it'll be
+        kept, False if the store doesn't know receiver.
+
+        parameters
+        -----------
+        - receiver = ''
+        - sender = ''
+        - message = ''
+        - sent = float (seconds since the epoch. now, by default)
+        - seen = bool
+        '''
+        sent = time.time() if sent is None else sent
+        if not self.is_known(receiver):
+            with self.cond:
+                self.refused += 1
+            return False
+        with self.cond:
+            self.pending.append(('save', (receiver, sender, message, sent, int(seen))))
+            # wake the writer to start a batch
+            if len(self.pending) == 1:
+                self.cond.notify()
+        return True
+
+    def save_many(self, receiver, messages):
+        '''
+        store several (sender, message, sent, seen) messages for receiver,
+        in order. returns right away, with the same result as save().
+        '''
+        if not self.is_known(receiver):
+            with self.cond:
+                self.refused += len(messages)
+            return False
+        with self.cond:
+            self.pending.extend(('save', (receiver, sender, message, sent, int(seen)))
+                                for sender, message, sent, seen in messages)
+            self.cond.notify()
+        return True
+
+    def take(self, receiver, callback):
+        '''
+        hand receiver's oldest messages to callback(receiver, messages,
+        waiting) on the writer thread. returns right away.
+
+        messages is a list of (sender, message, sent, seen), oldest first,
+        at most take_limit of them (empty if there aren't any), and waiting
+        is how many more are stored after those. callback returns how many
+        of messages it handled, counting from the oldest: those are
+        deleted, the rest stay stored. if it raises, they all stay.
+        '''
+        with self.cond:
+            self.pending.append(('take', receiver, callback))
+            self.urgent = True
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed and not self._sweep_due():
+                    self.cond.wait(self.sweep_interval)
+                if self.closed:
+                    return
+                # give the batch flush_interval to fill up
+                if self.pending and not self.urgent:
+                    self.cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                # i.e. another process held the database past busy_timeout.
+                # what didn't commit was put back, so try again in a bit
+                self.errors.append(e)
+                with self.cond:
+                    if not self.closed:
+                        self.cond.wait(RETRY_INTERVAL)
+
+    def flush(self):
+        '''
+        run every save() and take() asked for so far. if the database
+        raises, whatever hadn't committed yet goes back to be run again,
+        and the error is raised
+        '''
+        with self.write_lock:
+            with self.cond:
+                batch = self.pending
+                self.pending = []
+                self.urgent = False
+            # ops in batch[:done] are committed
+            done = 0
+            try:
+                rows = []
+                users = []
+                for index, op in enumerate(batch):
+                    if op[0] == 'save':
+                        rows.append(op[1])
+                    elif op[0] == 'user':
+                        users.append(op[1])
+                    else:
+                        self._insert(rows, users)
+                        done = index
+                        rows = []
+                        users = []
+                        self._take(op[1], op[2])
+                        done = index + 1
+                self._insert(rows, users)
+                done = len(batch)
+                if self._sweep_due():
+                    self._sweep()
+            except sqlite3.Error:
+                if self.db.in_transaction:
+                    self.db.execute('ROLLBACK')
+                with self.cond:
+                    self.pending[:0] = batch[done:]
+                    self.urgent = self.urgent or any(op[0] == 'take' for op in batch[done:])
+                raise
+
+    def _insert(self, rows, users=()):
+        if not rows and not users:
+            return
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.executemany('INSERT OR REPLACE INTO users (name, seen) VALUES (?, ?)', users)
+            self.db.executemany('INSERT INTO dms (receiver, sender, message, sent, seen) VALUES (?, ?, ?, ?, ?)', rows)
+            # only the newest max_messages of each receiver's are kept
+            for receiver in {row[0] for row in rows}:
+                self.dropped += self.db.execute(
+                    'DELETE FROM dms WHERE receiver = ? AND id <= (SELECT id FROM dms WHERE receiver = ? '
+                    'ORDER BY id DESC LIMIT 1 OFFSET ?)', (receiver, receiver, self.max_messages)).rowcount
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        self.commits += 1
+        self.saved += len(rows)
+
+    def _take(self, receiver, callback):
+        # IMMEDIATE, so no other process can take (or add to) them in
+        # between. the callback runs inside the transaction, and only what
+        # it handled is deleted
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            # expired messages are left for the sweep
+            cutoff = time.time() - self.ttl if self.ttl is not None else float('-inf')
+            rows = self.db.execute('SELECT id, sender, message, sent, seen FROM dms WHERE receiver = ? '
+                                   'AND sent >= ? ORDER BY id LIMIT ?', (receiver, cutoff, self.take_limit)).fetchall()
+            waiting = 0
+            if len(rows) == self.take_limit:
+                waiting = self.db.execute('SELECT COUNT(*) FROM dms WHERE receiver = ? AND id > ? AND sent >= ?',
+                                          (receiver, rows[-1][0], cutoff)).fetchone()[0]
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        messages = [(sender, message, sent, bool(seen)) for _, sender, message, sent, seen in rows]
+        try:
+            if self.dispatch is None:
+                handled = callback(receiver, messages, waiting)
+            else:
+                handled = self.dispatch(callback, receiver, messages, waiting)
+            handled = max(0, min(handled, len(rows)))
+            if handled:
+                self.db.execute('DELETE FROM dms WHERE receiver = ? AND id <= ?', (receiver, rows[handled - 1][0]))
+        except Exception as e:
+            self.db.execute('ROLLBACK')
+            self.errors.append(e)
+            return
+        self.db.execute('COMMIT')
+        self.commits += 1
+        self.taken += handled
+
+    def _sweep_due(self):
+        return time.monotonic() - self.swept >= self.sweep_interval
+
+    def _sweep(self):
+        self.swept = time.monotonic()
+        if self.ttl is not None:
+            cutoff = time.time() - self.ttl
+            self.db.execute('DELETE FROM dms WHERE sent < ?', (cutoff,))
+            self.db.execute('DELETE FROM users WHERE seen < ?', (cutoff,))
+        # catch up on users other processes remembered (and forget expired ones)
+        names = {name for name, in self.db.execute('SELECT name FROM users')}
+        with self.cond:
+            self.known = names | {op[1][0] for op in self.pending if op[0] == 'user'}
+
+    def count(self, receiver=None):
+        '''
+        how many messages are stored (for receiver, or for everyone).
+        runs everything pending first, and blocks while it does.
+        '''
+        self.flush()
+        with self.write_lock:
+            if receiver is None:
+                return self.db.execute('SELECT COUNT(*) FROM dms').fetchone()[0]
+            return self.db.execute('SELECT COUNT(*) FROM dms WHERE receiver = ?', (receiver,)).fetchone()[0]
+
+    def close(self):
+        '''
+        run whatever is left, stop the writer thread and close the database.
+        if the database still won't take what's left, it's recorded in errors
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            self.errors.append(e)
+        with self.write_lock:
+            self.db.close()
+        with self.read_lock:
+            self.reader.close()
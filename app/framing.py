@@ -0,0 +1,167 @@
+'''
+framing module. the wire protocol shared by the server and the client.
+
+every message is sent as a 4 byte big-endian length followed by that many
+bytes of ascii text. TCP is a byte stream, so one recv() can hold several
+messages or only part of one. FrameDecoder() takes whatever recv() hands
+back and returns only complete messages.
+'''
+
+import socket
+import struct
+import time
+
+# 4 byte unsigned length prefix, network byte order
+HEADER = struct.Struct('!I')
+# largest message we'll accept. anything bigger is treated as a bad client.
+MAX_FRAME = 1024 * 1024
+# most buffers a single sendmsg() call will take on linux
+IOV_MAX = 1024
+
+
+class FrameError(ValueError):
+    '''
+    raised when a peer sends a frame larger than the decoder allows
+    '''
+
+
+def encode_frame(message):
+    '''
+    returns message (bytes) with its length prefix attached
+    '''
+    return HEADER.pack(len(message)) + message
+
+
+def send_buffers(sock, buffers):
+    '''
+    writes a list of bytes objects to sock without joining them first, 
+    using sendmsg() (one syscall for many buffers) where it's available.
+    partial writes are picked up where they left off.
+
+    lets the same message bytes be shared between every recipient of 
+    a broadcast instead of copied once per recipient.
+
+    returns the number of write calls it took.
+    '''
+    # no sendmsg() on windows
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return 1
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    calls = 0
+    while views:
+        calls += 1
+        sent = sock.sendmsg(views[:IOV_MAX])
+        # drop whatever was fully written, trim what was partly written
+        done = 0
+        while done < len(views) and sent >= len(views[done]):
+            sent -= len(views[done])
+            done += 1
+        del views[:done]
+        if sent:
+            views[0] = views[0][sent:]
+    return calls
+
+
+class FrameDecoder:
+    '''
+    incremental decoder for length-prefixed frames.
+
+    feed() it raw bytes as they arrive and it returns a (possibly empty)
+    list of complete messages. partial frames are kept until the rest shows up.
+    '''
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        '''
+        add data (bytes) to the buffer and return a list of complete messages (list[bytes])
+        '''
+        self.buffer += data
+        messages = []
+        start = 0
+        end = len(self.buffer)
+        while end - start >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, start)
+            if length > self.max_frame:
+                raise FrameError(f'frame of {length} bytes is larger than {self.max_frame}')
+            if end - start - HEADER.size < length:
+                break
+            start += HEADER.size
+            messages.append(bytes(self.buffer[start:start + length]))
+            start += length
+        # drop everything we've consumed in one go
+        if start:
+            del self.buffer[:start]
+        return messages
+
+    def pending(self):
+        '''
+        number of bytes buffered that aren't a complete message yet
+        '''
+        return len(self.buffer)
+
+
+class FramedSocket:
+    '''
+    wraps a socket() object so .send() frames each message, and
+    .recv_messages() returns whole messages. anything else (connect, close,
+    shutdown, fileno, ...) is passed through to the wrapped socket.
+
+    writes counts the write syscalls made, and messages_sent the messages
+    they carried.
+    '''
+    def __init__(self, sock, max_frame=MAX_FRAME):
+        self.socket = sock
+        self.decoder = FrameDecoder(max_frame)
+        self.writes = 0
+        self.messages_sent = 0
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+    def send(self, message):
+        '''
+        send one message (bytes). the whole frame is always written,
+        and message itself is never copied.
+        '''
+        self.writes += send_buffers(self.socket, [HEADER.pack(len(message)), message])
+        self.messages_sent += 1
+        return len(message)
+
+    def send_many(self, messages):
+        '''
+        send several messages (list of bytes) in one write. each one is
+        still its own frame, so the peer can't tell the difference.
+        '''
+        buffers = []
+        for message in messages:
+            buffers.append(HEADER.pack(len(message)))
+            buffers.append(message)
+        self.writes += send_buffers(self.socket, buffers)
+        self.messages_sent += len(messages)
+        return sum(map(len, messages))
+
+    def recv_messages(self, buffer_max, deadline=None):
+        '''
+        block until at least one complete message has arrived.
+        returns a list of messages (list[bytes]), or an empty list
+        if the peer closed the connection.
+
+        given a deadline (a time.monotonic() value), raises socket.timeout
+        if no complete message has arrived by then, however the bytes are
+        trickled in. a socket timeout on its own only bounds each recv().
+        '''
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout('no complete message before the deadline')
+                self.socket.settimeout(remaining)
+            data = self.socket.recv(buffer_max)
+            if not data:
+                return []
+            messages = self.decoder.feed(data)
+            if messages:
+                return messages
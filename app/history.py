@@ -0,0 +1,78 @@
+'''
+history module. bounded scrollback for chatrooms.
+
+a RingBuffer() keeps the most recent items written to it, up to a fixed
+number of them and a fixed number of bytes, whichever runs out first.
+its slots are allocated once, up front, and old items are overwritten
+in place, so a busy room costs no more memory than a quiet one.
+'''
+
+import threading
+
+# defaults: lines kept per room, and total bytes of those lines
+HISTORY_LINES = 100
+HISTORY_BYTES = 32 * 1024
+
+
+class RingBuffer:
+    '''
+    fixed-capacity buffer of the newest (key, data) entries. thread-safe.
+
+    data is bytes, and counts against max_bytes. key is anything the
+    caller wants to keep with it (the room uses the sender's name).
+    an entry bigger than max_bytes on its own isn't kept at all.
+
+    parameters
+    -----------
+    - capacity = int (most entries kept)
+    - max_bytes = int (most bytes of data kept)
+    '''
+    def __init__(self, capacity=HISTORY_LINES, max_bytes=HISTORY_BYTES):
+        if capacity < 1:
+            raise ValueError('a RingBuffer needs room for at least one entry')
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        # preallocated slots. index of the oldest entry, and how many there are
+        self.slots = [None] * capacity
+        self.start = 0
+        self.count = 0
+        # bytes of data currently held
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, key, data):
+        '''
+        add an entry, dropping the oldest ones to make room for it
+        '''
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            # drop from the front until it fits by bytes and by count
+            while self.count and (self.size + len(data) > self.max_bytes or self.count == self.capacity):
+                self.size -= len(self.slots[self.start][1])
+                self.slots[self.start] = None
+                self.start = (self.start + 1) % self.capacity
+                self.count -= 1
+            self.slots[(self.start + self.count) % self.capacity] = (key, data)
+            self.count += 1
+            self.size += len(data)
+
+    def last(self, n=None):
+        '''
+        returns the newest n entries (all of them by default), oldest
+        first, as a list of (key, data) tuples
+        '''
+        with self.lock:
+            n = self.count if n is None else max(0, min(n, self.count))
+            first = self.start + self.count - n
+            return [self.slots[i % self.capacity] for i in range(first, first + n)]
+
+    def clear(self):
+        with self.lock:
+            self.slots = [None] * self.capacity
+            self.start = 0
+            self.count = 0
+            self.size = 0
@@ -0,0 +1,115 @@
+'''
+ids module. dense integer ids for names, and bitmap helpers.
+
+an Interner() hands out small integer ids for names, reusing ids that
+have been released, so ids stay dense. bitmaps are plain python ints
+(bit i set = item i is in the set). and/or/not on them run in C over
+whole machine words, and select() turns one back into the items it
+covers without a python-level loop over every item.
+'''
+
+import itertools
+import threading
+
+
+class Interner:
+    '''
+    reference counted name <-> dense integer id table. thread-safe.
+
+    acquire() a name to get its id (assigning one if needed) and release()
+    it when done. once every acquire() has been released the id is freed
+    and will be given to the next new name.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key is name (str), value is id (int)
+        self.ids = {}
+        # index is id. name (or None if the id is free) and reference count
+        self.names = []
+        self.refs = []
+        # released ids, reused before new ones are made
+        self.free = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def acquire(self, name):
+        '''
+        returns name's id, assigning one if it doesn't have one yet
+        '''
+        with self.lock:
+            id = self.ids.get(name)
+            if id is None:
+                if self.free:
+                    id = self.free.pop()
+                    self.names[id] = name
+                    self.refs[id] = 0
+                else:
+                    id = len(self.names)
+                    self.names.append(name)
+                    self.refs.append(0)
+                self.ids[name] = id
+            self.refs[id] += 1
+            return id
+
+    def release(self, name):
+        '''
+        drop one reference to name. frees its id after the last one.
+        '''
+        with self.lock:
+            id = self.ids.get(name)
+            if id is None:
+                return
+            self.refs[id] -= 1
+            if self.refs[id] <= 0:
+                del self.ids[name]
+                self.names[id] = None
+                self.refs[id] = 0
+                self.free.append(id)
+
+    def id_of(self, name):
+        '''
+        name's id, or None if it doesn't have one
+        '''
+        return self.ids.get(name)
+
+    def name_of(self, id):
+        '''
+        the name that has this id, or None
+        '''
+        return self.names[id] if 0 <= id < len(self.names) else None
+
+
+# ids for usernames, shared by every room in this process
+USER_IDS = Interner()
+
+
+# EXPAND[b] is 8 bytes, one per bit of b (lowest bit first), each 0 or 1
+EXPAND = tuple(bytes((b >> i) & 1 for i in range(8)) for b in range(256))
+
+
+def select(items, mask):
+    '''
+    iterates items[i] for every bit i set in mask.
+    the work is done by bytes.join() and itertools.compress(), so it
+    costs C-speed steps per item rather than python ones.
+
+    parameters
+    -----------
+    - items = sequence
+    - mask = int (bitmap)
+    '''
+    if not mask:
+        return iter(())
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    return itertools.compress(items, b''.join(map(EXPAND.__getitem__, data)))
+
+
+def bits(mask):
+    '''
+    the positions of every set bit in mask (list[int]), lowest first
+    '''
+    return list(select(range(mask.bit_length()), mask))
@@ -0,0 +1,220 @@
+'''
+inbox module. bounded storage for a user's direct messages.
+
+an Inbox() keeps one Conversation() per sender: a queue of that sender's
+messages, oldest first, holding at most max_messages of them. every
+inbox also has a total budget of max_bytes (message text, over every
+conversation) and max_conversations. when either runs out, whole
+conversations are evicted, least recently used first (a conversation
+is used when a message arrives in it or it's read).
+
+messages older than ttl seconds expire. expiry is lazy: a conversation
+drops its expired messages whenever it's touched, and the whole inbox
+is swept at most once every sweep_interval seconds, when a message
+arrives. nothing runs in the background.
+
+messages are read a page at a time. page 1 is the newest page_size
+messages, page 2 the ones before those, and so on, so reading a
+conversation never sends more than one page at once.
+'''
+
+import time
+from collections import OrderedDict, deque
+
+# defaults
+MAX_MESSAGES = 200              # per conversation
+MAX_BYTES = 256 * 1024          # per inbox
+MAX_CONVERSATIONS = 100         # per inbox
+TTL = 7 * 24 * 60 * 60          # seconds a message is kept
+SWEEP_INTERVAL = 60.0           # seconds between expiry sweeps
+PAGE_SIZE = 10                  # messages per page
+
+
+class Conversation:
+    '''
+    one sender's messages, as (time, message) tuples, oldest first
+    '''
+    __slots__ = ('messages', 'size')
+
+    def __init__(self):
+        self.messages = deque()
+        # characters of message text held
+        self.size = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, stamp, message, max_messages):
+        '''
+        add a message. returns the characters freed by dropping old ones
+        '''
+        freed = 0
+        while len(self.messages) >= max_messages:
+            freed += len(self.messages.popleft()[1])
+        self.messages.append((stamp, message))
+        self.size += len(message) - freed
+        return freed
+
+    def expire(self, cutoff):
+        '''
+        drop messages from before cutoff. returns the characters freed
+        '''
+        freed = 0
+        while self.messages and self.messages[0][0] < cutoff:
+            freed += len(self.messages.popleft()[1])
+        self.size -= freed
+        return freed
+
+    def drop_oldest(self):
+        '''
+        drop the oldest message. returns the characters freed
+        '''
+        freed = len(self.messages.popleft()[1])
+        self.size -= freed
+        return freed
+
+
+class Inbox:
+    '''
+    bounded direct message storage. key is sender name (str).
+
+    not thread-safe on its own: User() guards its inbox with its lock.
+
+    parameters
+    -----------
+    - max_messages = int (most messages kept per conversation)
+    - max_bytes = int (most characters of message text kept in total)
+    - max_conversations = int (most senders kept)
+    - ttl = float (seconds a message is kept, None to keep them forever)
+    - page_size = int (messages per page)
+    - sweep_interval = float (most seconds between expiry sweeps)
+    '''
+    def __init__(self, max_messages=MAX_MESSAGES, max_bytes=MAX_BYTES, max_conversations=MAX_CONVERSATIONS,
+                 ttl=TTL, page_size=PAGE_SIZE, sweep_interval=SWEEP_INTERVAL):
+        if max_messages < 1 or max_conversations < 1 or page_size < 1:
+            raise ValueError('an Inbox needs room for at least one message, conversation, and page entry')
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.page_size = page_size
+        self.sweep_interval = sweep_interval
+        # key is sender, value is Conversation(). least recently used first
+        self.conversations = OrderedDict()
+        # characters of message text held, over every conversation
+        self.size = 0
+        self.swept = time.monotonic()
+        # conversations evicted to stay under the caps, and messages expired
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.conversations)
+
+    def __contains__(self, sender):
+        return sender in self.conversations
+
+    def __iter__(self):
+        return iter(self.conversations)
+
+    def __getitem__(self, sender):
+        '''
+        every message kept from sender (list[str]), oldest first
+        '''
+        return [message for _, message in self.conversations[sender].messages]
+
+    def keys(self):
+        return self.conversations.keys()
+
+    def add(self, sender, message, now=None):
+        '''
+        store a message from sender, evicting and expiring as needed
+        '''
+        now = time.monotonic() if now is None else now
+        if self.ttl is not None and now - self.swept >= self.sweep_interval:
+            self.expire(now)
+        conversation = self.conversations.get(sender)
+        if conversation is None:
+            conversation = self.conversations[sender] = Conversation()
+        else:
+            self.conversations.move_to_end(sender)
+        self.size += len(message) - conversation.append(now, message, self.max_messages)
+        self._evict(sender)
+
+    def _evict(self, keep):
+        # least recently used conversations go first, but never the one
+        # just written to. if it's too big by itself, it loses old messages
+        while len(self.conversations) > self.max_conversations or self.size > self.max_bytes:
+            oldest = next(iter(self.conversations))
+            if oldest != keep:
+                self.size -= self.conversations.pop(oldest).size
+                self.evicted += 1
+            elif len(self.conversations[keep]) > 1:
+                self.size -= self.conversations[keep].drop_oldest()
+            else:
+                break
+
+    def expire(self, now=None):
+        '''
+        drop every message older than ttl, and conversations left empty
+        '''
+        now = time.monotonic() if now is None else now
+        self.swept = now
+        if self.ttl is None:
+            return
+        for sender in list(self.conversations):
+            self._expire(sender, now)
+
+    def _expire(self, sender, now):
+        conversation = self.conversations[sender]
+        before = len(conversation)
+        self.size -= conversation.expire(now - self.ttl)
+        self.expired += before - len(conversation)
+        if not conversation.messages:
+            del self.conversations[sender]
+
+    def entries(self):
+        '''
+        every message kept, as (sender, time, message) tuples: least
+        recently used conversation first, each one oldest first
+        '''
+        return [(sender, stamp, message) for sender, conversation in self.conversations.items()
+                for stamp, message in conversation.messages]
+
+    def pages(self, sender):
+        '''
+        number of pages of messages from sender
+        '''
+        conversation = self.conversations.get(sender)
+        return 0 if conversation is None else -(-len(conversation) // self.page_size)
+
+    def page(self, sender, number=1, now=None):
+        '''
+        returns (messages, pages): page number of sender's messages (list
+        of str, oldest first) and how many pages there are in all.
+        page 1 is the newest. messages is empty past the last page.
+        '''
+        now = time.monotonic() if now is None else now
+        if sender not in self.conversations:
+            return [], 0
+        if self.ttl is not None:
+            self._expire(sender, now)
+            if sender not in self.conversations:
+                return [], 0
+        self.conversations.move_to_end(sender)
+        messages = self.conversations[sender].messages
+        end = len(messages) - (number - 1) * self.page_size
+        start = max(end - self.page_size, 0)
+        page = [messages[i][1] for i in range(start, end)] if number >= 1 and end > 0 else []
+        return page, self.pages(sender)
+
+    def summary(self, now=None):
+        '''
+        returns (sender, message count, newest message) for every
+        conversation, most recently used first
+        '''
+        now = time.monotonic() if now is None else now
+        if self.ttl is not None:
+            self.expire(now)
+        return [(sender, len(conversation), conversation.messages[-1][1])
+                for sender, conversation in reversed(self.conversations.items())]
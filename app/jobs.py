@@ -0,0 +1,114 @@
+'''
+jobs module. a fixed-size worker pool for running commands.
+
+normally every client's own thread (or coroutine) reads, parses and runs
+its commands, so CPU work scales with the number of connections.
+with a CommandPool() the readers only decode frames and submit jobs, and
+a fixed number of worker threads run them.
+
+every job has a key (the username). jobs with the same key always go to
+the same worker, in the order they were submitted, so a user's commands
+still run one at a time and in order.
+'''
+
+import queue
+import threading
+import time
+
+# default max jobs waiting per worker
+MAX_QUEUE = 1000
+
+
+class CommandPool:
+    '''
+    bounded pool of worker threads.
+
+    parameters
+    -----------
+    - workers = int (number of worker threads)
+    - max_queue = int (max jobs waiting per worker. submit() blocks or
+                       refuses jobs past this)
+    - on_error = None (optional callable on_error(key, error), called when
+                       a job raises. default is to print the error)
+    '''
+    def __init__(self, workers=4, max_queue=MAX_QUEUE, on_error=None):
+        if workers < 1:
+            raise ValueError('a CommandPool needs at least one worker')
+        self.max_queue = max_queue
+        self.on_error = on_error
+        self.queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        # per worker: seconds spent running jobs, and jobs finished
+        self.busy = [0.0] * workers
+        self.done = [0] * workers
+        self.started = time.monotonic()
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work, args=(index,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def lane(self, key):
+        '''
+        index of the worker that runs every job for this key
+        '''
+        return hash(key) % len(self.queues)
+
+    def submit(self, key, func, *args, block=True):
+        '''
+        queue func(*args) to run on key's worker.
+
+        returns True once queued. if that worker's queue is full, waits for
+        room when block is True, otherwise returns False right away.
+        '''
+        try:
+            self.queues[self.lane(key)].put((key, func, args), block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def _work(self, index):
+        jobs = self.queues[index]
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            key, func, args = job
+            start = time.monotonic()
+            try:
+                func(*args)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(key, e)
+                else:
+                    print(f'job for {key} failed: {e!r}')
+            self.busy[index] += time.monotonic() - start
+            self.done[index] += 1
+
+    def stats(self):
+        '''
+        returns a dictionary describing the pool:
+
+        - "Workers": number of worker threads
+        - "Queue Depth": jobs waiting, per worker (list[int])
+        - "Max Queue": max jobs waiting per worker
+        - "Jobs Done": jobs finished so far
+        - "Utilization": fraction of time each worker has spent running
+                         jobs since the pool started (list[float])
+        '''
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "Workers": len(self.queues),
+            "Queue Depth": [jobs.qsize() for jobs in self.queues],
+            "Max Queue": self.max_queue,
+            "Jobs Done": sum(self.done),
+            "Utilization": [round(min(busy / elapsed, 1.0), 3) for busy in self.busy],
+        }
+
+    def stop(self):
+        '''
+        let every worker finish what's queued, then stop them
+        '''
+        for jobs in self.queues:
+            jobs.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,517 @@
+'''
+message log module. durable, append-only history for every room.
+
+each room gets its own directory of segment files. a segment is named
+after the sequence number of its first record, only ever appended to,
+and sealed once it reaches segment_bytes, when a new one is started.
+a record is:
+
+    seq (8 bytes) | time (8 bytes) | sender length (2) | frame length (4) | sender | frame
+
+append() only adds the record to an in-memory list, so it's as cheap
+as a list append for whoever is sending the message. a writer thread
+commits everything appended in the last flush_interval seconds (or
+sooner, once flush_bytes are waiting) as one write, and one fsync, per
+room. that's group commit: the cost of hitting the disk is shared by
+every message in the batch.
+
+reads memory-map the segments and hand back memoryviews into them, so
+old messages are never copied on their way out. they only see what's
+already been committed: the writer writes and fsyncs without holding the
+lock reads take, and only then publishes the new size and index under
+it, so a read never waits for (or forces) a write. every segment keeps a
+sparse index (the offset of every index_every'th record), so finding a
+sequence number is a binary search plus a short scan.
+
+logs are recovered when a room is first used after a restart. a record
+cut short by a crash is truncated away.
+
+every open append file and every mapping holds a file descriptor, so
+there's only ever max_open of them. they're kept in one least recently
+used list, shared by every room, and whatever falls off the end of it is
+closed. it's reopened the next time it's needed.
+'''
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+# seq, time, sender length, frame length. network byte order
+RECORD = struct.Struct('!QdHI')
+# defaults
+SEGMENT_BYTES = 16 * 1024 * 1024
+FLUSH_INTERVAL = 0.005
+FLUSH_BYTES = 256 * 1024
+INDEX_EVERY = 64
+# open append files and mappings kept, over every room
+MAX_OPEN = 128
+SUFFIX = '.log'
+
+
+class Segment:
+    '''
+    one segment file. base is the seq of its first record.
+    index is a list of (seq, offset) for every index_every'th record.
+    size, count and index only cover committed records.
+    '''
+    def __init__(self, path, base):
+        self.path = path
+        self.base = base
+        self.size = 0
+        self.count = 0
+        self.index = []
+        # read-only mapping of the first mapped_size bytes, made on demand
+        self.map = None
+        self.mapped_size = 0
+
+    def view(self):
+        '''
+        memoryview of everything written to this segment so far
+        '''
+        if self.size == 0:
+            return memoryview(b'')
+        if self.map is None or self.mapped_size != self.size:
+            # a growing segment is remapped
+            self.unmap()
+            with open(self.path, 'rb') as file:
+                self.map = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+            self.mapped_size = self.size
+        return memoryview(self.map)
+
+    def unmap(self):
+        '''
+        close the mapping, if there is one. a mapping someone still has
+        views into can't be closed yet: it's dropped, and closes by
+        itself once the last of them is gone.
+        '''
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+            self.map = None
+            self.mapped_size = 0
+
+
+class Handles:
+    '''
+    least recently used list of open append files and mappings, shared by
+    every RoomLog() of a MessageLog(). thread-safe.
+
+    an entry is (RoomLog(), None) for a room's append file, and (RoomLog(),
+    Segment()) for a segment's mapping. use() hands back the entries that
+    fell off the end, for the caller to close once it isn't holding any
+    room's lock (see RoomLog.release()).
+
+    parameters
+    -----------
+    - limit = int (most entries kept open)
+    '''
+    def __init__(self, limit=MAX_OPEN):
+        if limit < 1:
+            raise ValueError('Handles needs room for at least one open file')
+        self.limit = limit
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # entries closed to stay under the limit
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def use(self, log, segment=None):
+        '''
+        mark an entry as just used. returns the entries to close, least
+        recently used first (list of (RoomLog(), Segment() or None))
+        '''
+        key = (log, segment)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return []
+            self.entries[key] = None
+            evicted = []
+            while len(self.entries) > self.limit:
+                evicted.append(self.entries.popitem(last=False)[0])
+            self.evicted += len(evicted)
+            return evicted
+
+    def forget(self, log, segment=None):
+        '''
+        drop an entry that was closed by its owner
+        '''
+        with self.lock:
+            self.entries.pop((log, segment), None)
+
+
+class RoomLog:
+    '''
+    the segments for one room. only MessageLog() should use these.
+
+    parameters
+    -----------
+    - directory = '' (this room's directory)
+    - segment_bytes = int
+    - index_every = int
+    - sync = bool (fsync after every commit)
+    - handles = Handles() object (open files and mappings, shared with
+                the other rooms. one of its own by default)
+    '''
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, index_every=INDEX_EVERY, sync=True,
+                 handles=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_every = index_every
+        self.sync = sync
+        self.handles = handles if handles is not None else Handles()
+        self.segments = []
+        # file the newest segment is appended through
+        self.file = None
+        # the seq the next committed record gets
+        self.next_seq = 0
+        # held by reads, and by the writer only to publish what it committed
+        self.lock = threading.Lock()
+        # held by the writer for the whole write, and by whoever closes file
+        self.file_lock = threading.Lock()
+        # file fell off the Handles() list in the middle of a write
+        self.file_evicted = False
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        # records that were already on disk
+        self.recovered = self.next_seq
+
+    def _recover(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SUFFIX))
+        for name in names:
+            segment = Segment(os.path.join(self.directory, name), int(name[:-len(SUFFIX)]))
+            segment.size = os.path.getsize(segment.path)
+            valid = self._scan(segment)
+            if valid != segment.size:
+                # a partial record from a crash. only the newest segment can have one
+                os.truncate(segment.path, valid)
+                segment.size = valid
+            # mapped again by the first read() that needs it
+            segment.unmap()
+            self.segments.append(segment)
+            if segment.count:
+                self.next_seq = segment.base + segment.count
+
+    def _scan(self, segment):
+        # rebuild the segment's index. returns how many bytes hold whole records
+        data = segment.view()
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            seq, _, sender_length, frame_length = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + sender_length + frame_length
+            if end > len(data):
+                break
+            if segment.count % self.index_every == 0:
+                segment.index.append((seq, offset))
+            segment.count += 1
+            offset = end
+        data.release()
+        return offset
+
+    def _roll(self):
+        # start a new segment at the next seq
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.directory, f'{self.next_seq:020}{SUFFIX}')
+        self.file = open(path, 'ab')
+        with self.lock:
+            self.segments.append(Segment(path, self.next_seq))
+
+    def write(self, records):
+        '''
+        append a batch of (time, sender, frame) records, with as few
+        writes as segment boundaries allow, then fsync once. only one
+        thread may write at a time (MessageLog() has a single writer).
+        '''
+        with self.file_lock:
+            if self.file is None:
+                if self.segments and self.segments[-1].size < self.segment_bytes:
+                    self.file = open(self.segments[-1].path, 'ab')
+                else:
+                    self._roll()
+            evicted = self.handles.use(self)
+            self.file_evicted = False
+            segment = self.segments[-1]
+            # nothing else changes these, so they're read without the lock.
+            # the new records only reach segment once they're committed
+            seq = self.next_seq
+            count = segment.count
+            buffer = bytearray()
+            index = []
+            for stamp, sender, frame in records:
+                sender = sender.encode('ascii')
+                size = RECORD.size + len(sender) + len(frame)
+                if segment.size + len(buffer) + size > self.segment_bytes and segment.size + len(buffer) > 0:
+                    self._commit(segment, buffer, index, count, seq)
+                    buffer = bytearray()
+                    index = []
+                    self._roll()
+                    segment = self.segments[-1]
+                    count = 0
+                if count % self.index_every == 0:
+                    index.append((seq, segment.size + len(buffer)))
+                buffer += RECORD.pack(seq, stamp, len(sender), len(frame))
+                buffer += sender
+                buffer += frame
+                count += 1
+                seq += 1
+            self._commit(segment, buffer, index, count, seq)
+            # see release()
+            if self.file_evicted:
+                self.file.close()
+                self.file = None
+        self.release(evicted)
+
+    def _commit(self, segment, buffer, index, count, next_seq):
+        # the write and fsync happen outside the lock, so reads never wait on them
+        self.file.write(buffer)
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        with self.lock:
+            segment.size += len(buffer)
+            segment.count = count
+            segment.index.extend(index)
+            self.next_seq = next_seq
+
+    def read(self, start, count):
+        '''
+        returns up to count records starting at seq start, as a list of
+        (seq, time, sender, frame). sender and frame are memoryviews into
+        the mapped segments, nothing is copied.
+        '''
+        records = []
+        evicted = []
+        with self.lock:
+            start = max(start, 0)
+            bases = [segment.base for segment in self.segments]
+            position = max(bisect.bisect_right(bases, start) - 1, 0)
+            for segment in self.segments[position:]:
+                if len(records) >= count:
+                    break
+                if not segment.count:
+                    continue
+                data = segment.view()
+                evicted += self.handles.use(self, segment)
+                # jump to the last indexed record at or before start
+                point = bisect.bisect_right(segment.index, (start, float('inf'))) - 1
+                offset = segment.index[point][1] if point >= 0 else 0
+                while offset < len(data) and len(records) < count:
+                    seq, stamp, sender_length, frame_length = RECORD.unpack_from(data, offset)
+                    body = offset + RECORD.size
+                    end = body + sender_length + frame_length
+                    if seq >= start:
+                        records.append((seq, stamp, data[body:body + sender_length],
+                                        data[body + sender_length:end]))
+                    offset = end
+        self.release(evicted)
+        return records
+
+    @staticmethod
+    def release(evicted):
+        '''
+        close the (RoomLog(), Segment() or None) entries Handles.use()
+        handed back. never called while holding a room's lock: it takes
+        each entry's room lock in turn, so two rooms closing each other's
+        files can't deadlock. an append file in the middle of a write is
+        left for its writer to close, so this never waits on an fsync.
+        '''
+        for log, segment in evicted:
+            if segment is not None:
+                with log.lock:
+                    segment.unmap()
+            elif log.file_lock.acquire(blocking=False):
+                try:
+                    if log.file is not None:
+                        log.file.close()
+                        log.file = None
+                finally:
+                    log.file_lock.release()
+            else:
+                log.file_evicted = True
+
+    def close(self):
+        '''
+        close the append file and every mapping
+        '''
+        with self.file_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.handles.forget(self)
+        with self.lock:
+            for segment in self.segments:
+                segment.unmap()
+                self.handles.forget(self, segment)
+
+
+class MessageLog:
+    '''
+    per-room append-only logs under one directory, with a group commit
+    writer thread. thread-safe.
+
+    parameters
+    -----------
+    - directory = '' (created if it doesn't exist)
+    - segment_bytes = int (size a segment is sealed at)
+    - flush_interval = float (most seconds a message waits to be written)
+    - flush_bytes = int (write sooner once this many bytes are waiting)
+    - index_every = int (records between sparse index entries)
+    - sync = bool (fsync every commit. turn off for speed over durability)
+    - max_open = int (most append files and mappings open at once, over
+                 every room)
+    '''
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, flush_interval=FLUSH_INTERVAL,
+                 flush_bytes=FLUSH_BYTES, index_every=INDEX_EVERY, sync=True, max_open=MAX_OPEN):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.index_every = index_every
+        self.sync = sync
+        self.handles = Handles(max_open)
+        os.makedirs(directory, exist_ok=True)
+        # key is room name, value is RoomLog()
+        self.rooms = {}
+        self.rooms_lock = threading.Lock()
+        # (room name, time, sender, frame) waiting to be written
+        self.pending = []
+        # key is room name, value is how many messages were appended to it
+        # since this log was opened (written or not)
+        self.appended = {}
+        self.pending_bytes = 0
+        self.cond = threading.Condition()
+        # held while a batch is being written, so batches land in order
+        self.write_lock = threading.Lock()
+        # group commits made, and records they held
+        self.commits = 0
+        self.records = 0
+        self.closed = False
+        self.writer = threading.Thread(target=self._run, daemon=True)
+        self.writer.start()
+
+    def room(self, room_name):
+        '''
+        the RoomLog() for a room, opening (and recovering) it if needed
+        '''
+        log = self.rooms.get(room_name)
+        if log is None:
+            with self.rooms_lock:
+                log = self.rooms.get(room_name)
+                if log is None:
+                    # room names can hold any character, so they're quoted for the filesystem
+                    path = os.path.join(self.directory, quote(room_name, safe=''))
+                    log = self.rooms[room_name] = RoomLog(path, self.segment_bytes, self.index_every,
+                                                          self.sync, self.handles)
+        return log
+
+    def append(self, room_name, sender, frame):
+        '''
+        log a message sent to a room. returns right away, the message is
+        written by the next group commit.
+
+        parameters
+        -----------
+        - room_name = ''
+        - sender = ''
+        - frame = bytes (the message as it was sent)
+        '''
+        with self.cond:
+            if self.closed:
+                return
+            self.pending.append((room_name, time.time(), sender, frame))
+            self.pending_bytes += len(frame)
+            self.appended[room_name] = self.appended.get(room_name, 0) + 1
+            # wake the writer to start a batch, or to write a full one now
+            if len(self.pending) == 1 or self.pending_bytes >= self.flush_bytes:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                # give the batch flush_interval to fill up
+                deadline = time.monotonic() + self.flush_interval
+                while not self.closed and self.pending_bytes < self.flush_bytes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            self.flush()
+
+    def flush(self):
+        '''
+        write (and fsync) everything appended so far
+        '''
+        with self.write_lock:
+            with self.cond:
+                batch = self.pending
+                self.pending = []
+                self.pending_bytes = 0
+            if not batch:
+                return
+            by_room = {}
+            for room_name, stamp, sender, frame in batch:
+                by_room.setdefault(room_name, []).append((stamp, sender, frame))
+            for room_name, records in by_room.items():
+                self.room(room_name).write(records)
+            self.commits += 1
+            self.records += len(batch)
+
+    def read(self, room_name, start, count):
+        '''
+        returns up to count of a room's committed messages from seq start
+        on, as a list of (seq, time, sender, frame), sender and frame being
+        memoryviews into the log (see RoomLog.read())
+        '''
+        return self.room(room_name).read(start, count)
+
+    def tail(self, room_name, count):
+        '''
+        a room's last count committed messages, oldest first. same format
+        as read()
+        '''
+        log = self.room(room_name)
+        return log.read(log.next_seq - count, count)
+
+    def older(self, room_name, skip, count):
+        '''
+        up to count of a room's committed messages from before its newest
+        skip (counting the ones not written yet), oldest first. same format
+        as read(). for someone who already has the newest skip messages
+        from somewhere else, like the room's own history.
+        '''
+        log = self.room(room_name)
+        with self.cond:
+            total = log.recovered + self.appended.get(room_name, 0)
+        end = min(total - skip, log.next_seq)
+        if end <= 0 or count <= 0:
+            return []
+        start = max(end - count, 0)
+        return log.read(start, end - start)
+
+    def close(self):
+        '''
+        write whatever is left, stop the writer thread, and close every
+        room's files and mappings
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        self.flush()
+        with self.rooms_lock:
+            for log in self.rooms.values():
+                log.close()
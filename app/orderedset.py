@@ -0,0 +1,95 @@
+'''
+ordered set module.
+
+an OrderedSet() is a set that remembers insertion order, with the parts
+of the list interface User() already used (append, remove, [-1], == [...]),
+so it can replace the lists without touching any callers. membership
+checks, appends and removes are all O(1).
+'''
+
+
+class OrderedSet(dict):
+    '''
+    insertion ordered set. it's a dict with every value set to None, so
+    membership checks, len() and iteration run at dict speed, which 
+    matters since has_blocked() and has_muted() run for every recipient
+    of every broadcast.
+
+    parameters
+    -----------
+    - items = iterable (optional starting items, in order)
+    '''
+    def __init__(self, items=()):
+        super().__init__(dict.fromkeys(items))
+
+    def __getitem__(self, index):
+        '''
+        positional lookup, like a list. [0] and [-1] are O(1), anything else is O(n)
+        '''
+        if index == -1 and self:
+            return next(reversed(self))
+        if index == 0 and self:
+            return next(iter(self))
+        return list(self)[index]
+
+    def __eq__(self, other):
+        # compares like a list (order matters) against lists, tuples and
+        # other OrderedSets, and like a set against sets
+        if isinstance(other, (OrderedSet, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        if isinstance(other, (set, frozenset)):
+            return self.keys() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'OrderedSet({list(self)!r})'
+
+    def add(self, item):
+        '''
+        add an item at the end, if it isn't already here
+        '''
+        self[item] = None
+
+    # same as add(), for code that treated this as a list
+    append = add
+
+    def remove(self, item):
+        '''
+        remove an item. raises ValueError if it isn't here, like list.remove()
+        '''
+        try:
+            del self[item]
+        except KeyError:
+            raise ValueError(f'{item!r} not in OrderedSet') from None
+
+    def discard(self, item):
+        '''
+        remove an item if it's here
+        '''
+        self.pop(item, None)
+
+    def copy(self):
+        return OrderedSet(self)
+
+
+class FrozenOrderedSet(OrderedSet):
+    '''
+    an OrderedSet() that can't be changed once it's made. anything that
+    would change it raises TypeError, so a shared instance can't leak
+    one caller's changes to everyone else who holds it.
+    '''
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('FrozenOrderedSet is read-only')
+
+    __setitem__ = __delitem__ = _read_only
+    add = append = remove = discard = _read_only
+    pop = popitem = clear = update = setdefault = __ior__ = _read_only
+
+    def copy(self):
+        return OrderedSet(self)
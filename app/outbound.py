@@ -0,0 +1,263 @@
+'''
+outbound module. per-connection send queues with backpressure.
+
+User.send() used to write straight to the client's socket, so one client
+with a full TCP window would stall everyone else in the room (and the
+sender's own thread). OutboundQueue() makes send() a cheap append and lets
+a writer thread per connection do the actual socket writes.
+
+a client is "behind" once its queue grows past high_water, and only counts
+as caught up again after it drains below low_water. if it stays behind for
+longer than max_lag seconds, the policy decides what happens to it:
+
+- 'drop'       new messages for that client are thrown away until it catches up
+- 'disconnect' the connection is shut down and the usual disconnect cleanup runs
+
+by default the writer sends whatever it finds queued right away, one write
+per message. with coalescing turned on (flush_window) it holds on to
+queued messages until flush_bytes have piled up or flush_window seconds
+have passed since the first one, whichever is first, then writes them
+all with a single vectored write (see framing.send_buffers()).
+'''
+
+import collections
+import socket
+import threading
+import time
+
+# defaults. server.py passes its own settings in.
+HIGH_WATER = 256 * 1024
+LOW_WATER = 64 * 1024
+MAX_BYTES = 1024 * 1024
+MAX_LAG = 10.0
+# coalescing defaults: flush at this many bytes, or after this many seconds
+FLUSH_BYTES = 16 * 1024
+FLUSH_WINDOW = 0.0005
+POLICIES = ('drop', 'disconnect')
+
+# Backpressure.check() results
+ACCEPT = 'accept'
+DROP = 'drop'
+EVICT = 'evict'
+
+
+class Backpressure:
+    '''
+    watermark bookkeeping for a single connection. used by OutboundQueue()
+    and by the asyncio StreamSocket(), which have different buffers but
+    the same rules.
+
+    parameters
+    -----------
+    - high_water = int (bytes queued before the client counts as behind)
+    - low_water = int (bytes queued before a behind client counts as caught up)
+    - max_lag = float (seconds a client may stay behind before policy applies)
+    - policy = 'drop' or 'disconnect'
+    - max_bytes = int (hard limit. messages past this are always dropped)
+    '''
+    def __init__(self, high_water=HIGH_WATER, low_water=LOW_WATER, max_lag=MAX_LAG,
+                 policy='disconnect', max_bytes=MAX_BYTES):
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}, not {policy}')
+        if not 0 <= low_water <= high_water <= max_bytes:
+            raise ValueError('watermarks must satisfy 0 <= low_water <= high_water <= max_bytes')
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_lag = max_lag
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.behind_since = None   # time.monotonic() when the client fell behind
+
+    def is_behind(self):
+        return self.behind_since is not None
+
+    def check(self, queued, size, now=None):
+        '''
+        decide what to do with a new message of size bytes, given how
+        many bytes are already queued. returns ACCEPT, DROP or EVICT.
+        '''
+        now = time.monotonic() if now is None else now
+        if self.behind_since is None:
+            if queued >= self.high_water:
+                self.behind_since = now
+        elif queued < self.low_water:
+            self.behind_since = None
+
+        if self.behind_since is not None and now - self.behind_since > self.max_lag:
+            return EVICT if self.policy == 'disconnect' else DROP
+        if queued + size > self.max_bytes:
+            return DROP
+        return ACCEPT
+
+
+class OutboundQueue:
+    '''
+    wraps a FramedSocket() so .send() never blocks on the network.
+
+    messages are queued and written in order by a writer thread. anything
+    else (recv_messages, fileno, ...) is passed through to the wrapped socket.
+
+    parameters
+    -----------
+    - sock = FramedSocket() object
+    - backpressure = Backpressure() object (optional)
+    - flush_window = float (optional. seconds to hold messages back so 
+                     they can be written together. default is no coalescing)
+    - flush_bytes = int (with flush_window, write as soon as this many
+                    bytes are waiting)
+    '''
+    def __init__(self, sock, backpressure=None, flush_window=None, flush_bytes=FLUSH_BYTES):
+        self.socket = sock
+        self.backpressure = backpressure if backpressure is not None else Backpressure()
+        self.flush_window = flush_window
+        self.flush_bytes = flush_bytes
+        self.frames = collections.deque()
+        self.queued_bytes = 0
+        self.dropped = 0       # messages dropped because this client was behind
+        self.evicted = False   # True once the policy has disconnected this client
+        self.closed = False
+        self.cond = threading.Condition()
+        self.writer = threading.Thread(target=self._drain, daemon=True)
+        self.writer.start()
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+    def send(self, message):
+        '''
+        queue one message (bytes). returns the number of bytes queued
+        (0 if it was dropped).
+        '''
+        with self.cond:
+            if self.closed:
+                return 0
+            action = self.backpressure.check(self.queued_bytes, len(message))
+            if action == ACCEPT:
+                self.frames.append(message)
+                self.queued_bytes += len(message)
+                self.cond.notify()
+                return len(message)
+            self.dropped += 1
+            if action == EVICT and not self.evicted:
+                self._evict()
+            return 0
+
+    def send_many(self, messages):
+        '''
+        queue several messages (list of bytes) to be written together in
+        one write. they're accepted or dropped as a group. returns the 
+        number of bytes queued (0 if they were dropped).
+        '''
+        messages = tuple(messages)
+        size = sum(map(len, messages))
+        with self.cond:
+            if self.closed:
+                return 0
+            action = self.backpressure.check(self.queued_bytes, size)
+            if action == ACCEPT:
+                self.frames.append(messages)
+                self.queued_bytes += size
+                self.cond.notify()
+                return size
+            self.dropped += 1
+            if action == EVICT and not self.evicted:
+                self._evict()
+            return 0
+
+    def _evict(self):
+        '''
+        slow consumer. stop writing to it and shut the socket down so its
+        reader sees the disconnect and runs the normal cleanup.
+        '''
+        self.evicted = True
+        self.closed = True
+        self.frames.clear()
+        self.queued_bytes = 0
+        self.cond.notify()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _drain(self):
+        '''
+        writer thread. takes everything queued so far and writes it out.
+        an entry is either one message (bytes) or a tuple of messages
+        from send_many(), which go out in one write.
+        '''
+        while True:
+            with self.cond:
+                while not self.frames and not self.closed:
+                    self.cond.wait()
+                if self.flush_window is not None:
+                    self._wait_for_batch()
+                if self.closed:
+                    return
+                batch = list(self.frames)
+                self.frames.clear()
+            sent = 0
+            try:
+                if self.flush_window is not None:
+                    messages = []
+                    for message in batch:
+                        if type(message) is tuple:
+                            messages.extend(message)
+                        else:
+                            messages.append(message)
+                    sent = self.socket.send_many(messages)
+                else:
+                    for message in batch:
+                        if type(message) is tuple:
+                            sent += self.socket.send_many(message)
+                        else:
+                            self.socket.send(message)
+                            sent += len(message)
+            except OSError:
+                with self.cond:
+                    self.closed = True
+                    self.frames.clear()
+                    self.queued_bytes = 0
+                return
+            with self.cond:
+                if not self.closed:
+                    self.queued_bytes -= sent
+
+    def _wait_for_batch(self):
+        # caller holds self.cond and something is queued. nothing is being
+        # written right now, so queued_bytes is exactly what's waiting
+        deadline = time.monotonic() + self.flush_window
+        while not self.closed and self.queued_bytes < self.flush_bytes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.cond.wait(remaining)
+
+    def flush(self, timeout=None):
+        '''
+        wait until everything queued has been written (or timeout seconds).
+        returns True if the queue is empty.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.cond:
+                if self.closed or self.queued_bytes == 0:
+                    return self.queued_bytes == 0
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+
+    def pending(self):
+        '''
+        number of bytes queued but not yet written
+        '''
+        return self.queued_bytes
+
+    def close(self):
+        '''
+        stop the writer thread and close the socket
+        '''
+        with self.cond:
+            self.closed = True
+            self.frames.clear()
+            self.cond.notify()
+        self.socket.close()
@@ -5,14 +5,35 @@ CS 594
 Application module - the core functionality of the PyRC Chat program.
 '''
 
+import threading
+
 from app.user import User
 from app.chatroom import Chatroom
+from app.ids import USER_IDS
+from app.search import scan, tokenize
 
 DEFAULT_ROOM_NAME = '#lobby'
+# lines of history sent to someone joining a room (and by /history
+# by default). rooms keep HISTORY_LINES in memory, see app/history.py.
+# with a message log, /history can go back up to HISTORY_MAX lines
+HISTORY_REPLAY = 20
+HISTORY_MAX = 500
+# most results /search sends back
+SEARCH_LIMIT = 20
+# with a message log, /search reads up to SEARCH_LOG_MESSAGES of a room's
+# messages the index doesn't hold, SEARCH_LOG_PAGE at a time
+SEARCH_LOG_MESSAGES = 50000
+SEARCH_LOG_PAGE = 1000
+# direct messages kept while someone was away are sent back in frames of
+# at most DM_FRAME_BYTES, and at most DM_REPLAY_BYTES of them at a time,
+# well under what a connection's outbound queue holds (see server.py).
+# the rest wait for /dms more
+DM_FRAME_BYTES = 16 * 1024
+DM_REPLAY_BYTES = 256 * 1024
 
 
 # Broadcast a message to all clients in a given room
-def message_broadcast(room, sender_name, message):
+def message_broadcast(room, sender_name, message, log=None, search=None):
     '''
     sends a message to all the users in a Chatroom() instance.
     won't send message if a user in that room has blocked the sender!
@@ -22,15 +43,118 @@ def message_broadcast(room, sender_name, message):
     - room = Chatroom() object
     - sender_name = '' senders name (str)
     - message = '' message string
+    - log = MessageLog() object (optional. the message is written to it,
+            see app/msglog.py)
+    - search = SearchIndex() object (optional. the message is indexed by 
+               it, see app/search.py)
     '''
+    # build the frame once. every recipient gets the same bytes object.
+    frame = room.prefix + f'{sender_name} : {message} '.encode('ascii')
+
     # Send the message to all clients in this room, including the sender. 
     # Excludes users who blocked sender, or users who muted this room!
-    for client in room.clients:
-        if room.clients[client].has_blocked(sender_name):
-            continue
-        elif room.clients[client].has_muted(room.name):
-            continue
-        room.clients[client].send(f'{room.name} {sender_name} : {message} '.encode('ascii'))
+    # the room works out who that is ahead of time (see Chatroom), and hands
+    # back a snapshot, so joins/leaves on other threads can't break this loop.
+    room.record(sender_name, frame)
+    if log is not None:
+        log.append(room.name, sender_name, frame)
+    if search is not None:
+        search.add(room.name, message, frame)
+    for client in room.recipients_for(sender_name):
+        client.send(frame)
+
+
+# Send the same message to several rooms
+def message_multicast(rooms, sender_name, message, log=None, search=None):
+    '''
+    sends a message to every user in several Chatroom() instances, with
+    the same blocking and muting rules as message_broadcast().
+
+    works out who gets what first, then gives each recipient all of 
+    their copies (one per room they share with the sender, in the order 
+    of rooms) in a single write. so the number of writes is the number
+    of different recipients, not the number of room memberships.
+
+    parameters
+    -----------
+    - rooms = list of Chatroom() objects
+    - sender_name = '' senders name (str)
+    - message = '' message string
+    - log = MessageLog() object (optional, same as message_broadcast())
+    - search = SearchIndex() object (optional, same as message_broadcast())
+    '''
+    if len(rooms) == 1:
+        message_broadcast(rooms[0], sender_name, message, log, search)
+        return
+    body = f'{sender_name} : {message} '.encode('ascii')
+    # key is User() object, value is the frames for them (list[bytes])
+    plan = {}
+    for room in rooms:
+        frame = room.prefix + body
+        room.record(sender_name, frame)
+        if log is not None:
+            log.append(room.name, sender_name, frame)
+        if search is not None:
+            search.add(room.name, message, frame)
+        for client in room.recipients_for(sender_name):
+            frames = plan.get(client)
+            if frames is None:
+                plan[client] = [frame]
+            else:
+                frames.append(frame)
+    for client, frames in plan.items():
+        if len(frames) == 1:
+            client.send(frames[0])
+        else:
+            client.send_many(frames)
+
+
+# Parse the arguments of a /broadcast command
+def parse_broadcast(words):
+    '''
+    parses "#room1 : <message> / #room2 : <message> / ..." in one pass 
+    over the words. a "/" can also be stuck to the last word of a message,
+    i.e. "#room : hello there/". inside a message, "#" and ":" are just words.
+
+    returns a dictionary, "Rooms" = room names (list[str]) and
+    "Messages" = the message for each room (list[str]), or None if the
+    words don't fit the syntax.
+
+    parameters
+    -----------
+    - words = list[str] (everything after the /broadcast command)
+    '''
+    rooms = []
+    messages = []
+    # 0 = expecting a room name, 1 = expecting ':', 2 = reading a message
+    state = 0
+    message_text = []
+    for word in words:
+        if state == 0:
+            if word[0] != '#':
+                return None
+            rooms.append(word)
+            state = 1
+        elif state == 1:
+            if word != ':':
+                return None
+            state = 2
+        # end of this room's message
+        elif word == '/':
+            messages.append(' '.join(message_text))
+            message_text = []
+            state = 0
+        elif word[-1] == '/':
+            message_text.append(word[:-1])
+            messages.append(' '.join(message_text))
+            message_text = []
+            state = 0
+        else:
+            message_text.append(word)
+    # every message has to be finished
+    if state != 0 or not rooms:
+        return None
+    return {"Rooms": rooms, "Messages": messages}
 
 
 # PyRC class. 
@@ -43,6 +167,11 @@ class PyRC:
 
     PyRC.message_parser() is the main point of entry for this application. 
     All message strings recieved from the client should be sent through here.
+
+    safe to use from many client threads at once. there's no global lock:
+    rooms_lock and users_lock only guard adding/removing entries in 
+    self.rooms and self.users, each Chatroom() has its own lock for its
+    membership, and each User() has its own lock for its lists.
     '''
     def __init__(self):
 
@@ -56,6 +185,28 @@ class PyRC:
         # Key is username (str), value is User() object
         self.users = {}
 
+        # guard creating/deleting entries in self.rooms and self.users.
+        # never held while messages are being sent.
+        self.rooms_lock = threading.Lock()
+        self.users_lock = threading.Lock()
+
+        # RelayClient() when running as one of several worker processes,
+        # otherwise None. see app/relay.py
+        self.relay = None
+
+        # MessageLog() every room message is written to, or None to keep
+        # nothing on disk. see app/msglog.py
+        self.log = None
+
+        # SearchIndex() over every room message for /search, or None if
+        # search is turned off. see app/search.py
+        self.search = None
+
+        # DMStore() that keeps direct messages for users who aren't
+        # connected, or None to only deliver to connected users. 
+        # see app/dmstore.py
+        self.dmstore = None
+
     # add a new user to the instance
     def add_user(self, user_name, new_user_socket):
         '''
@@ -67,16 +218,26 @@ class PyRC:
         - new_user_socket = socket() object
         '''
         # is this actually a new user?
-        if user_name not in self.users.keys():
-            # create new User() instance
-            self.users[user_name] = User(name = user_name,
-                                         curr_room = DEFAULT_ROOM_NAME,
-                                         socket = new_user_socket)
+        with self.users_lock:
+            is_new = user_name not in self.users.keys() and not self.is_remote_user(user_name)
+            if is_new:
+                # create new User() instance
+                self.users[user_name] = User(name = user_name,
+                                             curr_room = DEFAULT_ROOM_NAME,
+                                             socket = new_user_socket)
+        if is_new:
             # add them to default lobby.
-            self.rooms[DEFAULT_ROOM_NAME].add_new_client_to_room(self.users[user_name])
+            self.enter_room(self.rooms[DEFAULT_ROOM_NAME], self.users[user_name])
             join_message = f'{user_name} joined {DEFAULT_ROOM_NAME}!'
-            # send join message to room
-            message_broadcast(self.rooms[DEFAULT_ROOM_NAME], user_name, join_message)
+            # let the other workers know, then send join message to room
+            if self.relay is not None:
+                self.relay.publish('join', user=user_name)
+            self.broadcast(self.rooms[DEFAULT_ROOM_NAME], user_name, join_message)
+            # anything sent while they were away comes back on the store's
+            # thread, see deliver_stored_dms()
+            if self.dmstore is not None:
+                self.dmstore.remember(user_name)
+                self.dmstore.take(user_name, self.deliver_stored_dms)
             return True
 
         # case where they're already in the instance
@@ -93,17 +254,183 @@ class PyRC:
         -----------
         - user_name = ''
         '''
-        if user_name in self.users.keys():
-            # this could iterate over lots of rooms that don't have
-            # this user, but it will make sure the user is definitively
-            # removed in the off chance their curr_rooms list is inaccurate.
-            for room in self.rooms:
-                if self.rooms[room].has_user(user_name):
-                    self.rooms[room].remove_client_from_room(user_name) 
-            del self.users[user_name]
+        with self.users_lock:
+            user = self.users.pop(user_name, None)
+        if user is not None:
+            # curr_rooms is kept exact by the rooms themselves, so this only
+            # touches the rooms this user is actually in.
+            # (iterates a copy, since leaving a room updates curr_rooms)
+            for room_name in list(user.curr_rooms):
+                room = self.rooms.get(room_name)
+                if room is not None:
+                    room.remove_client_from_room(user_name)
+            if self.relay is not None:
+                self.relay.publish('leave', user=user_name)
+            # keep their inbox for when they come back
+            if self.dmstore is not None:
+                self.dmstore.remember(user_name)
+                dms = user.export_dms()
+                if dms:
+                    self.dmstore.save_many(user_name, dms)
         else:
             return f'{user_name} is not in the server!'
+
+    # hand a reconnected user the direct messages kept for them
+    def deliver_stored_dms(self, user_name, messages, waiting=0):
+        '''
+        called by the DMStore() (see DMStore.take()) with the oldest messages
+        it kept for user_name, as (sender, message, sent, seen) tuples, and
+        how many more are waiting after those. returns how many of messages
+        were handled: only those are deleted from the store.
+
+        the ones they haven't seen are sent in frames of at most
+        DM_FRAME_BYTES, up to DM_REPLAY_BYTES in all. a frame the socket
+        drops, and everything after it, stays in the store, as does
+        everything past DM_REPLAY_BYTES. what was sent goes back into the
+        user's inbox.
+
+        parameters
+        -----------
+        - user_name = ''
+        - messages = list of tuples
+        - waiting = int
+        '''
+        user = self.users.get(user_name)
+        # they left again before these got here. keep them for next time
+        if user is None or not messages:
+            return 0
+        # split the unseen ones into frames: (end, lines), where end is the
+        # index of the first message the frame doesn't cover
+        frames = []
+        lines = []
+        size = 0
+        budget = DM_REPLAY_BYTES
+        end = len(messages)
+        for index, (sender, message, _, seen) in enumerate(messages):
+            if seen:
+                continue
+            line = f'{sender}: {message}'
+            if (frames or lines) and len(line) >= budget:
+                end = index
+                break
+            if lines and size + len(line) >= DM_FRAME_BYTES:
+                frames.append((index, lines))
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line) + 1
+            budget -= len(line) + 1
+        if lines:
+            frames.append((end, lines))
+        waiting += len(messages) - end
+        handled = end if not frames else 0
+        for number, (frame_end, lines) in enumerate(frames, 1):
+            text = f'{len(lines)} new message(s) while you were away:\n' + '\n'.join(lines)
+            if number == len(frames):
+                if waiting:
+                    text += f'\n{waiting} more message(s) are waiting. Use /dms more to get them'
+                else:
+                    text += '\nUse /dms to see all your conversations'
+            # dropped. it and everything after it stay in the store
+            if user.send(text.encode('ascii')) == 0:
+                break
+            handled = frame_end
+        if not frames and waiting:
+            user.send(f'{waiting} more message(s) are waiting. Use /dms more to get them'.encode('ascii'))
+        user.restore_dms(messages[:handled])
+        return handled
+
+    # hand over more of what's waiting, when asked for with /dms more
+    def deliver_more_dms(self, user_name, messages, waiting=0):
+        '''
+        deliver_stored_dms(), but says so when there's nothing waiting
+        '''
+        if not messages and user_name in self.users.keys():
+            self.users[user_name].send('No messages waiting!'.encode('ascii'))
+        return self.deliver_stored_dms(user_name, messages, waiting)
     
+    # is this user connected to another worker process?
+    def is_remote_user(self, user_name):
+        '''
+        True if user_name is connected to a different worker. 
+        always False when there's no relay.
+        '''
+        return self.relay is not None and self.relay.is_remote(user_name)
+
+    # send a message to a room, and to the same room on other workers
+    def broadcast(self, room, sender_name, message):
+        '''
+        message_broadcast() plus relaying to any other worker processes.
+        use this instead of calling message_broadcast() directly.
+
+        parameters
+        -----------
+        - room = Chatroom() object
+        - sender_name = ''
+        - message = ''
+        '''
+        message_broadcast(room, sender_name, message, self.log, self.search)
+        if self.relay is not None:
+            self.relay.publish('room', room=room.name, sender=sender_name, message=message)
+
+    # send a message to several rooms, and to the same rooms on other workers
+    def broadcast_rooms(self, rooms, sender_name, message):
+        '''
+        message_multicast() plus relaying to any other worker processes.
+
+        parameters
+        -----------
+        - rooms = list of Chatroom() objects
+        - sender_name = ''
+        - message = ''
+        '''
+        message_multicast(rooms, sender_name, message, self.log, self.search)
+        if self.relay is not None:
+            self.relay.publish('rooms', rooms=[room.name for room in rooms],
+                               sender=sender_name, message=message)
+
+    # handle traffic relayed from another worker process
+    def relay_receive(self, record):
+        '''
+        delivers a record from RelayClient() to local users only. 
+        nothing here is relayed again.
+
+        parameters
+        -----------
+        - record = {'kind': '', ...} (see app/relay.py)
+        '''
+        kind = record['kind']
+        if kind == 'room':
+            if record['room'] in self.rooms.keys():
+                message_broadcast(self.rooms[record['room']], record['sender'], record['message'],
+                                  self.log, self.search)
+        elif kind == 'rooms':
+            rooms = [self.rooms[name] for name in record['rooms'] if name in self.rooms.keys()]
+            if rooms:
+                message_multicast(rooms, record['sender'], record['message'],
+                                  self.log, self.search)
+        elif kind == 'whisper':
+            receiver = record['receiver']
+            # looked up once, the receiver can disconnect at any time
+            user = self.users.get(receiver)
+            if user is not None:
+                if user.has_blocked(record['sender']):
+                    self.relay.publish('notice', receiver=record['sender'],
+                                       message=f'Error: you were blocked by {receiver}!')
+                else:
+                    user.send(f'/whisper @{record["sender"]}: {record["message"]}'.encode('ascii'))
+        elif kind == 'dm':
+            user = self.users.get(record['receiver'])
+            if user is not None:
+                user.get_dm(record['sender'], record['message'])
+            # they disconnected while it was on its way
+            elif self.dmstore is not None:
+                self.dmstore.save(record['receiver'], record['sender'], record['message'])
+        elif kind == 'notice':
+            user = self.users.get(record['receiver'])
+            if user is not None:
+                user.send(record['message'].encode('ascii'))
+
     # get a list of active users in a specific room
     def get_users(self, room, sender_socket):
         '''
@@ -123,6 +450,8 @@ class PyRC:
         returns a str of all active users in the instance.
         '''
         users = list(self.users.keys())
+        if self.relay is not None:
+            users.extend(sorted(self.relay.remote_users))
         return " ".join(users)
 
     # returns true or false if a room exists
@@ -150,6 +479,48 @@ class PyRC:
         self.users[sender_name].send(room_list.encode('ascii'))
         return room_list
     
+    # make sure rooms and users agree on who's where
+    def check_consistency(self):
+        '''
+        checks that every room's clients and every user's curr_rooms
+        describe the same membership. meant for tests, not for use while 
+        other threads are changing things.
+
+        returns a list of problems (list[str]). empty if everything agrees.
+        '''
+        problems = []
+        for room_name, room in list(self.rooms.items()):
+            if room.name != room_name:
+                problems.append(f'{room_name} is stored under the wrong name ({room.name})')
+            if set(room.members) != set(room.clients.values()) or len(room.members) != len(room.clients):
+                problems.append(f'{room_name} members snapshot is out of date')
+            unmuted = [user for user in room.members if not user.has_muted(room_name)]
+            if set(room.recipients) != set(unmuted) or len(room.recipients) != len(unmuted):
+                problems.append(f'{room_name} recipients are out of date')
+            slots = room.view[0]
+            if any(slots[slot] is not room.clients.get(name) for name, slot in room.slot_of.items()):
+                problems.append(f'{room_name} slots are out of date')
+            blocked_by = {}
+            for user in room.members:
+                for sender in user.blocked:
+                    id = USER_IDS.id_of(sender)
+                    blocked_by[id] = blocked_by.get(id, 0) | 1 << room.slot_of[user.name]
+            if room.blocked_by != blocked_by:
+                problems.append(f'{room_name} blocked_by is out of date')
+            for user_name, user in list(room.clients.items()):
+                if self.users.get(user_name) is not user:
+                    problems.append(f'{user_name} is in {room_name} but not connected')
+                if room_name not in user.curr_rooms:
+                    problems.append(f'{user_name} is in {room_name} but it is not in their curr_rooms')
+        for user_name, user in list(self.users.items()):
+            for room_name in list(user.curr_rooms):
+                room = self.rooms.get(room_name)
+                if room is None:
+                    problems.append(f'{user_name} has {room_name} in curr_rooms but it does not exist')
+                elif room.clients.get(user_name) is not user:
+                    problems.append(f'{user_name} has {room_name} in curr_rooms but is not in it')
+        return problems
+
     # Check if the room name begins with '#', check if user is already in the room,
     # create the room if it does not exist, then join the room the user specified
     def join_room(self, room_to_join, sender_name):
@@ -161,26 +532,106 @@ class PyRC:
         - room_to_join = '#room_name' OR list['#room_name1', '#room_name2',..]
         - sender_name = ''
         '''
-        # Case where this room doesn't already exist
-        if room_to_join not in self.rooms.keys():
-            # create new room.
-            self.create_room(room_to_join, sender_name)
+        # find or create the room in one step, so two users joining a new
+        # room at the same time can't each create their own copy of it
+        with self.rooms_lock:
+            room = self.rooms.get(room_to_join)
+            created = room is None
+            if created:
+                room = self.rooms[room_to_join] = Chatroom(room_name = room_to_join)
+
+        # Case where this room didn't already exist
+        if created:
+            self.enter_room(room, self.users[sender_name])
+            # new to this process, but it may have logged history
+            self.send_history(room, sender_name, HISTORY_REPLAY)
+            join_message = f'{sender_name} joined {room_to_join}!'
+            self.broadcast(room, sender_name, join_message)
             self.users[sender_name].send(f'Joined {room_to_join}!'.encode('ascii'))
             return f'Joined {room_to_join}!'
 
         # Case where it DOES already exist
         else:
             # Case where the user is already there
-            if self.rooms[room_to_join].has_user(sender_name):
+            if room.has_user(sender_name):
                 self.users[sender_name].send(f'You are already in {room_to_join}, silly!'.encode('ascii'))
                 return f'You are already in {room_to_join}, silly!'
             # otherwise join the room...
             else:
-                self.rooms[room_to_join].add_new_client_to_room(self.users[sender_name])
+                self.enter_room(room, self.users[sender_name])
+                # catch them up before they see themselves join
+                self.send_history(room, sender_name, HISTORY_REPLAY)
                 join_message = f'{sender_name} joined {room_to_join}!'
-                message_broadcast(self.rooms[room_to_join], sender_name, join_message)
+                self.broadcast(room, sender_name, join_message)
                 return f'Joined {room_to_join}!'
 
+    # add a user to a room, and let the other workers know
+    def enter_room(self, room, user):
+        '''
+        add a user to a Chatroom() instance. with a relay, the other
+        workers are told too, so /users there can list them.
+
+        returns True if they were added, False if they were already there.
+
+        parameters
+        ------------
+        - room = Chatroom() object
+        - user = User() object
+        '''
+        added = room.add_new_client_to_room(user)
+        if added and self.relay is not None:
+            self.relay.publish('enter', room=room.name, user=user.name)
+        return added
+
+    # remove a user from a room, and let the other workers know
+    def exit_room(self, room, user_name):
+        '''
+        remove a user from a Chatroom() instance. see enter_room().
+
+        returns an error message if they weren't there, otherwise None.
+
+        parameters
+        ------------
+        - room = Chatroom() object
+        - user_name = ''
+        '''
+        error = room.remove_client_from_room(user_name)
+        if error is None and self.relay is not None:
+            self.relay.publish('exit', room=room.name, user=user_name)
+        return error
+
+    # send someone a room's recent messages
+    def send_history(self, room, user_name, count):
+        '''
+        sends a user the last count messages from a room, all in one
+        message. leaves out anyone they've blocked. 
+        returns what was sent, or None if there was nothing to send.
+
+        recent messages come from the room's own history. anything older
+        (or from before a restart) comes from what the message log, if
+        there is one, has already committed. it's only read when the room's
+        history comes up short, and never waits for a write.
+
+        parameters
+        -----------
+        - room = Chatroom() object
+        - user_name = ''
+        - count = int
+        '''
+        user = self.users[user_name]
+        kept = len(room.history) if room.history is not None else 0
+        lines = room.recent(count, user)
+        if self.log is not None and kept < count:
+            older = self.log.older(room.name, kept, count - kept)
+            if older:
+                lines = [frame for _, _, sender, frame in older
+                         if not user.has_blocked(sender.tobytes().decode('ascii'))] + lines
+        if not lines:
+            return None
+        frame = f'{room.name} history:\n'.encode('ascii') + b'\n'.join(lines)
+        user.send(frame)
+        return frame.decode('ascii')
+
     # Create a new Chatroom, add the room to the room list, and add the client to the chatroom
     # A room cannot exist without a client, so one must be supplied
     def create_room(self, room_to_join, sender_name):
@@ -194,12 +645,15 @@ class PyRC:
         - sender_name = ''
         '''
         # create room, add user, and update their info (handled in room.add_new_client_to_room())
-        self.rooms[room_to_join] = Chatroom(room_name = room_to_join)
-        self.rooms[room_to_join].add_new_client_to_room(self.users[sender_name]) 
+        # if another thread just created it, join that one rather than replacing
+        # it, so its members aren't left pointing at a room that's gone.
+        with self.rooms_lock:
+            room = self.rooms.setdefault(room_to_join, Chatroom(room_name = room_to_join))
+        self.enter_room(room, self.users[sender_name])
 
         # send join message
         join_message = f'{sender_name} joined {room_to_join}!'
-        message_broadcast(self.rooms[room_to_join], sender_name, join_message)
+        self.broadcast(room, sender_name, join_message)
 
     # Check if the room exists, check if user is in the room,
     # remove user from room and delete room if it is empty
@@ -232,21 +686,21 @@ class PyRC:
             # remove user from SINGLE room. doesn't send them anywhere
             # unless they only had #lobby on their list after they left their
             # current room.
-            self.rooms[room_to_leave].remove_client_from_room(sender_name)
-            self.users[sender_name].curr_rooms.remove(room_to_leave)
+            # (this updates their curr_rooms too)
+            self.exit_room(self.rooms[room_to_leave], sender_name)
             exit_message = f' {sender_name} left {room_to_leave}!'
             
             # make sure we don't broadcast to an empty room...
             if len(self.rooms[room_to_leave].clients) > 0:
-                message_broadcast(self.rooms[room_to_leave], sender_name, exit_message)
+                self.broadcast(self.rooms[room_to_leave], sender_name, exit_message)
 
             # send user back to previous room 
             # user should still get messages from all the rooms they're active in. 
             if len(self.users[sender_name].curr_rooms) > 1:
                 prev_room = self.users[sender_name].curr_rooms[-1]
-                self.rooms[prev_room].add_new_client_to_room(self.users[sender_name])
+                self.enter_room(self.rooms[prev_room], self.users[sender_name])
                 join_message = f'{sender_name} joined {prev_room}!'
-                message_broadcast(self.rooms[prev_room], sender_name, join_message)
+                self.broadcast(self.rooms[prev_room], sender_name, join_message)
 
             # ...otherwise they'll be in the #lobby by default
             else:
@@ -272,22 +726,16 @@ class PyRC:
 
         # iterate through users curr_rooms list
         else:
-            rooms_left = [] # this will be used to update users list afterwards
-            for room in range(len(self.users[sender_name].curr_rooms)):
+            # iterates a copy, since leaving a room updates curr_rooms
+            for room_to_leave in list(self.users[sender_name].curr_rooms):
                 # make sure they don't get removed from the #lobby!
-                if self.users[sender_name].curr_rooms[room] == DEFAULT_ROOM_NAME:
+                if room_to_leave == DEFAULT_ROOM_NAME:
                     continue
-                room_to_leave = self.users[sender_name].curr_rooms[room]
-                rooms_left.append(room_to_leave)
 
-                self.rooms[room_to_leave].remove_client_from_room(sender_name)
+                self.exit_room(self.rooms[room_to_leave], sender_name)
                 leave_message = f' {sender_name} left {room_to_leave}!'
                 self.users[sender_name].send(leave_message.encode('ascii'))
-                message_broadcast(self.rooms[room_to_leave], sender_name, leave_message)
-                 
-            # update curr_rooms list
-            for room in rooms_left:
-                self.users[sender_name].curr_rooms.remove(room)
+                self.broadcast(self.rooms[room_to_leave], sender_name, leave_message)
  
     # message another user privately in a shared room
     def send_whisper(self, sender_name, message, receiver):
@@ -305,19 +753,25 @@ class PyRC:
         '''
         #pop @ from name
         receiver = self.parse_user_name(receiver)
+        # looked up once, the receiver can disconnect at any time
+        user = self.users.get(receiver)
+        # case where receiver is on another worker process
+        if user is None and self.is_remote_user(receiver):
+            self.relay.publish('whisper', sender=sender_name, receiver=receiver, message=message)
+
         # case where receiver is not in app instance
-        if receiver not in self.users:                  
+        elif user is None:
             self.users[sender_name].send(f'Error: {receiver} not in server!'.encode('ascii'))
 
         # case where receiver blocked sender
-        elif self.users[receiver].has_blocked(sender_name):
+        elif user.has_blocked(sender_name):
             self.users[sender_name].send(f'Error: you were blocked by {receiver}!'.encode('ascii'))
 
         # otherwise, try to send whisper
         else:
             message_text = f'/whisper @{sender_name}: {message}'
             # send message to receiver
-            self.users[receiver].send(message_text.encode('ascii'))
+            user.send(message_text.encode('ascii'))
 
     # directly message another user
     def send_dm(self, sender, message, receiver):
@@ -332,19 +786,29 @@ class PyRC:
 
         wont send message if sender has been blocked by receiver!
         receiver gets a notification message that they've received
-        a direct message from another user.
+        a direct message from another user. if they aren't connected,
+        there's a DMStore() and it knows them (they've connected before),
+        it's kept there until they are.
         '''
+        # looked up once, the receiver can disconnect at any time
+        user = self.users.get(receiver)
+        # receiver is on another worker process. their worker stores it.
+        if user is None and self.is_remote_user(receiver):
+            self.relay.publish('dm', sender=sender, receiver=receiver, message=message)
+        # receiver isn't connected. keep it for when they are
+        elif user is None and self.dmstore is not None and self.dmstore.save(receiver, sender, message):
+            self.users[sender].send(f'{receiver} is offline, they will get your message when they reconnect.'.encode('ascii'))
         # make sure receiver is in the instance
-        if receiver not in self.users.keys():
+        elif user is None:
             self.users[sender].send(f'Error: {receiver} not in app instance!'.encode('ascii'))
         else:
             # save message to User() instance. 
             # User() will send notification message to receiver.
             # User() will also check whether sender was blocked by receiver.
-            self.users[receiver].get_dm(sender, message)
+            user.get_dm(sender, message)
 
     # read direct messages
-    def read_dms(self, receiver, sender=None):
+    def read_dms(self, receiver, sender=None, page=1):
         '''
         gets a user's direct messages. works with the User() object.
 
@@ -353,25 +817,69 @@ class PyRC:
         - receiver = '' (user requesting dms)
         - sender = None (set to user_name string if user wants 
                          dms from a specific user)
+        - page = int (which page of sender's messages. 1 is the newest)
         '''
         if sender is None:
             return self.users[receiver].read_all_dms()
         else:
-            return self.users[receiver].read_dm(sender)
+            return self.users[receiver].read_dm(sender, page)
     
     # block a user
     def block(self, user_name, to_block):
         '''
-        blocks a user from DM'ing someone. 
+        blocks a user from DM'ing someone, and from being heard in 
+        any room user_name is in.
         '''
-        self.users[user_name].block(to_block)
+        user = self.users[user_name]
+        user.block(to_block)
+        for room_name in list(user.curr_rooms):
+            room = self.rooms.get(room_name)
+            if room is not None:
+                room.set_blocked(user, to_block, True)
 
     # unblock a user
     def unblock(self, user_name, to_unblock):
         '''
         unblocks a user. 
         '''
-        self.users[user_name].unblock(to_unblock)
+        user = self.users[user_name]
+        user.unblock(to_unblock)
+        for room_name in list(user.curr_rooms):
+            room = self.rooms.get(room_name)
+            if room is not None:
+                room.set_blocked(user, to_unblock, False)
+
+    # mute a room
+    def mute(self, user_name, room_name):
+        '''
+        stop sending a room's messages to a user
+
+        parameters
+        -----------
+        - user_name = ''
+        - room_name = ''
+        '''
+        user = self.users[user_name]
+        user.mute(room_name)
+        room = self.rooms.get(room_name)
+        if room is not None:
+            room.set_muted(user, True)
+
+    # unmute a room
+    def unmute(self, user_name, room_name):
+        '''
+        start sending a muted room's messages to a user again
+
+        parameters
+        -----------
+        - user_name = ''
+        - room_name = ''
+        '''
+        user = self.users[user_name]
+        user.unmute(room_name)
+        room = self.rooms.get(room_name)
+        if room is not None:
+            room.set_muted(user, False)
     
     # parse a username
     def parse_user_name(self, user_name):
@@ -430,6 +938,13 @@ class PyRC:
             - if you are in the main lobby, you will be asked if you 
               want to exit. if yes, then client will terminate.
 
+        - /history #room_name (opt) <number of lines>
+            - show a room's most recent messages (20 by default, 500 at most)
+            - you also get these when you join a room
+
+        - /search #room_name <terms>
+            - find the newest messages in a room that contain all the terms
+
         - /mute #room1 (opt) #room2...
             - mutes output from selected rooms that you're active in
 
@@ -451,9 +966,14 @@ class PyRC:
               same room with you.
             - these are asynchronous between users.
         
-        - /dms (opt) <from_user>
-            - gets *all* your direct messages and who they're from by default.
-            - specify <from_user> if you want to see messages from a specific person.
+        - /dms (opt) <from_user> (opt) <page>
+            - lists who you have direct messages from, and how many, by default.
+            - specify <from_user> if you want to see messages from a specific person,
+              a page at a time. page 1 (the default) is the newest.
+
+        - /dms more
+            - get more of the messages that were kept while you were away,
+              when there were too many to send at once.
 
         - /whisper @<user_name> <message>
             - directly message another user in real-time.
@@ -478,365 +998,475 @@ class PyRC:
 
         ### case where client sends an empty message ###
         if not message:
-            pass
+            return
 
         ### send message to each room the user is currently in. ###
         # this just checks whether there's a command prior to the message
-        elif message[0] != '/':
-            for room in self.users[sender_name].curr_rooms:
-                message_broadcast(self.rooms[room], sender_name, message)
-
-        ### Case where user wants to join a room ###:
-        elif message.split()[0] == '/join':
-            '''
-            syntax : /join #room_name1 (opt) #room_name2 etc...
-            '''
-            # case where there's a typo or user forgot to add a room argument
-            if len(message.split()) < 2:
-                sender_socket.send("/join requires a #room_name argument.\nPlease enter: /join #roomname\n".encode('ascii'))
-                return "/join requires a #room_name argument.\nPlease enter: /join #roomname\n"
-
-            # case where first room arg doesn't have '#' symbol in front of it
-            elif '#' not in message.split()[1]:
-                sender_socket.send("/join requires a #room_name argument with '#' in front.\nPlease enter: /join #roomname\n".encode('ascii'))
-                return "/join requires a #room_name argument with '#' in front.\nPlease enter: /join #roomname\n"
-            
-            # case where a random word follows the roomname (i.e. /join #roomname t)
-            elif len(message.split()) == 3:
-                if message.split()[2][0] != '#':
-                    sender_socket.send('Error: incorrect syntax! all room names must start with a "#"'.encode('ascii'))
-                    return 'Error: incorrect syntax! all room names must start with a "#"'
-            
-            # otherwise try to join or create room(s).
-            else:
-                # check if there's more than one room arguments 
-                # if so, join multiple rooms 
-                if len(message.split()) > 2:
-                    rooms_to_join = []
-                    for word in message.split():
-                        if word[0] == '#':
-                            rooms_to_join.append(word)
-                    # attempt to add user to these rooms
-                    for room in rooms_to_join:
-                        self.join_room(room, sender_name)
-                # otherwise join single room
-                else:
-                    self.join_room(message.split()[1], sender_name)
-
-        ### Case where user wants to create a new room ###
-        elif message.split()[0] == '/create':
-            '''
-            syntax: /create #room_name
-            '''
-            # case where user forgets to add a room name
-            if len(message.split()) == 1:
-                sender_socket.send(f'Error: must include a roomname argument separated with a space \nex: /create #room_name'.encode('ascii'))
-                return f'Error: must include a room name argument separated with a space \nex: /create #room_name'
-
-            # case where room_name doesn't start with a '#'
-            elif '#' not in message.split()[1]:
-                sender_socket.send(f'Error: must include a "#" when denoting a room name! \nex: /create #room_name'.encode('ascii'))
-                return f'Error: must include a "#" when denoting a room name! \nex: /create #room_name'                 
-
-            # case where room already exists
-            elif message.split()[1] in self.rooms.keys():
-                sender_socket.send(f'Error: {message.split()[1]} already exists!'.encode('ascii'))
-                return f'Error: {message.split()[1]} already exists!'
-
-            # otherwise create a new room
-            else:
-                self.create_room(message.split()[1], sender_name)
-
-        ### Case where user wants to leave a room ###:
-        elif message.split()[0] == "/leave":
-            '''
-            syntax: /leave #room OR /leave all
-            '''
-            # Case where user just submits "/leave"
-            if len(message.split()) == 1:
-                sender_socket.send("/leave requires a #room_name argument.\nPlease enter: /leave #roomname\n".encode('ascii'))
-                return "/leave requires a #room_name argument.\nPlease enter: /leave #roomname\n"
-
-            # case where user wants to leave ALL their active rooms
-            elif message.split()[1] == 'all':
-                self.leave_all(sender_name)
-
-            # otherwise try to remove from single room
-            else:
-                room_to_leave = message.strip().split()[1]
-                # case where user forgets to include "#" in "#room_name"
-                if room_to_leave[0] != "#":
-                    sender_socket.send("/leave requires a #roomname argument to begin with '#'.\n".encode('ascii'))
-                    return "/leave requires a #roomname argument to begin with '#'.\n"
-                # leave room...
-                else:
-                    sender_socket.send(f'Leaving {room_to_leave}...'.encode('ascii'))
-                    # this sends the user back to the #lobby!
-                    self.leave_room(room_to_leave, sender_name)
-
-        ### Case where user wants to list all active rooms ###
-        elif message.split()[0] == "/rooms":
-            if len(self.rooms) > 0:
-                rooms = f'Active rooms: \n{self.list_all_rooms()}'
-                sender_socket.send(rooms.encode('ascii'))
+        if message[0] != '/':
+            rooms = [self.rooms[room] for room in tuple(self.users[sender_name].curr_rooms)]
+            self.broadcast_rooms(rooms, sender_name, message)
+            return
+
+        # split once. every command handler gets the same word list,
+        # with the command itself at words[0]
+        words = message.split()
+        command = self.COMMANDS.get(words[0])
+        if command is None:
+            sender_socket.send(f'{words[0]} is not a valid command!'.encode('ascii'))
+            return f'{words[0]} is not a valid command!'
+        return command(self, message, words, sender_name, sender_socket)
+
+    ### Case where user wants to join a room ###:
+    def _cmd_join(self, message, words, sender_name, sender_socket):
+        '''
+        syntax : /join #room_name1 (opt) #room_name2 etc...
+        '''
+        # case where there's a typo or user forgot to add a room argument
+        if len(words) < 2:
+            sender_socket.send("/join requires a #room_name argument.\nPlease enter: /join #roomname\n".encode('ascii'))
+            return "/join requires a #room_name argument.\nPlease enter: /join #roomname\n"
+
+        # case where first room arg doesn't have '#' symbol in front of it
+        elif '#' not in words[1]:
+            sender_socket.send("/join requires a #room_name argument with '#' in front.\nPlease enter: /join #roomname\n".encode('ascii'))
+            return "/join requires a #room_name argument with '#' in front.\nPlease enter: /join #roomname\n"
+        
+        # case where a random word follows the roomname (i.e. /join #roomname t)
+        elif len(words) == 3:
+            if words[2][0] != '#':
+                sender_socket.send('Error: incorrect syntax! all room names must start with a "#"'.encode('ascii'))
+                return 'Error: incorrect syntax! all room names must start with a "#"'
+        
+        # otherwise try to join or create room(s).
+        else:
+            # check if there's more than one room arguments 
+            # if so, join multiple rooms 
+            if len(words) > 2:
+                rooms_to_join = [word for word in words if word[0] == '#']
+                # attempt to add user to these rooms
+                for room in rooms_to_join:
+                    self.join_room(room, sender_name)
+            # otherwise join single room
             else:
-                sender_socket.send('Error: no active rooms!'.encode('ascii'))
-
-        ### Case where a user wants a list of all their active rooms ###
-        elif message.split()[0] == '/myrooms':
-            self.list_my_rooms(sender_name)
-
-        ### Case where user wants list of other users in their current room ###
-        elif message.split()[0] == "/users":
-            '''
-            syntax: /users #room_name
-            '''
-            # case where user forgets to add a room name argument
-            if len(message.split()) == 1:
-                sender_socket.send('Error: /users requires a room name argument \nex: /users #room_name'.encode('ascii'))
-            # case where room_name doesn't start with a '#'
-            elif '#' not in message.split()[1]:
-                sender_socket.send('Error: room name arg must start with "#" \nex: /users #room_name'.encode('ascii'))
+                self.join_room(words[1], sender_name)
+
+    ### Case where user wants to create a new room ###
+    def _cmd_create(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /create #room_name
+        '''
+        # case where user forgets to add a room name
+        if len(words) == 1:
+            sender_socket.send(f'Error: must include a roomname argument separated with a space \nex: /create #room_name'.encode('ascii'))
+            return f'Error: must include a room name argument separated with a space \nex: /create #room_name'
+
+        # case where room_name doesn't start with a '#'
+        elif '#' not in words[1]:
+            sender_socket.send(f'Error: must include a "#" when denoting a room name! \nex: /create #room_name'.encode('ascii'))
+            return f'Error: must include a "#" when denoting a room name! \nex: /create #room_name'                 
+
+        # case where room already exists
+        elif words[1] in self.rooms.keys():
+            sender_socket.send(f'Error: {words[1]} already exists!'.encode('ascii'))
+            return f'Error: {words[1]} already exists!'
+
+        # otherwise create a new room
+        else:
+            self.create_room(words[1], sender_name)
+
+    ### Case where user wants to leave a room ###:
+    def _cmd_leave(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /leave #room OR /leave all
+        '''
+        # Case where user just submits "/leave"
+        if len(words) == 1:
+            sender_socket.send("/leave requires a #room_name argument.\nPlease enter: /leave #roomname\n".encode('ascii'))
+            return "/leave requires a #room_name argument.\nPlease enter: /leave #roomname\n"
+
+        # case where user wants to leave ALL their active rooms
+        elif words[1] == 'all':
+            self.leave_all(sender_name)
+
+        # otherwise try to remove from single room
+        else:
+            room_to_leave = words[1]
+            # case where user forgets to include "#" in "#room_name"
+            if room_to_leave[0] != "#":
+                sender_socket.send("/leave requires a #roomname argument to begin with '#'.\n".encode('ascii'))
+                return "/leave requires a #roomname argument to begin with '#'.\n"
+            # leave room...
             else:
-                room = message.split()[1]
-                # case where the room doesn't actually exist
-                if room not in self.rooms.keys():
-                    sender_socket.send(f'Error: {room} doesnt exist!'.encode('ascii'))
-                # send user list
-                else:
-                    sender_socket.send(f'{room} users: {self.rooms[room].get_users()}'.encode('ascii'))
-
-        ### Case where user wants to send *distinct* messages to *multiple* rooms ###
-        elif message.split()[0] == '/broadcast':
-            '''
-            syntax: /broadcast #room1 : <message> / #room2 : <message> / ...
-            '''
-            # case where user forgets args
-            if len(message.split()) == 1:
-                sender_socket.send('Error: must include at least one room name and messsage! \nex: /broadcast #room_name : <message> /'.encode('ascii'))
-                return 'Error: must include at least one room name and messsage! \nex: /broadcast #room_name : <message> /'
-            
-            # case where user doesn't include a message
-            elif len(message.split()) == 2:
-                sender_socket.send('Error: must include a message! \nex: /broadcast #room_name : <message> /'.encode('ascii'))
-                return 'Error: must include a message! \nex: /broadcast #room_name : <message> /'
+                sender_socket.send(f'Leaving {room_to_leave}...'.encode('ascii'))
+                # this sends the user back to the #lobby!
+                self.leave_room(room_to_leave, sender_name)
+
+    ### Case where user wants to list all active rooms ###
+    def _cmd_rooms(self, message, words, sender_name, sender_socket):
+        if len(self.rooms) > 0:
+            rooms = f'Active rooms: \n{self.list_all_rooms()}'
+            sender_socket.send(rooms.encode('ascii'))
+        else:
+            sender_socket.send('Error: no active rooms!'.encode('ascii'))
 
-            # case where message doesn't end with a '/'
-            elif message.split()[-1] != '/':
-                sender_socket.send('Error: all messages must end with a "/" to denote ending. \nex: /broadcast #room_name : <message> /'.encode('ascii'))
-                return 'Error: all messages must end with a "/" to denote ending. \nex: /broadcast #room_name : <message> /'
+    ### Case where a user wants a list of all their active rooms ###
+    def _cmd_myrooms(self, message, words, sender_name, sender_socket):
+        self.list_my_rooms(sender_name)
 
-            # otherwise, try to parse
+    ### Case where user wants list of other users in their current room ###
+    def _cmd_users(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /users #room_name
+        '''
+        # case where user forgets to add a room name argument
+        if len(words) == 1:
+            sender_socket.send('Error: /users requires a room name argument \nex: /users #room_name'.encode('ascii'))
+        # case where room_name doesn't start with a '#'
+        elif '#' not in words[1]:
+            sender_socket.send('Error: room name arg must start with "#" \nex: /users #room_name'.encode('ascii'))
+        else:
+            room = words[1]
+            # members on other workers, if there are any
+            remote = self.relay.room_users(room) if self.relay is not None else []
+            # case where the room doesn't actually exist
+            if room not in self.rooms.keys() and not remote:
+                sender_socket.send(f'Error: {room} doesnt exist!'.encode('ascii'))
+            # send user list
             else:
-                message_ = message.split()
-                # remove /broadcast command
-                message_.pop(0)
-                # get room name, then save each word to message list 
-                # "Rooms" = list of rooms (list[str]), "Messages" = list individual messages (list[str])
-                messages = {"Rooms": [], "Messages": []}
-                word = 0
-                while word < len(message_):
-                    # is this a room name?
-                    if message_[word][0] == '#' and message_[word + 1] == ':':
-                        messages['Rooms'].append(message_[word])
-                        word += 1
-                    # skip ':'
-                    elif message_[word] == ':':
-                        word += 1 
-                    # else, keep adding words until we reach '/'
-                    else:
-                        # start at current place in iteration
-                        w = word 
-                        message_text = []
-                        # retreive the message for *this* room
-                        while w < len(message_):
-                            if message_[w] == '/': # have we reached the end of the message?
-                                break
-                            elif message_[w][-1] == '/': # did the user accidentally attach '/' to the last word?
-                                # remove /, then add to list
-                                wrd = list(message_[w]).remove('/')
-                                wrd = " ".join(wrd)
-                                message_text.append(wrd)
-                                # is the next word a room name? 
-                                # if so, break since this was clearly a typo
-                                # also trying to avoid an index error.
-                                if  w < len(message_) and message_[w + 1][0] == '#': 
-                                    break # exit loop since this was meant to denote the end of the message
-                            else:
-                                message_text.append(message_[w])
-                            w += 1
-                        messages["Messages"].append(" ".join(message_text))
-                        word = w + 1 # update outer loop placement so we don't keep recopying the messages
-
-                # make sure the total number of room names equals the total number of messages
-                if len(messages['Rooms']) != len(messages['Messages']):
-                    sender_socket.send('Error: unequal amounts of rooms and messages!'.encode('ascii'))
-                    return 'Error: unequal amounts of rooms and messages!'
+                users = [self.rooms[room].get_users()] if room in self.rooms.keys() else []
+                users = ' '.join(users + remote)
+                sender_socket.send(f'{room} users: {users}'.encode('ascii'))
+
+    ### Case where user wants to see a room's recent messages ###
+    def _cmd_history(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /history #room_name (opt) <number of lines>
+        '''
+        # case where user forgets to add a room name argument
+        if len(words) == 1 or len(words) > 3:
+            sender_socket.send('Error: /history requires a room name argument \nex: /history #room_name 10'.encode('ascii'))
+            return 'Error: /history requires a room name argument \nex: /history #room_name 10'
+        # case where room_name doesn't start with a '#'
+        elif words[1][0] != '#':
+            sender_socket.send('Error: room name arg must start with "#" \nex: /history #room_name 10'.encode('ascii'))
+            return 'Error: room name arg must start with "#" \nex: /history #room_name 10'
+        # case where the line count isn't a positive number
+        elif len(words) == 3 and (not words[2].isdigit() or int(words[2]) < 1):
+            sender_socket.send('Error: number of lines must be a positive number! \nex: /history #room_name 10'.encode('ascii'))
+            return 'Error: number of lines must be a positive number! \nex: /history #room_name 10'
+
+        room_name = words[1]
+        count = min(int(words[2]), HISTORY_MAX) if len(words) == 3 else HISTORY_REPLAY
+        room = self.rooms.get(room_name)
+        # case where the room doesn't actually exist
+        if room is None:
+            sender_socket.send(f'Error: {room_name} doesnt exist!'.encode('ascii'))
+            return f'Error: {room_name} doesnt exist!'
+        # only members get to read a room's history
+        elif not room.has_user(sender_name):
+            sender_socket.send(f'Error: you are not in {room_name}!'.encode('ascii'))
+            return f'Error: you are not in {room_name}!'
+        history = self.send_history(room, sender_name, count)
+        if history is None:
+            sender_socket.send(f'No messages in {room_name} yet!'.encode('ascii'))
+            return f'No messages in {room_name} yet!'
+        return history
+
+    ### Case where user wants to search a room's messages ###
+    def _cmd_search(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /search #room_name <terms>
+        '''
+        # case where search is turned off on this server
+        if self.search is None:
+            sender_socket.send('Error: search is not enabled on this server!'.encode('ascii'))
+            return 'Error: search is not enabled on this server!'
+        # case where user forgets the room or the terms
+        elif len(words) < 3:
+            sender_socket.send('Error: /search requires a room name and search terms \nex: /search #room_name <terms>'.encode('ascii'))
+            return 'Error: /search requires a room name and search terms \nex: /search #room_name <terms>'
+        # case where room_name doesn't start with a '#'
+        elif words[1][0] != '#':
+            sender_socket.send('Error: room name arg must start with "#" \nex: /search #room_name <terms>'.encode('ascii'))
+            return 'Error: room name arg must start with "#" \nex: /search #room_name <terms>'
+
+        room_name = words[1]
+        terms = ' '.join(words[2:])
+        room = self.rooms.get(room_name)
+        # case where the room doesn't actually exist
+        if room is None:
+            sender_socket.send(f'Error: {room_name} doesnt exist!'.encode('ascii'))
+            return f'Error: {room_name} doesnt exist!'
+        # only members get to search a room
+        elif not room.has_user(sender_name):
+            sender_socket.send(f'Error: you are not in {room_name}!'.encode('ascii'))
+            return f'Error: you are not in {room_name}!'
+
+        # leave out anyone the searcher blocked, before the limit is applied,
+        # so they can't push everything else out. a frame is "#room sender : ..."
+        user = self.users[sender_name]
+        keep = lambda frame: not user.has_blocked(frame.split(b' ', 2)[1].decode('ascii'))
+        results = self.search.search(room_name, terms, SEARCH_LIMIT, keep)
+        searched = None
+        if len(results) < SEARCH_LIMIT:
+            results, searched = self.search_older(room_name, terms, results, keep)
+        # say so when older messages weren't searched, rather than passing
+        # off what was found as everything
+        note = b''
+        if searched is not None:
+            note = f'\n(only the newest {searched} messages in {room_name} were searched)'.encode('ascii')
+        if not results:
+            reply = f'No results for "{terms}" in {room_name}'.encode('ascii') + note
+        else:
+            reply = f'Results for "{terms}" in {room_name}:\n'.encode('ascii') + b'\n'.join(results) + note
+        sender_socket.send(reply)
+        return reply.decode('ascii')
+
+    # look further back than the search index goes
+    def search_older(self, room_name, terms, found, keep):
+        '''
+        /search, for the messages in a room the search index doesn't hold:
+        the ones it dropped, and any from before the server started. they
+        are read from the message log, newest first, up to
+        SEARCH_LOG_MESSAGES of them.
+
+        returns (results, searched): found with older matches in front of
+        it (at most SEARCH_LIMIT in all, oldest first), and how many of the
+        room's newest messages were searched, or None if that's all of them
+        (or there are SEARCH_LIMIT results anyway).
+
+        parameters
+        -----------
+        - room_name = ''
+        - terms = '' (words to look for)
+        - found = list of frames (bytes) the index found, oldest first
+        - keep = function (keep(frame) is False for frames to leave out)
+        '''
+        held, dropped = self.search.coverage(room_name)
+        if self.log is None:
+            return found, held if dropped else None
+        words = tokenize(terms)
+        older = []
+        scanned = 0
+        while len(found) + len(older) < SEARCH_LIMIT:
+            if scanned >= SEARCH_LOG_MESSAGES:
+                return older[::-1] + found, held + scanned
+            page = self.log.older(room_name, held + scanned, min(SEARCH_LOG_PAGE, SEARCH_LOG_MESSAGES - scanned))
+            if not page:
+                break
+            # frames point into the log. a frame is "#room sender : message "
+            frames = [frame for _, _, _, frame in page]
+            texts = [bytes(frame).split(b' : ', 1)[-1] for frame in frames]
+            for index in reversed(scan(texts, words)):
+                frame = bytes(frames[index])
+                if keep(frame):
+                    older.append(frame)
+                    if len(found) + len(older) == SEARCH_LIMIT:
+                        break
+            scanned += len(page)
+        return older[::-1] + found, None
+
+    ### Case where user wants to send *distinct* messages to *multiple* rooms ###
+    def _cmd_broadcast(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /broadcast #room1 : <message> / #room2 : <message> / ...
+        '''
+        # case where user forgets args
+        if len(words) == 1:
+            sender_socket.send('Error: must include at least one room name and messsage! \nex: /broadcast #room_name : <message> /'.encode('ascii'))
+            return 'Error: must include at least one room name and messsage! \nex: /broadcast #room_name : <message> /'
+        
+        # case where user doesn't include a message
+        elif len(words) == 2:
+            sender_socket.send('Error: must include a message! \nex: /broadcast #room_name : <message> /'.encode('ascii'))
+            return 'Error: must include a message! \nex: /broadcast #room_name : <message> /'
+
+        # case where message doesn't end with a '/'
+        elif words[-1] != '/':
+            sender_socket.send('Error: all messages must end with a "/" to denote ending. \nex: /broadcast #room_name : <message> /'.encode('ascii'))
+            return 'Error: all messages must end with a "/" to denote ending. \nex: /broadcast #room_name : <message> /'
+
+        # otherwise, try to parse
+        else:
+            messages = parse_broadcast(words[1:])
+            # make sure every room name came with a message
+            if messages is None:
+                sender_socket.send('Error: unequal amounts of rooms and messages!'.encode('ascii'))
+                return 'Error: unequal amounts of rooms and messages!'
+            # send each message to its room, one fan out per room
+            for rm, msg in zip(messages["Rooms"], messages["Messages"]):
+                if self.is_room(rm):
+                    self.broadcast(self.rooms[rm], sender_name, msg)
                 else:
-                    # send each message to each room
-                    for item in range(len(messages['Rooms'])):
-                        # get current room, send message
-                        rm = messages["Rooms"][item]
-                        msg = " ".join(messages["Messages"][item])
-                        if self.is_room(rm):
-                            message_broadcast(self.rooms[rm], sender_name, msg)
-                        else:
-                            sender_socket.send(f'Error: {rm} doesnt exist!'.encode('ascii'))
-
-                return messages
-
-        ### Case where user wants to mute some of their active rooms ###
-        elif message.split()[0] == '/mute':
-            '''
-            syntax: /mute #room1 #room2
-            '''
-            # case where user forgets #
-            if '#' not in message.split()[1]:
-                sender_socket.send('Error: command must start with a /!'.encode('ascii'))
-            # case where user forgets first arg
-            elif len(message.split()) == 1:
-                sender_socket.send('Error: must include at least one room name argument. \nex: /mute #roomname'.encode('ascii'))
-            # mute room(s)
-            else:
-                message_ = message.split()
-                for word in message_:
+                    sender_socket.send(f'Error: {rm} doesnt exist!'.encode('ascii'))
+
+            return messages
+
+    ### Case where user wants to mute some of their active rooms ###
+    def _cmd_mute(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /mute #room1 #room2
+        '''
+        # case where user forgets first arg
+        if len(words) == 1:
+            sender_socket.send('Error: must include at least one room name argument. \nex: /mute #roomname'.encode('ascii'))
+        # case where user forgets #
+        elif '#' not in words[1]:
+            sender_socket.send('Error: command must start with a /!'.encode('ascii'))
+        # mute room(s)
+        else:
+            for word in words:
+                # make sure this is actually a room name
+                if word[0] == '#' and word in self.rooms.keys():
+                    self.mute(sender_name, word)
+
+    ### Case where a user wants to unmute some of their active rooms
+    def _cmd_unmute(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /unmute #room1 #room2... -or- /unmute all
+        '''
+        # case where user forgets first arg
+        if len(words) == 1:
+            sender_socket.send('Error: must include at least one room name argument. \nex: /mute #roomname'.encode('ascii'))
+        # case where user forgets # and the second arg isn't 'all'
+        elif len(words) == 2 and '#' not in words[1] and words[1] != 'all':
+            sender_socket.send('Error: room name must start with a "#"! \nex: /unmute #roomname'.encode('ascii'))
+        # otherwise unmute the room(s)...
+        else:
+            # Unmute *all* muted rooms for this user or n amount of specified rooms
+            if words[1] == 'all' or words.count('#') > 1:
+                for word in words:
                     # make sure this is actually a room name
                     if word[0] == '#' and word in self.rooms.keys():
-                        self.users[sender_name].mute(word)
-    
-        ### Case where a user wants to unmute some of their active rooms
-        elif message.split()[0] == '/unmute':
-            '''
-            syntax: /unmute #room1 #room2... -or- /unmute all
-            '''
-            # case where user forgets first arg
-            if len(message.split()) == 1:
-                sender_socket.send('Error: must include at least one room name argument. \nex: /mute #roomname'.encode('ascii'))
-            # case where user forgets # and the second arg isn't 'all'
-            elif len(message.split()) == 2 and '#' not in message.split()[1] and message.split()[1] != 'all':
-                sender_socket.send('Error: room name must start with a "#"! \nex: /unmute #roomname'.encode('ascii'))
-            # otherwise unmute the room(s)...
-            else:
-                # Unmute *all* muted rooms for this user or n amount of specified rooms
-                if message.split()[1] == 'all' or message.split().count('#') > 1:
-                    message_ = message.split()
-                    for word in message_:
-                        # make sure this is actually a room name
-                        if word[0] == '#' and word in self.rooms.keys():
-                            self.users[sender_name].unmute(word)
-                            sender_socket.send(f'{word} has been unmuted!'.encode('ascii'))
-                # unmute *one* room
-                else:
-                    room = message.split()[1]
-                    self.users[sender_name].unmute(room)
-
-        ### Case where user wants to directly message another user ###
-        elif message.split()[0] == "/message":
-            '''
-            syntax - /message @<user_name> <message>
-            '''
-            # case where client doesn't include a user_name
-            if len(message.split()) == 1:
-                sender_socket.send('Error: /message requires a username argument. \nex: /message @<user_name> <message>'.encode('ascii'))
-                return 'Error: /message requires a username argument. \nex: /message @<user_name> <message>'
-            # case where user tries to message more than one person at a time.
-            elif list(message).count('@') > 1:
-                sender_socket.send('Error: /message only takes one username argument. \nex: /message @<user_name> <message>'.encode('ascii'))
-                return 'Error: /message only takes one username argument. \nex: /message @<user_name> <message>'
-            # get receiver's name then send message
+                        self.unmute(sender_name, word)
+                        sender_socket.send(f'{word} has been unmuted!'.encode('ascii'))
+            # unmute *one* room
             else:
-                receiver = self.parse_user_name(message.split()[1]) # get receiver's name
-                message_text = ' '.join(message.split()[2:])        # get message text                
-                # send dm
-                self.send_dm(sender_name, message_text, receiver)
-                
-        ### Case where a user wants to check their direct messages ###
-        elif message.split()[0] == "/dms":
-            '''
-            syntax - /dms (opt) @<sender_name> 
-            '''
-            # check if there's a specific user they're looking for
-            if len(message.split()) > 1:
-                dm_sender = message.split()[1]
-                if dm_sender[0] == '@':
-                    # remove @ symbol
-                    dm_sender = self.parse_user_name(dm_sender)
-                    # get dm's
-                    self.read_dms(sender_name, dm_sender)
-                else:
-                    sender_socket.send('Error: /message requires a "@" character to denote a user, ie @user_name'.encode('ascii'))
-                    return 'Error: /message requires a "@" character to denote a user, ie @user_name'
-            # otherwise just get all their dms
-            else:
-                # otherwise retrieve all dms for this user
-                self.read_dms(sender_name)
-
-        ### Case where a user wants to whisper to another user in the same chatroom ###
-        elif message.split()[0] == '/whisper':
-            '''
-            syntax: /whisper @<user_name>
-            ''' 
-            # case where there's no username or text argument
-            if len(message.split()) == 1:
-                sender_socket.send('Error: No username argument found! \nuse syntax /whisper @<user_name> <message>'.encode('ascii'))
-                return 'Error: No username argument found! \nuse syntax /whisper @<user_name> <message>'
-
-            # case where we try to message more than one user
-            elif list(message).count('@') > 1:
-                sender_socket.send('Error: too many username arguments found! \nuse syntax /whisper @<user_name> <message>'.encode('ascii'))
-                return 'Error: too many username arguments found! \nuse syntax /whisper @<user_name> <message>'
-
-            # otherwise, get receiver name and send to method
+                self.unmute(sender_name, words[1])
+
+    ### Case where user wants to directly message another user ###
+    def _cmd_message(self, message, words, sender_name, sender_socket):
+        '''
+        syntax - /message @<user_name> <message>
+        '''
+        # case where client doesn't include a user_name
+        if len(words) == 1:
+            sender_socket.send('Error: /message requires a username argument. \nex: /message @<user_name> <message>'.encode('ascii'))
+            return 'Error: /message requires a username argument. \nex: /message @<user_name> <message>'
+        # case where user tries to message more than one person at a time.
+        elif message.count('@') > 1:
+            sender_socket.send('Error: /message only takes one username argument. \nex: /message @<user_name> <message>'.encode('ascii'))
+            return 'Error: /message only takes one username argument. \nex: /message @<user_name> <message>'
+        # get receiver's name then send message
+        else:
+            receiver = self.parse_user_name(words[1]) # get receiver's name
+            message_text = ' '.join(words[2:])        # get message text                
+            # send dm
+            self.send_dm(sender_name, message_text, receiver)
+            
+    ### Case where a user wants to check their direct messages ###
+    def _cmd_dms(self, message, words, sender_name, sender_socket):
+        '''
+        syntax - /dms (opt) @<sender_name> (opt) <page>
+                 /dms more
+        '''
+        # case where they want more of what was kept while they were away
+        if len(words) == 2 and words[1] == 'more':
+            if self.dmstore is None:
+                sender_socket.send('Error: no messages are kept on this server!'.encode('ascii'))
+                return 'Error: no messages are kept on this server!'
+            # they come back on the store's thread, see deliver_more_dms()
+            self.dmstore.take(sender_name, self.deliver_more_dms)
+            sender_socket.send('Getting your waiting messages...'.encode('ascii'))
+            return 'Getting your waiting messages...'
+        # check if there's a specific user they're looking for
+        elif len(words) > 1:
+            dm_sender = words[1]
+            if dm_sender[0] == '@':
+                # case where the page isn't a positive number
+                if len(words) > 2 and (len(words) > 3 or not words[2].isdigit() or int(words[2]) < 1):
+                    sender_socket.send('Error: page number must be a positive number! \nex: /dms @user_name 2'.encode('ascii'))
+                    return 'Error: page number must be a positive number! \nex: /dms @user_name 2'
+                page = int(words[2]) if len(words) == 3 else 1
+                # remove @ symbol
+                dm_sender = self.parse_user_name(dm_sender)
+                # get a page of dm's
+                return self.read_dms(sender_name, dm_sender, page)
             else:
-                # get receiver's name, then message text
-                message_ = message.split()
-                message_.pop(0)  # get rid of command
-                receiver = message_[0]
-                message_.pop(0)  # get rid of receiver name
-                self.send_whisper(sender_name, " ".join(message_), receiver)
-
-        ### Case where user wants to block DM's from another user ###
-        elif message.split()[0] == "/block":
-            '''
-            syntax: /block @user1 (opt) @user2...
-            '''
-            # case where the users messes up, yet again
-            if len(message.split()) == 1:
-                sender_socket.send('Error: /block requires at least one user_name argument!'.encode('ascii'))
-                return 'Error: /block requires at least one user_name argument!'
-            message_ = message.split()
-            # remove the command, then iterate through list
-            message_.pop(0)
-            to_block = []
-            for name in message_:
-                # make sure we remove the '@' symbol. 
-                if name[0] == '@':
-                    to_block.append(self.parse_user_name(name))
-            # send to User() to block each name sent in
-            for name in to_block:
-                self.block(sender_name, name)
-
-        ### Case where user wants to un-block another user ###
-        elif message.split()[0] == "/unblock":
-            '''
-            syntax: /unblock @user1 (opt) @user2...
-            '''
-            # case where the users messes up, yet again
-            if len(message.split()) == 1:
-                sender_socket.send('Error: /unblock requires at least one user_name argument!'.encode('ascii'))
-                return 'Error: /unblock requires at least one user_name argument!'
-            message_ = message.split()
-            # remove the command, then iterate through list
-            message_.pop(0)
-            to_unblock = []
-            for name in message_:
-                if name[0] == '@':
-                    to_unblock.append(self.parse_user_name(name))
-            # send to User() to block each name sent in
-            for name in to_unblock:
-                self.unblock(sender_name, name)
-
-        # anything else...
+                sender_socket.send('Error: /message requires a "@" character to denote a user, ie @user_name'.encode('ascii'))
+                return 'Error: /message requires a "@" character to denote a user, ie @user_name'
+        # otherwise just get all their dms
+        else:
+            # otherwise list every conversation this user has
+            return self.read_dms(sender_name)
+
+    ### Case where a user wants to whisper to another user in the same chatroom ###
+    def _cmd_whisper(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /whisper @<user_name>
+        ''' 
+        # case where there's no username or text argument
+        if len(words) == 1:
+            sender_socket.send('Error: No username argument found! \nuse syntax /whisper @<user_name> <message>'.encode('ascii'))
+            return 'Error: No username argument found! \nuse syntax /whisper @<user_name> <message>'
+
+        # case where we try to message more than one user
+        elif message.count('@') > 1:
+            sender_socket.send('Error: too many username arguments found! \nuse syntax /whisper @<user_name> <message>'.encode('ascii'))
+            return 'Error: too many username arguments found! \nuse syntax /whisper @<user_name> <message>'
+
+        # otherwise, get receiver name and send to method
         else:
-            sender_socket.send(f'{message.split()[0]} is not a valid command!'.encode('ascii'))
-            return f'{message.split()[0]} is not a valid command!'
\ No newline at end of file
+            # words[1] is the receiver's name, then the message text
+            self.send_whisper(sender_name, " ".join(words[2:]), words[1])
+
+    ### Case where user wants to block DM's from another user ###
+    def _cmd_block(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /block @user1 (opt) @user2...
+        '''
+        # case where the users messes up, yet again
+        if len(words) == 1:
+            sender_socket.send('Error: /block requires at least one user_name argument!'.encode('ascii'))
+            return 'Error: /block requires at least one user_name argument!'
+        # skip the command. make sure we remove the '@' symbol. 
+        to_block = [self.parse_user_name(name) for name in words[1:] if name[0] == '@']
+        # send to User() to block each name sent in
+        for name in to_block:
+            self.block(sender_name, name)
+
+    ### Case where user wants to un-block another user ###
+    def _cmd_unblock(self, message, words, sender_name, sender_socket):
+        '''
+        syntax: /unblock @user1 (opt) @user2...
+        '''
+        # case where the users messes up, yet again
+        if len(words) == 1:
+            sender_socket.send('Error: /unblock requires at least one user_name argument!'.encode('ascii'))
+            return 'Error: /unblock requires at least one user_name argument!'
+        # skip the command, then remove the '@' symbol
+        to_unblock = [self.parse_user_name(name) for name in words[1:] if name[0] == '@']
+        # send to User() to block each name sent in
+        for name in to_unblock:
+            self.unblock(sender_name, name)
+
+    # command registry for message_parser(). 
+    # key is the command (str), value is the handler method
+    COMMANDS = {
+        '/join': _cmd_join,
+        '/create': _cmd_create,
+        '/leave': _cmd_leave,
+        '/rooms': _cmd_rooms,
+        '/myrooms': _cmd_myrooms,
+        '/users': _cmd_users,
+        '/history': _cmd_history,
+        '/search': _cmd_search,
+        '/broadcast': _cmd_broadcast,
+        '/mute': _cmd_mute,
+        '/unmute': _cmd_unmute,
+        '/message': _cmd_message,
+        '/dms': _cmd_dms,
+        '/whisper': _cmd_whisper,
+        '/block': _cmd_block,
+        '/unblock': _cmd_unblock,
+    }
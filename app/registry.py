@@ -0,0 +1,88 @@
+'''
+session registry module.
+
+keeps track of connected clients for the server, indexed both by the
+client socket's file descriptor and by username, so lookups, inserts and
+removals are all O(1) no matter how many users are connected.
+'''
+
+import threading
+from collections import namedtuple
+
+# one connected client.
+# fd = socket file descriptor (int), name = username (str), client = socket-like object
+Session = namedtuple('Session', ['fd', 'name', 'client'])
+
+
+class SessionRegistry:
+    '''
+    thread-safe index of connected clients.
+
+    sessions are keyed by file descriptor rather than the socket object,
+    since the fd is captured when the client connects and stays valid as
+    a key even after the socket has been shut down.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key is fd (int), value is Session()
+        self.by_fd = {}
+        # key is username (str), value is Session()
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.by_fd)
+
+    def __contains__(self, fd):
+        return fd in self.by_fd
+
+    def add(self, fd, user_name, client):
+        '''
+        register a new session. returns False if the fd or username
+        is already registered.
+
+        parameters
+        -----------
+        - fd = int (client.fileno())
+        - user_name = ''
+        - client = socket() object
+        '''
+        with self.lock:
+            if fd in self.by_fd or user_name in self.by_name:
+                return False
+            session = Session(fd, user_name, client)
+            self.by_fd[fd] = session
+            self.by_name[user_name] = session
+            return True
+
+    def find(self, fd):
+        '''
+        returns the Session() for this fd, or None
+        '''
+        return self.by_fd.get(fd)
+
+    def find_user(self, user_name):
+        '''
+        returns the Session() for this username, or None
+        '''
+        return self.by_name.get(user_name)
+
+    def remove(self, fd, session=None):
+        '''
+        removes and returns the Session() for this fd, or None if there wasn't one.
+        given a session, only removes it if it's still the one registered for
+        fd: once a socket is closed its fd can be handed to a new client.
+        '''
+        with self.lock:
+            found = self.by_fd.get(fd)
+            if found is None or (session is not None and found is not session):
+                return None
+            del self.by_fd[fd]
+            del self.by_name[found.name]
+            return found
+
+    def sessions(self):
+        '''
+        returns a list of every Session() (a snapshot, safe to iterate)
+        '''
+        with self.lock:
+            return list(self.by_fd.values())
@@ -0,0 +1,347 @@
+'''
+relay module.
+
+lets several server worker processes, each with their own PyRC() instance,
+act like one chat server. a RelayHub() runs in the supervisor process and
+every worker connects to it with a RelayClient() over a unix socket.
+
+records are small dicts sent as newline-delimited json. kinds:
+
+- join    {user}                       user connected to a worker
+- leave   {user}                       user disconnected from a worker
+- enter   {room, user}                 user joined a room on a worker
+- exit    {room, user}                 user left a room on a worker
+- room    {room, sender, message}      message_broadcast() traffic
+- rooms   {rooms, sender, message}     message_multicast() traffic
+- whisper {sender, receiver, message}  /whisper traffic
+- dm      {sender, receiver, message}  /message traffic
+- notice  {receiver, message}          plain text for a single user
+
+nothing here writes to a relay socket on the thread that has the record.
+every connection is a Link(): records are queued, and the link's own
+writer thread sends them. so a worker that stops reading can't stall
+the hub (or, through it, every other worker), and the hub never does a
+socket write while holding its lock.
+'''
+
+import collections
+import json
+import os
+import socket
+import threading
+
+# most bytes a link queues before it's given up on
+MAX_QUEUED = 64 * 1024 * 1024
+
+
+def encode_record(record):
+    '''
+    turns a record dict into bytes for the relay socket
+    '''
+    return json.dumps(record).encode('ascii') + b'\n'
+
+
+def decode_record(line):
+    '''
+    turns a line read off the relay socket back into a record dict
+    '''
+    return json.loads(line.decode('ascii'))
+
+
+class Link:
+    '''
+    one relay connection's outbound side: a queue of records (bytes) and
+    a writer thread that sends them, in order. put() never blocks.
+
+    parameters
+    -----------
+    - sock = socket() object
+    - max_bytes = int (most bytes queued. put() drops anything past that)
+    '''
+    def __init__(self, sock, max_bytes=MAX_QUEUED):
+        self.socket = sock
+        self.max_bytes = max_bytes
+        self.frames = collections.deque()
+        self.queued_bytes = 0
+        # records dropped because the link was full or closed
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.writer = threading.Thread(target=self._drain, daemon=True)
+        self.writer.start()
+
+    def put(self, data):
+        '''
+        queue data (bytes) to be sent. returns False if it was dropped
+        '''
+        with self.cond:
+            if self.closed or self.queued_bytes + len(data) > self.max_bytes:
+                self.dropped += 1
+                return False
+            self.frames.append(data)
+            self.queued_bytes += len(data)
+            self.cond.notify()
+            return True
+
+    def _drain(self):
+        while True:
+            with self.cond:
+                while not self.frames and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                batch = b''.join(self.frames)
+                self.frames.clear()
+            try:
+                self.socket.sendall(batch)
+            except OSError:
+                self.close()
+                return
+            with self.cond:
+                self.queued_bytes -= len(batch)
+
+    def close(self):
+        '''
+        drop whatever is queued and stop the writer thread. the socket
+        itself is left to whoever owns it.
+        '''
+        with self.cond:
+            self.closed = True
+            self.dropped += len(self.frames)
+            self.frames.clear()
+            self.cond.notify()
+
+
+class RelayHub:
+    '''
+    runs in the supervisor. forwards records between worker processes
+    and keeps a directory of which worker each user is connected to,
+    so that whispers and dms only go to the worker that needs them.
+
+    parameters
+    -----------
+    - path = '' (unix socket to listen on)
+    - max_queued = int (most bytes queued for a worker before it's
+                   disconnected, see Link())
+    '''
+    def __init__(self, path, max_queued=MAX_QUEUED):
+        self.path = path
+        self.max_queued = max_queued
+        self.socket = None
+        self.running = False
+        self.lock = threading.Lock()
+        # key is worker connection (socket() object), value is a set of user names
+        self.workers = {}
+        # key is worker connection, value is the Link() that writes to it
+        self.links = {}
+        # key is user name (str), value is the worker connection they're on
+        self.directory = {}
+        # key is user name (str), value is a set of the room names they're in
+        self.memberships = {}
+
+    def start(self):
+        '''
+        bind the unix socket and start accepting workers in a background thread
+        '''
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen()
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def stop(self):
+        '''
+        stop accepting workers and close every connection
+        '''
+        self.running = False
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+        with self.lock:
+            for conn in list(self.workers):
+                self.links[conn].close()
+                conn.close()
+            self.workers.clear()
+            self.links.clear()
+            self.directory.clear()
+            self.memberships.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.socket.accept()
+            except OSError:
+                break
+            link = Link(conn, self.max_queued)
+            with self.lock:
+                self.workers[conn] = set()
+                self.links[conn] = link
+                # let the new worker know who is already connected elsewhere.
+                # queued under the lock, so nothing routed after can overtake it
+                for user in self.directory:
+                    link.put(encode_record({'kind': 'join', 'user': user}))
+                for user, rooms in self.memberships.items():
+                    for room in rooms:
+                        link.put(encode_record({'kind': 'enter', 'room': room, 'user': user}))
+            threading.Thread(target=self._worker_loop, args=(conn,), daemon=True).start()
+
+    def _worker_loop(self, conn):
+        reader = conn.makefile('rb')
+        try:
+            for line in reader:
+                self.route(conn, decode_record(line))
+        except (OSError, ValueError):
+            pass
+        # worker went away. everyone it was hosting has left.
+        with self.lock:
+            users = self.workers.pop(conn, set())
+            link = self.links.pop(conn, None)
+            for user in users:
+                self.directory.pop(user, None)
+                self.memberships.pop(user, None)
+        if link is not None:
+            link.close()
+        for user in users:
+            self.route(None, {'kind': 'leave', 'user': user})
+        conn.close()
+
+    def route(self, origin, record):
+        '''
+        forward a record from one worker (origin) to the others.
+
+        records with a receiver go straight to the worker hosting them. if
+        nobody is (they just left), they go back to the worker they came
+        from, so a DM for them is stored once, not by every worker.
+        everything else goes to every worker except the one it came from.
+        the record is only queued on each worker's Link(), which never
+        blocks, so a slow worker doesn't hold up the others. a worker so
+        far behind that its link fills up is disconnected.
+        '''
+        data = encode_record(record)
+        full = []
+        with self.lock:
+            if record['kind'] == 'join' and origin is not None and origin in self.workers:
+                self.workers[origin].add(record['user'])
+                self.directory[record['user']] = origin
+            elif record['kind'] == 'leave' and origin is not None and origin in self.workers:
+                self.workers[origin].discard(record['user'])
+                self.directory.pop(record['user'], None)
+                self.memberships.pop(record['user'], None)
+            elif record['kind'] == 'enter' and origin in self.workers:
+                self.memberships.setdefault(record['user'], set()).add(record['room'])
+            elif record['kind'] == 'exit' and origin in self.workers:
+                self.memberships.get(record['user'], set()).discard(record['room'])
+
+            target = self.directory.get(record.get('receiver'))
+            if target is not None:
+                targets = [target]
+            elif 'receiver' in record and origin in self.links:
+                targets = [origin]
+            else:
+                targets = [conn for conn in self.workers if conn is not origin]
+
+            # queued in the order routed, so every worker sees the same order
+            for conn in targets:
+                if not self.links[conn].put(data):
+                    full.append(conn)
+        # its reader sees the disconnect, and cleans up after it
+        for conn in full:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class RelayClient:
+    '''
+    runs in each worker. publishes local traffic to the hub, and hands
+    traffic from other workers to PyRC.relay_receive().
+
+    parameters
+    -----------
+    - path = '' path to the hub's unix socket
+    - dispatch = None (optional callable. dispatch(func, record) is used to
+                       run func(record) on the right thread, i.e. the event
+                       loop in async mode. default is to call it directly)
+    '''
+    def __init__(self, path, dispatch=None):
+        self.path = path
+        self.dispatch = dispatch
+        self.socket = None
+        # writes to the hub, see Link()
+        self.link = None
+        self.app = None
+        # users connected to *other* workers
+        self.remote_users = set()
+        # key is a remote user's name, value is a set of the room names they're in
+        self.remote_rooms = {}
+        self.rooms_lock = threading.Lock()
+
+    def connect(self, app):
+        '''
+        connect to the hub and attach this relay to a PyRC() instance
+        '''
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.path)
+        self.link = Link(self.socket)
+        self.app = app
+        app.relay = self
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def close(self):
+        self.link.close()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def is_remote(self, user_name):
+        '''
+        is this user connected to another worker?
+        '''
+        return user_name in self.remote_users
+
+    def room_users(self, room_name):
+        '''
+        sorted names of the users in a room on other workers
+        '''
+        with self.rooms_lock:
+            return sorted(user for user, rooms in self.remote_rooms.items() if room_name in rooms)
+
+    def publish(self, kind, **fields):
+        '''
+        send a record to the hub. only queues it, so it never blocks
+        (and is dropped if the hub has stopped reading, see Link())
+        '''
+        fields['kind'] = kind
+        self.link.put(encode_record(fields))
+
+    def _read_loop(self):
+        reader = self.socket.makefile('rb')
+        try:
+            for line in reader:
+                record = decode_record(line)
+                if record['kind'] == 'join':
+                    self.remote_users.add(record['user'])
+                elif record['kind'] == 'leave':
+                    self.remote_users.discard(record['user'])
+                    with self.rooms_lock:
+                        self.remote_rooms.pop(record['user'], None)
+                elif record['kind'] == 'enter':
+                    with self.rooms_lock:
+                        self.remote_rooms.setdefault(record['user'], set()).add(record['room'])
+                elif record['kind'] == 'exit':
+                    with self.rooms_lock:
+                        self.remote_rooms.get(record['user'], set()).discard(record['room'])
+                elif self.dispatch is not None:
+                    self.dispatch(self.app.relay_receive, record)
+                else:
+                    self.app.relay_receive(record)
+        except (OSError, ValueError):
+            pass
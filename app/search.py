@@ -0,0 +1,388 @@
+'''
+search module. full-text search over room messages.
+
+a SearchIndex() is an inverted index per room: for every word, the list
+of messages (by number, in order) that use it. a search for several
+words intersects their lists, starting from the shortest, and stops as
+soon as it runs out of candidates. it never looks at messages that
+don't contain at least one of the words.
+
+a room's index is split into chunks of chunk_messages messages, each
+with its own posting lists and copy of its messages. a room keeps at
+most max_chunks of them: once it has more, the oldest chunk is dropped,
+postings and all, so a busy room's index stops growing instead of
+holding every message it was ever sent.
+
+posting lists are stored compressed: each message number is written as
+the gap from the previous one, as a varint (7 bits per byte, high bit
+set on all but the last byte). gaps for common words are small, so most
+entries take a single byte.
+
+add() only queues the message. a background thread tokenizes and
+indexes everything queued every batch_interval seconds, off the path
+that sends messages. searches never do that work themselves: they see
+what's been indexed so far, which is at most about batch_interval behind.
+a search goes through a room's chunks newest first, holding the lock
+for one chunk at a time, and stops as soon as it has enough results.
+
+the index only ever holds a room's newest messages, and nothing from
+before a restart. coverage() says how many those are, so a caller can
+look further back some other way (PyRC goes through the message log
+with scan(), when there is one), or at least say the results may not be
+complete.
+'''
+
+import array
+import re
+import threading
+from collections import deque
+
+# defaults
+BATCH_INTERVAL = 0.05           # seconds between index batches
+CHUNK_MESSAGES = 1024           # messages per chunk of a room's index
+MAX_CHUNKS = 32                 # chunks kept per room
+# words are runs of letters and digits, matched case-insensitively
+WORD = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    '''
+    returns the distinct words in text (list[str]), lowercased, in order
+    '''
+    return list(dict.fromkeys(WORD.findall(text.lower())))
+
+
+def scan(texts, words):
+    '''
+    the indexes of the texts (list of bytes) that use every one of words
+    (as tokenize() returns them), without an index: every text is read.
+    '''
+    encoded = [word.encode('ascii') for word in words]
+    found = []
+    for index, text in enumerate(texts):
+        text = text.lower()
+        # cheap substring check first, then whole words for the ones left
+        if all(word in text for word in encoded) and \
+                set(words) <= set(WORD.findall(text.decode('ascii', 'replace'))):
+            found.append(index)
+    return found
+
+
+class PostingList:
+    '''
+    increasing message numbers, delta + varint encoded into a bytearray
+    '''
+    __slots__ = ('data', 'last', 'count')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.last = -1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, number):
+        '''
+        add a message number. must be bigger than every number already here
+        '''
+        gap = number - self.last
+        self.last = number
+        self.count += 1
+        while gap >= 0x80:
+            self.data.append((gap & 0x7f) | 0x80)
+            gap >>= 7
+        self.data.append(gap)
+
+    def __iter__(self):
+        number = -1
+        gap = 0
+        shift = 0
+        for byte in self.data:
+            gap |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                number += gap
+                yield number
+                gap = 0
+                shift = 0
+
+
+class Chunk:
+    '''
+    a run of consecutive messages: their postings, plus a compact copy of
+    them so results can be shown (every frame back to back in one
+    bytearray, and where each one starts). numbers count from base.
+    '''
+    __slots__ = ('base', 'postings', 'blob', 'offsets')
+
+    def __init__(self, base=0):
+        self.base = base
+        # key is a word, value is a PostingList()
+        self.postings = {}
+        self.blob = bytearray()
+        self.offsets = array.array('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, words, frame):
+        number = len(self.offsets)
+        self.offsets.append(len(self.blob))
+        self.blob += frame
+        for word in words:
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = PostingList()
+            postings.append(number)
+
+    def frame(self, number):
+        start = self.offsets[number]
+        end = self.offsets[number + 1] if number + 1 < len(self.offsets) else len(self.blob)
+        return bytes(self.blob[start:end])
+
+    def match(self, words):
+        '''
+        message numbers that use every one of words, in increasing order
+        '''
+        lists = []
+        for word in words:
+            postings = self.postings.get(word)
+            if postings is None:
+                return []
+            lists.append(postings)
+        # start from the rarest word, and only ever shrink the candidates
+        lists.sort(key=len)
+        matches = list(lists[0])
+        for postings in lists[1:]:
+            if not matches:
+                break
+            wanted = iter(matches)
+            target = next(wanted)
+            kept = []
+            try:
+                for number in postings:
+                    while target < number:
+                        target = next(wanted)
+                    if target == number:
+                        kept.append(number)
+                        target = next(wanted)
+            except StopIteration:
+                pass
+            matches = kept
+        return matches
+
+
+class RoomIndex:
+    '''
+    one room's index: up to max_chunks Chunk()s of chunk_messages messages
+    each, oldest first. messages are numbered from 0 in the order they
+    were added, and keep their numbers when older ones are dropped.
+
+    parameters
+    -----------
+    - chunk_messages = int (messages per chunk)
+    - max_chunks = int (most chunks kept)
+    '''
+    __slots__ = ('chunks', 'chunk_messages', 'max_chunks', 'next_number', 'dropped')
+
+    def __init__(self, chunk_messages=CHUNK_MESSAGES, max_chunks=MAX_CHUNKS):
+        if chunk_messages < 1 or max_chunks < 1:
+            raise ValueError('a RoomIndex needs room for at least one message and one chunk')
+        self.chunks = deque()
+        self.chunk_messages = chunk_messages
+        self.max_chunks = max_chunks
+        self.next_number = 0
+        # messages dropped with old chunks
+        self.dropped = 0
+
+    def __len__(self):
+        return self.next_number - self.dropped
+
+    def add(self, words, frame):
+        chunk = self.chunks[-1] if self.chunks else None
+        if chunk is None or len(chunk) >= self.chunk_messages:
+            chunk = Chunk(self.next_number)
+            self.chunks.append(chunk)
+            if len(self.chunks) > self.max_chunks:
+                self.dropped += len(self.chunks.popleft())
+        chunk.add(words, frame)
+        self.next_number += 1
+
+    def frame(self, number):
+        '''
+        the frame (bytes) of message number. IndexError once it's been dropped
+        '''
+        if number < self.dropped:
+            raise IndexError('message number out of range')
+        chunk = self.chunks[(number - self.dropped) // self.chunk_messages]
+        return chunk.frame(number - chunk.base)
+
+    def match(self, words):
+        '''
+        message numbers still kept that use every one of words, in increasing order
+        '''
+        return [chunk.base + number for chunk in self.chunks for number in chunk.match(words)]
+
+
+class SearchIndex:
+    '''
+    inverted indexes for every room, built in the background. thread-safe.
+
+    parameters
+    -----------
+    - batch_interval = float (seconds between index batches)
+    - chunk_messages = int (messages per chunk of a room's index)
+    - max_chunks = int (chunks kept per room. a room's index holds at
+                   most chunk_messages * max_chunks of its newest messages)
+    '''
+    def __init__(self, batch_interval=BATCH_INTERVAL, chunk_messages=CHUNK_MESSAGES, max_chunks=MAX_CHUNKS):
+        self.batch_interval = batch_interval
+        self.chunk_messages = chunk_messages
+        self.max_chunks = max_chunks
+        # key is room name, value is RoomIndex()
+        self.rooms = {}
+        # guards self.rooms and every RoomIndex()
+        self.lock = threading.Lock()
+        # held while a batch is indexed, so batches go in in order
+        self.flush_lock = threading.Lock()
+        # (room name, message, frame) waiting to be indexed
+        self.pending = []
+        self.cond = threading.Condition()
+        # messages indexed so far, and the batches they came in
+        self.indexed = 0
+        self.batches = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, room_name, message, frame):
+        '''
+        queue a message to be indexed. returns right away.
+
+        parameters
+        -----------
+        - room_name = ''
+        - message = '' (the text that gets searched)
+        - frame = bytes (what a search result shows)
+        '''
+        with self.cond:
+            self.pending.append((room_name, message, frame))
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.closed:
+                    return
+                self.cond.wait(self.batch_interval)
+            self.flush()
+
+    def flush(self):
+        '''
+        index everything queued so far
+        '''
+        with self.flush_lock:
+            with self.cond:
+                batch = self.pending
+                self.pending = []
+            if not batch:
+                return
+            # tokenize before taking the lock, so searches aren't held up by it
+            entries = [(room_name, tokenize(message), frame) for room_name, message, frame in batch]
+            with self.lock:
+                for room_name, words, frame in entries:
+                    room = self.rooms.get(room_name)
+                    if room is None:
+                        room = self.rooms[room_name] = RoomIndex(self.chunk_messages, self.max_chunks)
+                    room.add(words, frame)
+                self.indexed += len(entries)
+                self.batches += 1
+
+    def coverage(self, room_name):
+        '''
+        returns (held, dropped): how many of a room's newest messages the
+        index holds (counting ones still waiting to be indexed), and how
+        many older ones it dropped. messages from before it was started
+        aren't counted in either.
+        '''
+        with self.cond:
+            waiting = sum(1 for pending in self.pending if pending[0] == room_name)
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                return waiting, 0
+            return len(room) + waiting, room.dropped
+
+    def search(self, room_name, terms, limit=20, keep=None):
+        '''
+        the newest messages in a room that contain every word in terms.
+        returns a list of frames (bytes), oldest first, at most limit of them.
+        only messages that have been indexed are found.
+
+        parameters
+        -----------
+        - room_name = ''
+        - terms = '' (words to look for)
+        - limit = int
+        - keep = function (optional. keep(frame) is False for frames to
+                 leave out. they don't count towards limit)
+        '''
+        words = tokenize(terms)
+        if not words or limit <= 0:
+            return []
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                return []
+            chunks = list(room.chunks)
+        # newest first. a chunk dropped in the meantime can still be read
+        found = []
+        for chunk in reversed(chunks):
+            with self.lock:
+                for number in reversed(chunk.match(words)):
+                    frame = chunk.frame(number)
+                    if keep is None or keep(frame):
+                        found.append(frame)
+                        if len(found) == limit:
+                            break
+            if len(found) == limit:
+                break
+        found.reverse()
+        return found
+
+    def stats(self):
+        '''
+        returns a dictionary describing the index:
+
+        - "Messages": messages indexed
+        - "Kept": messages still in the index (the rest were dropped with
+                  old chunks)
+        - "Batches": index batches run
+        - "Words": posting lists, over every chunk of every room
+        - "Posting Bytes": size of every posting list, compressed
+        - "Postings": entries in every posting list
+        - "Frame Bytes": size of every kept copy of a message
+        '''
+        with self.lock:
+            chunks = [chunk for room in self.rooms.values() for chunk in room.chunks]
+            lists = [postings for chunk in chunks for postings in chunk.postings.values()]
+            return {
+                "Messages": self.indexed,
+                "Kept": sum(len(room) for room in self.rooms.values()),
+                "Batches": self.batches,
+                "Words": len(lists),
+                "Posting Bytes": sum(len(postings.data) for postings in lists),
+                "Postings": sum(len(postings) for postings in lists),
+                "Frame Bytes": sum(len(chunk.blob) for chunk in chunks),
+            }
+
+    def close(self):
+        '''
+        index whatever is left and stop the background thread
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.flush()
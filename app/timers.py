@@ -0,0 +1,208 @@
+'''
+timers module. a hashed timer wheel, and client heartbeats built on it.
+
+a TimerWheel() is a ring of slots, one per tick. a timer due in d
+seconds goes in slot (now + d) / tick, modulo the number of slots, so
+scheduling and cancelling are O(1) and each tick only looks at one slot,
+no matter how many timers there are. timers more than one lap away just
+stay in their slot until the wheel comes around to their tick.
+
+one wheel (and one thread) covers every connection on the server.
+'''
+
+import math
+import threading
+import time
+
+# default seconds per tick, and slots per lap
+TICK = 1.0
+SLOTS = 512
+
+
+class TimerWheel:
+    '''
+    hashed timer wheel. every timer has a key, and a key has at most one
+    timer: scheduling it again replaces the old one.
+
+    callbacks run on the wheel's thread (or whoever calls advance()),
+    outside the wheel's lock, so they're free to schedule or cancel timers.
+
+    parameters
+    -----------
+    - tick = float (seconds per tick. timers fire up to one tick late)
+    - slots = int (slots per lap)
+    '''
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        # each slot is a dict. key is the timer key, value is (due tick, callback, args)
+        self.slots = [{} for _ in range(slots)]
+        # key is the timer key, value is the index of its slot
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        # last tick processed
+        self.current = 0
+        self.thread = None
+        self.running = False
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    # which tick a monotonic timestamp falls in
+    def _tick_of(self, now):
+        return int((now - self.origin) / self.tick)
+
+    def schedule(self, key, delay, callback, *args, now=None):
+        '''
+        run callback(*args) in about delay seconds, replacing any timer
+        already scheduled for this key.
+        '''
+        now = time.monotonic() if now is None else now
+        due = math.ceil((now - self.origin + delay) / self.tick)
+        with self.lock:
+            # always at least one tick away, so it can't be skipped
+            due = max(due, self.current + 1)
+            old = self.timers.get(key)
+            if old is not None:
+                del self.slots[old][key]
+            index = due % len(self.slots)
+            self.slots[index][key] = (due, callback, args)
+            self.timers[key] = index
+
+    def cancel(self, key):
+        '''
+        cancel this key's timer. returns False if it didn't have one.
+        '''
+        with self.lock:
+            index = self.timers.pop(key, None)
+            if index is None:
+                return False
+            del self.slots[index][key]
+            return True
+
+    def advance(self, now=None):
+        '''
+        move the wheel up to now and run every timer that's come due.
+        returns the number of timers fired.
+        '''
+        now = time.monotonic() if now is None else now
+        target = self._tick_of(now)
+        expired = []
+        with self.lock:
+            if target <= self.current:
+                return 0
+            # past one full lap every slot gets looked at once
+            steps = min(target - self.current, len(self.slots))
+            for step in range(1, steps + 1):
+                slot = self.slots[(self.current + step) % len(self.slots)]
+                due = [key for key, timer in slot.items() if timer[0] <= target]
+                for key in due:
+                    expired.append((key, slot.pop(key)))
+                    del self.timers[key]
+            self.current = target
+        for key, (_, callback, args) in expired:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f'timer for {key} failed: {e!r}')
+        return len(expired)
+
+    def start(self):
+        '''
+        start the wheel's thread (once), which advances it every tick
+        '''
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.tick)
+            self.advance()
+
+    def stop(self):
+        '''
+        stop the wheel's thread. pending timers are kept.
+        '''
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class Heartbeat:
+    '''
+    pings quiet clients and expires ones that stop answering.
+
+    a client that's been quiet for interval seconds is pinged. one that's
+    been quiet for timeout seconds is expired. any message counts as activity,
+    including a reply to the ping.
+
+    seen() only records a timestamp, so it's cheap enough to call on every
+    read. the client's timer checks that timestamp when it fires and
+    reschedules itself from there.
+
+    parameters
+    -----------
+    - ping = callable ping(key). send the client a ping
+    - expire = callable expire(key). drop the client
+    - interval = float (seconds of quiet before a ping)
+    - timeout = float (seconds of quiet before the client is expired)
+    - wheel = TimerWheel() (default is a new one)
+    '''
+    def __init__(self, ping, expire, interval=30.0, timeout=90.0, wheel=None):
+        self.ping = ping
+        self.expire = expire
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = wheel if wheel is not None else TimerWheel()
+        # key is the client key, value is time.monotonic() of its last message
+        self.last_seen = {}
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def start(self):
+        self.wheel.start()
+
+    def watch(self, key):
+        '''
+        start keeping track of a client
+        '''
+        self.last_seen[key] = time.monotonic()
+        self.wheel.schedule(key, self.interval, self._check, key)
+
+    def seen(self, key):
+        '''
+        record activity from a client
+        '''
+        if key in self.last_seen:
+            self.last_seen[key] = time.monotonic()
+
+    def forget(self, key):
+        '''
+        stop keeping track of a client
+        '''
+        self.last_seen.pop(key, None)
+        self.wheel.cancel(key)
+
+    def _check(self, key):
+        last = self.last_seen.get(key)
+        if last is None:
+            return
+        now = time.monotonic()
+        quiet = now - last
+        if quiet >= self.timeout:
+            self.forget(key)
+            self.expire(key)
+        elif quiet >= self.interval:
+            self.ping(key)
+            self.wheel.schedule(key, min(self.interval, self.timeout - quiet), self._check, key, now=now)
+        else:
+            self.wheel.schedule(key, self.interval - quiet, self._check, key, now=now)
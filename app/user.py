@@ -2,6 +2,21 @@
 user class module
 '''
 
+import threading
+import time
+from types import MappingProxyType
+
+from app.inbox import Inbox
+from app.orderedset import FrozenOrderedSet, OrderedSet
+
+# shared, read-only stand-ins for containers a user hasn't needed yet
+EMPTY = FrozenOrderedSet()
+NO_DMS = MappingProxyType({})
+# conversations listed by read_all_dms(), and characters of each one's newest message shown
+SUMMARY_LINES = 20
+PREVIEW = 40
+
+
 class User:
     '''
     User class. Keeps track of a user's name, current rooms, and 
@@ -9,49 +24,99 @@ class User:
 
     Also handles direct message functionality (both asynchronous and not), 
     and blocking/unblocking other users.
+
+    other users' threads deliver DMs here and read the block/mute lists
+    during broadcasts, so changes to those go through self.lock.
+    curr_rooms, muted_rooms and blocked are OrderedSet()s, so the checks
+    done for every recipient of every broadcast are O(1).
+
+    a server holds one of these per connection, so they're kept small:
+    __slots__ instead of a __dict__, and muted_rooms, blocked and dms
+    aren't made until they get something in them. until then they read
+    as shared empty (read-only) containers. only change them through the
+    methods below.
+
+    dms is an Inbox() (see app/inbox.py): bounded per sender and in total,
+    with old messages expiring, and read back a page at a time.
     '''
 
+    __slots__ = ('name', 'socket', 'curr_rooms', '_muted_rooms', '_blocked', '_dms', 'lock')
+
     def __init__(self, name, socket, curr_room):
 
         self.name = name                # user name
         self.socket = socket            # user's socket() object
-        self.curr_rooms = [curr_room]   # list (list[str]) of room names user is active in
-        self.muted_rooms = []           # list of muted rooms
-        self.blocked = []               # list of blocked users (list[str])
-        self.dms = {}                   # dictionary of direct messages. 
-                                        # key is sender (str), value is the message (str)
+        self.curr_rooms = OrderedSet([curr_room])  # room names (str) user is active in, in the order they joined
+        self._muted_rooms = None        # muted room names (OrderedSet of str), made on first mute
+        self._blocked = None            # blocked user names (OrderedSet of str), made on first block
+        self._dms = None                # direct messages (Inbox), made on first DM. 
+                                        # key is sender (str), value is their messages (list of str)
+        self.lock = threading.Lock()    # guards muted_rooms, blocked, and dms
+
+    @property
+    def muted_rooms(self):
+        return EMPTY if self._muted_rooms is None else self._muted_rooms
+
+    @property
+    def blocked(self):
+        return EMPTY if self._blocked is None else self._blocked
+
+    @property
+    def dms(self):
+        return NO_DMS if self._dms is None else self._dms
 
     def send(self, message):
         '''
         send a message via this user's socket object.
         ***message must be a string already encoded to ascii!***
+        returns whatever the socket's send() does. a server's sockets
+        return 0 when the message was dropped (see app/outbound.py).
 
         always preceed with if User.has_blocked(sender) == False !!
         '''
         if type(message) != bytes:
             self.socket.send(f'Error: message not in correct format! Must be a series of bytes using ascii encoding.'.encode('ascii'))
         else:
-            self.socket.send(message)
+            return self.socket.send(message)
+
+    def send_many(self, messages):
+        '''
+        send several messages (list of bytes, each encoded to ascii) 
+        in one write, if the socket can do that.
+        '''
+        if len(messages) == 1:
+            self.send(messages[0])
+        elif any(type(message) != bytes for message in messages):
+            self.socket.send(f'Error: message not in correct format! Must be a series of bytes using ascii encoding.'.encode('ascii'))
+        elif hasattr(self.socket, 'send_many'):
+            self.socket.send_many(messages)
+        else:
+            for message in messages:
+                self.socket.send(message)
 
     def has_muted(self, room):
         '''
         was this room muted?
         '''
-        return True if room in self.muted_rooms else False
+        muted = self._muted_rooms
+        return muted is not None and room in muted
     
     def mute(self, room):
         '''
         mute a room
         '''
-        if room not in self.muted_rooms:
-            self.muted_rooms.append(room)
+        with self.lock:
+            if self._muted_rooms is None:
+                self._muted_rooms = OrderedSet()
+            self._muted_rooms.add(room)
     
     def unmute(self, room):
         '''
         unmute a room
         '''
-        if room in self.muted_rooms:
-            self.muted_rooms.remove(room)
+        with self.lock:
+            if self._muted_rooms is not None:
+                self._muted_rooms.discard(room)
 
     def get_dm(self, sender, message):
         '''
@@ -63,29 +128,60 @@ class User:
         - message = ''
 
         if the user isn't blocked, then the message will be saved to self.dms
-        with the senders name as the key, and the user will be notified.
+        under the senders name, and the user will be notified.
         '''
         # is this sender blocked?
-        if sender not in self.blocked:
-            # store the message if we haven't gotten one from this user
-            if sender not in self.dms.keys():
-                self.dms[sender] = message
-            # otherwise add to their list of messages
-            else:
-                self.dms[sender].extend(message)
+        if not self.has_blocked(sender):
+            with self.lock:
+                if self._dms is None:
+                    self._dms = Inbox()
+                # the inbox drops old and expired messages to stay in its limits
+                self._dms.add(sender, message)
             # send an alert message to receiver
             self.send(f'New message from {sender}! \nUse /dms @{sender} to read'.encode('ascii'))
         else:
             ...
 
-    def read_dm(self, user):
+    def export_dms(self):
+        '''
+        every direct message this user has, as (sender, message, sent, seen)
+        tuples for a DMStore() (see app/dmstore.py). sent is in seconds
+        since the epoch, and seen is always True.
+        '''
+        with self.lock:
+            if self._dms is None:
+                return []
+            entries = self._dms.entries()
+        # the inbox keeps monotonic times, a store needs wall clock ones
+        offset = time.time() - time.monotonic()
+        return [(sender, message, stamp + offset, True) for sender, stamp, message in entries]
+
+    def restore_dms(self, messages):
+        '''
+        put (sender, message, sent, seen) tuples from a DMStore() back into
+        this user's inbox, oldest first, without a notification for each.
+        '''
+        offset = time.time() - time.monotonic()
+        with self.lock:
+            if self._dms is None:
+                self._dms = Inbox()
+            for sender, message, sent, _ in messages:
+                self._dms.add(sender, message, now=sent - offset)
+
+    def read_dm(self, user, page=1):
         '''
-        displays a message from a single user
+        displays one page of messages from a single user. page 1 is the newest.
         '''
         if len(self.dms) > 0:
-            if user in self.dms.keys():
-                self.send(f'{user}: \n{self.dms[user]}'.encode('ascii'))
-                return f'{user}: \n{self.dms[user]}'
+            with self.lock:
+                messages, pages = self.dms.page(user, page) if user in self.dms else ([], 0)
+            if messages:
+                text = f'{user} (page {page} of {pages}): \n' + '\n'.join(messages)
+                self.send(text.encode('ascii'))
+                return text
+            elif pages > 0:
+                self.send(f'No page {page} of messages from {user}! There are {pages}.'.encode('ascii'))
+                return f'No page {page} of messages from {user}! There are {pages}.'
             else:
                 self.send(f'No messages from {user}!\n'.encode('ascii'))
                 return f'No messages from {user}!'
@@ -95,13 +191,25 @@ class User:
 
     def read_all_dms(self):
         '''
-        displays and returns a list of messages from other users as a string.
+        displays and returns a list of conversations with other users as a
+        string: who sent messages, how many, and the newest one. the most
+        recent SUMMARY_LINES conversations are listed.
         '''
         if len(self.dms) > 0:
+            with self.lock:
+                conversations = self.dms.summary()
+            if not conversations:
+                self.send('No direct messages!'.encode('ascii'))
+                return 'No direct messages!'
             dms = []
-            for sender in self.dms:
-                dms.append(f'{sender} : \n{self.dms[sender]}\n')
-            dms_str = ' '.join(dms)
+            for sender, count, newest in conversations[:SUMMARY_LINES]:
+                if len(newest) > PREVIEW:
+                    newest = newest[:PREVIEW] + '...'
+                dms.append(f'{sender} : {count} message(s), newest: {newest}')
+            if len(conversations) > SUMMARY_LINES:
+                dms.append(f'...and {len(conversations) - SUMMARY_LINES} more')
+            dms.append('Use /dms @user_name (opt) <page> to read')
+            dms_str = '\n'.join(dms)
             self.send(dms_str.encode('ascii'))
             return dms_str
         else:
@@ -112,14 +220,20 @@ class User:
         '''
         finds out whether a given user has been blocked by this user
         '''
-        return True if sender in self.blocked else False
+        blocked = self._blocked
+        return blocked is not None and sender in blocked
 
     def block(self, sender):
         '''
         block a user
         '''
-        if sender not in self.blocked:
-            self.blocked.append(sender)
+        with self.lock:
+            newly_blocked = sender not in self.blocked
+            if newly_blocked:
+                if self._blocked is None:
+                    self._blocked = OrderedSet()
+                self._blocked.add(sender)
+        if newly_blocked:
             self.send(f'{sender} has been blocked!'.encode('ascii'))
         else:
             self.send(f'{sender} is already blocked.'.encode('ascii'))
@@ -128,8 +242,11 @@ class User:
         '''
         unblock another user.
         '''
-        if sender in self.blocked:
-            self.blocked.remove(sender)
+        with self.lock:
+            was_blocked = sender in self.blocked
+            if was_blocked:
+                self._blocked.remove(sender)
+        if was_blocked:
             self.send(f'{sender} has been unblocked!'.encode('ascii'))
         else:
             self.send(f'{sender} was not blocked.'.encode('ascii'))
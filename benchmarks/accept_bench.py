@@ -0,0 +1,107 @@
+'''
+accept throughput benchmark.
+
+opens a burst of connections against a local server and times how long
+it takes for all of them to be accepted and greeted with 
+'Connected to server'. with --stalled, a few clients connect first and
+then never send a username, which used to hold up accept() for everyone.
+
+usage:
+    python -m benchmarks.accept_bench --clients 1000 --mode thread --stalled 1
+'''
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+import server
+from app.framing import FrameDecoder
+
+
+# start a server in the background, returns its port
+def start_server(mode, backlog):
+    if mode == 'thread':
+        test_server = server.Server('127.0.0.1', 0, backlog=backlog)
+        test_server.daemon = True
+        test_server.start()
+        test_server.ready.wait()
+        return test_server.socket.getsockname()[1]
+
+    ready = threading.Event()
+    ports = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        test_server = server.AsyncServer('127.0.0.1', 0, backlog=backlog)
+        listener = loop.run_until_complete(test_server.start())
+        ports.append(listener.sockets[0].getsockname()[1])
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return ports[0]
+
+
+# connect and wait for the greeting. returns seconds taken
+async def greet(port, timeout):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    decoder = FrameDecoder()
+    messages = []
+    while not messages:
+        data = await asyncio.wait_for(reader.read(2048), timeout)
+        if not data:
+            break
+        messages = decoder.feed(data)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return elapsed
+
+
+async def burst(port, clients, stalled, timeout):
+    # stalled clients connect, read the greeting, and then go quiet
+    quiet = []
+    for _ in range(stalled):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await asyncio.wait_for(reader.read(2048), timeout)
+        quiet.append(writer)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(greet(port, timeout) for _ in range(clients)),
+                                   return_exceptions=True)
+    total = time.perf_counter() - start
+    for writer in quiet:
+        writer.close()
+
+    times = sorted(r for r in results if isinstance(r, float))
+    return total, times, len(results) - len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC accept throughput benchmark')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread')
+    parser.add_argument('--backlog', type=int, default=server.LISTEN_BACKLOG)
+    parser.add_argument('--stalled', type=int, default=0,
+                        help='clients that connect but never send a username')
+    parser.add_argument('--timeout', type=float, default=5.0,
+                        help='seconds each client waits for its greeting')
+    args = parser.parse_args()
+
+    port = start_server(args.mode, args.backlog)
+    total, times, failed = asyncio.run(burst(port, args.clients, args.stalled, args.timeout))
+
+    print(f'mode={args.mode} clients={args.clients} backlog={args.backlog} stalled={args.stalled}')
+    print(f'total: {total:.3f}s ({len(times) / total:.0f} connections/s), failed: {failed}')
+    if times:
+        p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+        print(f'greeting latency: median {statistics.median(times) * 1000:.1f}ms, '
+              f'p99 {p99 * 1000:.1f}ms, max {times[-1] * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+broadcast benchmark.
+
+times message_broadcast() to one room where every recipient has blocked
+and muted lots of other users and rooms. every recipient is checked with
+has_blocked() and has_muted() on every message, so this is where the cost
+of those lookups shows up.
+
+usage:
+    python -m benchmarks.broadcast_bench --members 200 --blocks 500 --mutes 500
+'''
+
+import argparse
+import timeit
+
+from app.chatroom import Chatroom
+from app.pyrc import message_broadcast
+from app.user import User
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+def make_room(members, blocks, mutes):
+    room = Chatroom('#bench')
+    for i in range(members):
+        user = User(f'member{i}', NullSocket(), '#lobby')
+        for j in range(blocks):
+            user.block(f'blocked{j}')
+        for j in range(mutes):
+            user.mute(f'#muted{j}')
+        room.add_new_client_to_room(user)
+    return room
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC broadcast benchmark')
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'{"blocks/mutes":>12} {"us/broadcast":>13} {"us/recipient":>13}')
+    for count in (0, 10, 100, 500, 1000):
+        room = make_room(args.members, count, count)
+        seconds = min(timeit.repeat(lambda: message_broadcast(room, 'sender', 'hello everyone'),
+                                    number=args.runs, repeat=3))
+        per_call = seconds / args.runs * 1e6
+        print(f'{count:>12} {per_call:>13.1f} {per_call / args.members:>13.3f}')
+
+
+if __name__ == '__main__':
+    main()
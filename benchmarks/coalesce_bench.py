@@ -0,0 +1,73 @@
+'''
+write coalescing benchmark.
+
+sends a lot of small chat-sized messages to one client through an
+OutboundQueue(), with and without coalescing, and counts the write 
+syscalls it took. messages arrive in bursts, like a busy room.
+
+usage:
+    python -m benchmarks.coalesce_bench --messages 20000 --burst 20
+'''
+
+import argparse
+import socket
+import threading
+import time
+
+from app.framing import FramedSocket
+from app.outbound import OutboundQueue, FLUSH_BYTES, FLUSH_WINDOW
+
+
+def drain(sock, expected, done):
+    '''
+    reads frames off sock until expected messages have arrived
+    '''
+    reader = FramedSocket(sock)
+    received = 0
+    while received < expected:
+        messages = reader.recv_messages(1 << 16)
+        if not messages:
+            break
+        received += len(messages)
+    done.set()
+
+
+def run(messages, burst, pause, flush_window):
+    '''
+    returns (seconds, write syscalls, messages written)
+    '''
+    left, right = socket.socketpair()
+    framed = FramedSocket(left)
+    queue = OutboundQueue(framed, flush_window=flush_window, flush_bytes=FLUSH_BYTES)
+    done = threading.Event()
+    threading.Thread(target=drain, args=(right, messages, done), daemon=True).start()
+
+    message = b'#room some_user : a typical short chat message '
+    start = time.perf_counter()
+    for i in range(messages):
+        queue.send(message)
+        if i % burst == burst - 1:
+            time.sleep(pause)
+    done.wait()
+    seconds = time.perf_counter() - start
+    queue.close()
+    right.close()
+    return seconds, framed.writes, framed.messages_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC write coalescing benchmark')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--burst', type=int, default=20)
+    parser.add_argument('--pause', type=float, default=0.0001,
+                        help='seconds between bursts')
+    args = parser.parse_args()
+
+    print(f'{"":>12} {"seconds":>8} {"writes":>8} {"syscalls/message":>17}')
+    for name, window in (('immediate', None), ('coalesced', FLUSH_WINDOW)):
+        seconds, writes, sent = run(args.messages, args.burst, args.pause, window)
+        print(f'{name:>12} {seconds:>8.3f} {writes:>8} {writes / sent:>17.3f}')
+
+
+if __name__ == '__main__':
+    main()
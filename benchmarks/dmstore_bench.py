@@ -0,0 +1,92 @@
+'''
+offline dm store benchmark.
+
+sends direct messages to users who aren't connected, once with a plain
+insert and commit per message on the sending thread, and once through
+a DMStore() (batched on its writer thread), and compares how long the
+sender is held up. then reconnects users with a backlog of messages
+and times how long it takes for them to be handed back.
+
+usage:
+    python -m benchmarks.dmstore_bench --dms 20000 --receivers 200
+'''
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from app.dmstore import DMStore, SCHEMA
+
+
+def report(name, seconds, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print(f'{name:>10} {len(latencies) / seconds:>10.0f} {p50:>9.1f} {p99:>9.1f}')
+
+
+def per_message(path, dms, receivers):
+    # what saving on the sender's thread costs: one transaction per dm
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA synchronous = NORMAL')
+    db.executescript(SCHEMA)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(dms):
+        sent = time.perf_counter()
+        db.execute('INSERT INTO dms (receiver, sender, message, sent) VALUES (?, ?, ?, ?)',
+                   (f'user{i % receivers}', 'sender', f'direct message number {i}', time.time()))
+        latencies.append(time.perf_counter() - sent)
+    seconds = time.perf_counter() - start
+    db.close()
+    return seconds, latencies
+
+
+def batched(store, dms, receivers):
+    for i in range(receivers):
+        store.remember(f'user{i}')
+    store.flush()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(dms):
+        sent = time.perf_counter()
+        store.save(f'user{i % receivers}', 'sender', f'direct message number {i}')
+        latencies.append(time.perf_counter() - sent)
+    store.flush()
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC offline dm store benchmark')
+    parser.add_argument('--dms', type=int, default=20000)
+    parser.add_argument('--receivers', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"":>10} {"dms/s":>10} {"p50 us":>9} {"p99 us":>9}')
+        report('per dm', *per_message(os.path.join(directory, 'plain.db'), args.dms, args.receivers))
+
+        store = DMStore(os.path.join(directory, 'dms.db'))
+        report('DMStore', *batched(store, args.dms, args.receivers))
+        print(f'transactions: {store.commits}   dms per transaction: {store.saved / max(store.commits, 1):.0f}')
+
+        # reconnecting: from take() until the callback has the messages
+        waits = []
+        for i in range(args.receivers):
+            done = threading.Event()
+            asked = time.perf_counter()
+            store.take(f'user{i}', lambda receiver, messages, waiting: done.set() or len(messages))
+            done.wait()
+            waits.append(time.perf_counter() - asked)
+        print(f'reconnecting with {args.dms // args.receivers} stored dms: '
+              f'p50 {statistics.median(waits) * 1000:.2f}ms   max {max(waits) * 1000:.2f}ms')
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''
+dm inbox benchmark.
+
+gives users thousands of direct messages each, from a lot of different
+senders, and reports how long storing one takes, how much memory each
+inbox ends up holding (with tracemalloc), and how big and how slow
+reading them back is. the same load is run against an unbounded
+dict of lists, which is what keeping every message would cost.
+
+usage:
+    python -m benchmarks.inbox_bench --users 50 --dms 5000 --senders 500
+'''
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from app.user import User
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+# messages are made as they're stored, so each one's memory is counted
+# against whichever inbox keeps it
+
+def unbounded(users, load):
+    # every message kept, forever: key is sender, value is their messages
+    inboxes = [{} for _ in range(users)]
+    for index, sender, number, length in load:
+        inboxes[index].setdefault(sender, []).append(f'dm number {number} ' + 'x' * length)
+    return inboxes
+
+
+def bounded(users, load):
+    inboxes = [User(f'user{i}', NullSocket(), '#lobby') for i in range(users)]
+    for index, sender, number, length in load:
+        inboxes[index].get_dm(sender, f'dm number {number} ' + 'x' * length)
+    return inboxes
+
+
+def measure(build, *args):
+    '''
+    returns (seconds, bytes still allocated, result). timed and measured
+    on separate runs, tracemalloc slows everything down.
+    '''
+    gc.collect()
+    start = time.perf_counter()
+    build(*args)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = build(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, size, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC dm inbox benchmark')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--dms', type=int, default=5000, help='dms per user')
+    parser.add_argument('--senders', type=int, default=500, help='different senders per user')
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    senders = [f'sender{i}' for i in range(args.senders)]
+    load = [(i % args.users, rng.choice(senders), i, rng.randrange(20, 200)) for i in range(args.users * args.dms)]
+
+    print(f'{"":>10} {"us/dm":>8} {"KB/user":>9} {"/dms KB":>9} {"/dms us":>9}')
+    seconds, size, inboxes = measure(unbounded, args.users, load)
+    start = time.perf_counter()
+    # what read_all_dms() used to send: every message, in one frame
+    reads = [' '.join(f'{sender} : \n{" ".join(messages)}\n' for sender, messages in inbox.items())
+             for inbox in inboxes]
+    read_time = (time.perf_counter() - start) / args.users
+    print(f'{"unbounded":>10} {seconds / len(load) * 1e6:>8.2f} {size / args.users / 1024:>9.0f}'
+          f' {max(map(len, reads)) / 1024:>9.0f} {read_time * 1e6:>9.0f}')
+    del inboxes, reads
+
+    seconds, size, users = measure(bounded, args.users, load)
+    start = time.perf_counter()
+    reads = [user.read_all_dms() for user in users]
+    pages = [user.read_dm(f'sender{rng.randrange(args.senders)}', 1) for user in users]
+    read_time = (time.perf_counter() - start) / args.users
+    print(f'{"inbox":>10} {seconds / len(load) * 1e6:>8.2f} {size / args.users / 1024:>9.0f}'
+          f' {max(map(len, reads)) / 1024:>9.0f} {read_time * 1e6:>9.0f}')
+    print(f'largest page: {max(map(len, pages))} bytes   '
+          f'conversations evicted: {sum(user.dms.evicted for user in users)}')
+
+
+if __name__ == '__main__':
+    main()
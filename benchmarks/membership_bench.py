@@ -0,0 +1,68 @@
+'''
+room membership benchmark.
+
+fills one room with members, then times people leaving and joining it
+while it's busy: every leave and join is followed by a message to the 
+room, so the recipients snapshot has to be current for every one.
+
+usage:
+    python -m benchmarks.membership_bench --members 20000 --churn 1000
+'''
+
+import argparse
+import time
+
+from app.chatroom import Chatroom
+from app.pyrc import message_broadcast
+from app.user import User
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC room membership benchmark')
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--churn', type=int, default=1000)
+    args = parser.parse_args()
+
+    users = [User(f'member{i}', NullSocket(), '#lobby') for i in range(args.members)]
+    room = Chatroom('#big')
+    start = time.perf_counter()
+    for user in users:
+        room.add_new_client_to_room(user)
+    fill = time.perf_counter() - start
+    print(f'filling {args.members} members: {fill:.3f}s')
+
+    # a broadcast on its own, for comparison
+    start = time.perf_counter()
+    for _ in range(args.churn):
+        message_broadcast(room, 'member0', 'hi')
+    alone = (time.perf_counter() - start) / args.churn
+
+    leavers = users[1:args.churn + 1]
+    start = time.perf_counter()
+    for user in leavers:
+        room.remove_client_from_room(user.name)
+        message_broadcast(room, 'member0', 'bye')
+    leave = (time.perf_counter() - start) / args.churn
+
+    start = time.perf_counter()
+    for user in leavers:
+        room.add_new_client_to_room(user)
+        message_broadcast(room, 'member0', 'welcome')
+    join = (time.perf_counter() - start) / args.churn
+
+    print(f'{"":>20} {"ms":>8}')
+    print(f'{"broadcast":>20} {alone * 1000:>8.2f}')
+    print(f'{"leave + broadcast":>20} {leave * 1000:>8.2f}')
+    print(f'{"join + broadcast":>20} {join * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
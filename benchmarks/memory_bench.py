@@ -0,0 +1,70 @@
+'''
+memory benchmark.
+
+measures how many bytes each User() and Chatroom() takes when there are
+a lot of them, using tracemalloc. users share one socket stand-in, so
+only the User() objects themselves are counted. rooms are counted
+empty, and again with a few members each.
+
+usage:
+    python -m benchmarks.memory_bench --users 100000 --rooms 10000
+'''
+
+import argparse
+import gc
+import tracemalloc
+
+from app.chatroom import Chatroom
+from app.user import User
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+def measure(build):
+    '''
+    returns (bytes allocated by build(), whatever build() returned)
+    '''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC memory benchmark')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--rooms', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=5,
+                        help='members per room for the populated rooms')
+    args = parser.parse_args()
+
+    socket = NullSocket()
+    # names are made ahead of time so they aren't counted
+    names = [f'user{i}' for i in range(args.users)]
+    room_names = [f'#room{i}' for i in range(args.rooms)]
+
+    used, users = measure(lambda: [User(name, socket, '#lobby') for name in names])
+    print(f'users={args.users}   bytes per user: {used / args.users:.0f}')
+
+    used, rooms = measure(lambda: [Chatroom(name) for name in room_names])
+    print(f'rooms={args.rooms}   bytes per empty room: {used / args.rooms:.0f}')
+
+    def populate():
+        for i, room in enumerate(rooms):
+            for j in range(args.members):
+                room.add_new_client_to_room(users[(i * args.members + j) % len(users)])
+    used, _ = measure(populate)
+    print(f'bytes per room with {args.members} members (on top of empty): {used / args.rooms:.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+message log benchmark.
+
+sends messages to a room as fast as it can, without a message log and
+then with one (fsync on), and compares broadcast latency and throughput.
+also reports how many messages each group commit wrote, and how long 
+reading old history back takes.
+
+usage:
+    python -m benchmarks.msglog_bench --messages 50000 --members 50
+'''
+
+import argparse
+import statistics
+import tempfile
+import time
+
+from app.chatroom import Chatroom
+from app.msglog import MessageLog
+from app.pyrc import message_broadcast
+from app.user import User
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+def run(room, messages, log):
+    '''
+    returns (messages per second, broadcast latencies in seconds)
+    '''
+    latencies = []
+    start = time.perf_counter()
+    for i in range(messages):
+        sent = time.perf_counter()
+        message_broadcast(room, 'sender', f'message number {i}', log=log)
+        latencies.append(time.perf_counter() - sent)
+    return messages / (time.perf_counter() - start), latencies
+
+
+def report(name, rate, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print(f'{name:>10} {rate:>10.0f} {p50:>9.1f} {p99:>9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC message log benchmark')
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--members', type=int, default=50)
+    args = parser.parse_args()
+
+    room = Chatroom('#bench')
+    for i in range(args.members):
+        room.add_new_client_to_room(User(f'member{i}', NullSocket(), '#lobby'))
+
+    print(f'{"":>10} {"msgs/s":>10} {"p50 us":>9} {"p99 us":>9}')
+    report('no log', *run(room, args.messages, None))
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory)
+        rate, latencies = run(room, args.messages, log)
+        start = time.perf_counter()
+        log.flush()
+        drain = time.perf_counter() - start
+        report('log', rate, latencies)
+        print(f'group commits: {log.commits}   messages per commit: {log.records / max(log.commits, 1):.0f}'
+              f'   final flush: {drain * 1000:.1f}ms')
+
+        start = time.perf_counter()
+        reads = 1000
+        for i in range(reads):
+            log.read('#bench', (i * 37) % args.messages, 50)
+        print(f'reading 50 old messages: {(time.perf_counter() - start) / reads * 1e6:.0f}us')
+        log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''
+multi-room message benchmark.
+
+a plain message goes to every room the sender is in. times sending one
+to several rooms that all have the same members, once with a separate 
+message_broadcast() per room and once with message_multicast(), and 
+counts the socket writes each one makes.
+
+usage:
+    python -m benchmarks.multiroom_bench --members 500 --rooms 5
+'''
+
+import argparse
+import timeit
+
+from app.chatroom import Chatroom
+from app.framing import FramedSocket
+from app.pyrc import message_broadcast, message_multicast
+from app.user import User
+
+
+class CountingSocket:
+    '''
+    socket() stand-in that throws every write away, but counts them
+    '''
+    def __init__(self):
+        self.writes = 0
+
+    def sendmsg(self, buffers):
+        self.writes += 1
+        return sum(map(len, buffers))
+
+
+def make_rooms(members, rooms):
+    sockets = []
+    chatrooms = [Chatroom(f'#room{i}') for i in range(rooms)]
+    for i in range(members):
+        sock = CountingSocket()
+        sockets.append(sock)
+        user = User(f'member{i}', FramedSocket(sock), '#lobby')
+        for room in chatrooms:
+            room.add_new_client_to_room(user)
+    return chatrooms, sockets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC multi-room message benchmark')
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--rooms', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    chatrooms, sockets = make_rooms(args.members, args.rooms)
+
+    def per_room():
+        for room in chatrooms:
+            message_broadcast(room, 'sender', 'hello everyone')
+
+    def planned():
+        message_multicast(chatrooms, 'sender', 'hello everyone')
+
+    print(f'{"":>10} {"us/message":>11} {"writes/message":>15}')
+    for name, send in (('per room', per_room), ('planned', planned)):
+        for sock in sockets:
+            sock.writes = 0
+        send()
+        writes = sum(sock.writes for sock in sockets)
+        seconds = min(timeit.repeat(send, number=args.runs, repeat=3))
+        print(f'{name:>10} {seconds / args.runs * 1e6:>11.1f} {writes:>15}')
+
+
+if __name__ == '__main__':
+    main()
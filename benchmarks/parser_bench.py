@@ -0,0 +1,87 @@
+'''
+message parser benchmark.
+
+times PyRC.message_parser() for one sample of each command, against an
+instance with a few users and rooms. sockets are stubs, so this is the
+cost of parsing and running the command, without any I/O.
+
+also times parse_broadcast() on ever bigger /broadcasts. the time per
+word should stay flat, since it parses in one pass.
+
+usage:
+    python -m benchmarks.parser_bench --runs 20000
+'''
+
+import argparse
+import timeit
+
+from app.pyrc import PyRC, parse_broadcast
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+# one sample per command. each one leaves the instance as it found it,
+# so they can be repeated.
+SAMPLES = [
+    'hello everyone, this is a plain message',
+    '/rooms',
+    '/myrooms',
+    '/join #bench',
+    '/join',
+    '/create #bench',
+    '/leave',
+    '/users #bench',
+    '/mute #bench',
+    '/unmute #bench',
+    '/unmute all #bench #lobby',
+    '/message @nobody are you there?',
+    '/dms @bob',
+    '/whisper @bob psst, over here',
+    '/block @carol',
+    '/unblock @carol',
+    '/broadcast #bench : hi bench / #lobby : hi lobby /',
+    '/bogus',
+]
+
+
+def make_app():
+    app = PyRC()
+    for name in ('alice', 'bob', 'carol'):
+        app.add_user(name, NullSocket())
+        app.join_room('#bench', name)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC message parser benchmark')
+    parser.add_argument('--runs', type=int, default=20000)
+    args = parser.parse_args()
+
+    app = make_app()
+    client = NullSocket()
+    total = 0.0
+    print(f'{"command":<52} {"us/call":>8}')
+    for sample in SAMPLES:
+        seconds = min(timeit.repeat(lambda: app.message_parser(sample, 'alice', client),
+                                    number=args.runs, repeat=3))
+        total += seconds
+        print(f'{sample:<52} {seconds / args.runs * 1e6:>8.2f}')
+    print(f'{"mean":<52} {total / len(SAMPLES) / args.runs * 1e6:>8.2f}')
+
+    print(f'\n{"/broadcast size":<52} {"us/word":>8}')
+    for rooms in (10, 40, 160, 640):
+        words = []
+        for i in range(rooms):
+            words += [f'#room{i}', ':'] + ['word'] * 500 + ['/']
+        seconds = min(timeit.repeat(lambda: parse_broadcast(words), number=5, repeat=3)) / 5
+        print(f'{f"{rooms} rooms, {len(words)} words":<52} {seconds / len(words) * 1e6:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
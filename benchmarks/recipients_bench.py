@@ -0,0 +1,62 @@
+'''
+recipient filtering benchmark.
+
+times how long it takes to work out who gets a message in a large room
+when some of the members blocked the sender and some muted the room,
+with and without actually sending it.
+
+usage:
+    python -m benchmarks.recipients_bench --members 20000 --blocked 0.1 --muted 0.05
+'''
+
+import argparse
+import random
+import timeit
+
+from app.chatroom import Chatroom
+from app.pyrc import message_broadcast
+from app.user import User
+
+
+class NullSocket:
+    '''
+    socket() stand-in that throws every message away
+    '''
+    def send(self, message):
+        return len(message)
+
+
+def make_room(members, blocked, muted, seed=0):
+    rng = random.Random(seed)
+    room = Chatroom('#big')
+    room.add_new_client_to_room(User('sender', NullSocket(), '#big'))
+    for i in range(members):
+        user = User(f'member{i}', NullSocket(), '#lobby')
+        if rng.random() < blocked:
+            user.block('sender')
+        if rng.random() < muted:
+            user.mute('#big')
+        room.add_new_client_to_room(user)
+    return room
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC recipient filtering benchmark')
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--blocked', type=float, default=0.1)
+    parser.add_argument('--muted', type=float, default=0.05)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    room = make_room(args.members, args.blocked, args.muted)
+    count = sum(1 for _ in room.recipients_for('sender'))
+    filtering = min(timeit.repeat(lambda: sum(1 for _ in room.recipients_for('sender')),
+                                  number=args.runs, repeat=3)) / args.runs
+    sending = min(timeit.repeat(lambda: message_broadcast(room, 'sender', 'hello'),
+                                number=args.runs, repeat=3)) / args.runs
+    print(f'members={args.members} recipients={count}')
+    print(f'filter only: {filtering * 1000:.2f}ms   full broadcast: {sending * 1000:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
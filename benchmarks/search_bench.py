@@ -0,0 +1,78 @@
+'''
+search benchmark.
+
+indexes a room's worth of synthetic messages (words drawn from a skewed
+vocabulary, like real chat), then times two-word searches against the
+inverted index and against scanning every message. also reports index
+throughput and how many bytes each compressed posting takes.
+
+usage:
+    python -m benchmarks.search_bench --messages 1000000 --queries 200
+'''
+
+import argparse
+import random
+import time
+
+from app.search import CHUNK_MESSAGES, SearchIndex, tokenize
+
+
+def make_messages(count, vocabulary, rng):
+    # zipf-ish: the first words are much more common than the last ones
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    words = rng.choices(vocabulary, weights, k=count * 8)
+    return [' '.join(words[i * 8:i * 8 + 8]) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PyRC search benchmark')
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--words', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    vocabulary = [f'w{i}' for i in range(args.words)]
+    messages = make_messages(args.messages, vocabulary, rng)
+    frames = [f'#bench sender : {message} '.encode('ascii') for message in messages]
+
+    # keep every message, so results can be checked against the scan
+    index = SearchIndex(max_chunks=-(-args.messages // CHUNK_MESSAGES))
+    start = time.perf_counter()
+    for message, frame in zip(messages, frames):
+        index.add('#bench', message, frame)
+    queued = time.perf_counter() - start
+    index.flush()
+    total = time.perf_counter() - start
+    stats = index.stats()
+    print(f'add(): {args.messages / queued:.0f} msgs/s   indexed: {args.messages / total:.0f} msgs/s')
+    print(f'postings: {stats["Postings"]}   bytes per posting: {stats["Posting Bytes"] / stats["Postings"]:.2f}'
+          f'   (vs 8 for a list of 64 bit ints)')
+
+    # one common word and one mid-frequency word per query
+    queries = [f'{rng.choice(vocabulary[:50])} {rng.choice(vocabulary[50:2000])}' for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    indexed = [index.search('#bench', query) for query in queries]
+    index_time = (time.perf_counter() - start) / len(queries)
+
+    scans = queries[:max(1, len(queries) // 20)]
+    start = time.perf_counter()
+    scanned = []
+    for query in scans:
+        terms = tokenize(query)
+        found = [frame for message, frame in zip(messages, frames)
+                 if all(term in tokenize(message) for term in terms)]
+        scanned.append(found[-20:])
+    scan_time = (time.perf_counter() - start) / len(scans)
+    assert scanned == indexed[:len(scans)]
+
+    print(f'{"":>8} {"ms/query":>10}')
+    print(f'{"scan":>8} {scan_time * 1000:>10.2f}')
+    print(f'{"index":>8} {index_time * 1000:>10.2f}')
+    print(f'speedup: {scan_time / index_time:.0f}x')
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
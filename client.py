@@ -14,6 +14,7 @@ from ui.tui import (
     TUI, supports_color, app_info
 )
 from info import APP_INFO, CLIENT_COMMANDS
+from app.framing import FramedSocket
 
 
 ### Constants ###
@@ -82,18 +83,12 @@ def run_client():
     # main communication loop
     while True:
         try: 
-            # listen for messages from the server
-            message = SOCKET.recv(BUFFER_MAX).decode('ascii')
-
-            # case where it's our first connection
-            if message == 'Connected to server':
-                if SUPPORTS_COLOR:
-                    TEXT_UI.assign_colors('#lobby')
-                # send user name as the first message.
-                SOCKET.send(CLIENT_INFO["Name"].encode('ascii'))
+            # listen for messages from the server.
+            # one read can hold several messages, or a message can span several reads
+            messages = SOCKET.recv_messages(BUFFER_MAX)
 
             # case where the server shuts down
-            elif not message:
+            if not messages:
                 if SUPPORTS_COLOR:
                     TEXT_UI.shut_down_message('SERVER OFFLINE! Closing connection...')
                 else:
@@ -101,13 +96,27 @@ def run_client():
                 SOCKET.close()
                 break
 
-            # otherwise its some other message
-            else:
-                # get any room names, assign colors as needed, then display
-                if SUPPORTS_COLOR:
-                    TEXT_UI.display(message)
+            for message in messages:
+                message = message.decode('ascii')
+
+                # case where it's our first connection
+                if message == 'Connected to server':
+                    if SUPPORTS_COLOR:
+                        TEXT_UI.assign_colors('#lobby')
+                    # send user name as the first message.
+                    SOCKET.send(CLIENT_INFO["Name"].encode('ascii'))
+
+                # case where the server is checking we're still here
+                elif message == '/ping':
+                    SOCKET.send('/pong'.encode('ascii'))
+
+                # otherwise its some other message
                 else:
-                    print(message + '\n')
+                    # get any room names, assign colors as needed, then display
+                    if SUPPORTS_COLOR:
+                        TEXT_UI.display(message)
+                    else:
+                        print(message + '\n')
 
         # case where there's a problem with the server
         except ConnectionResetError:
@@ -160,7 +169,8 @@ if __name__ == '__main__':
         print('\nConnecting to server...')
         # Create a new socket using IPv4 address family (AF_INET) 
         # and TCP protocol (SOCK_STREAM)
-        SOCKET = socket.socket(socket.AF_INET, socket.SOCK_STREAM)    
+        # every message to and from the server is length-prefixed (see app/framing.py)
+        SOCKET = FramedSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
         try:
             # send initial message (the username) to server
             SOCKET.connect(CLIENT_INFO['Address'])
@@ -29,6 +29,10 @@ CLIENT_COMMANDS = {
     "Create2":   "               ex: /create #room                              ",
     "Leave":     "  /leave :   Leave a room.                                    ",
     "Leave3":    "               ex: /leave #dnd                                ",
+    "History":   "  /history : Show a room's recent messages                    ",
+    "History2":  "               ex: /history #dnd -or- /history #dnd 50        ",
+    "Search":    "  /search :  Find messages in a room with all the given words ",
+    "Search2":   "               ex: /search #dnd dragon loot                   ",
     "Blank3":    "                                                              ",
     "Broadcast": "  /broadcast : Send distinct messages to multiple rooms       ",
     "Broadcast2":"   ex: /broadcast #room1 : <message1> / #room2 : <message2> / ",
@@ -42,8 +46,9 @@ CLIENT_COMMANDS = {
     "Message2":  "             ex: /message @user_name <message>                ",
     "Blank5":    "                                                              ",
     "DMs":       "  /dms :     Get your direct messages. Add a username to get  ",
-    "DMs2":      "             messages from a specific user                    ",
-    "DMs3":      "                ex: /dms -or - /dms @user_name                ",
+    "DMs2":      "             messages from a specific user, and a page number ",
+    "DMs3":      "             for older ones                                   ",
+    "DMs4":      "                ex: /dms -or - /dms @user_name 2              ",
     "Blank6":    "                                                              ",
     "Whisper":   "  /whisper : Send a private message to another user           ",
     "Whisper2":  "                ex: /whisper @user_name <message>             ",
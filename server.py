@@ -5,60 +5,220 @@ CS 594
 Server module. Also runs main IRC application (app.py).
 '''
 
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
 import socket
+import tempfile
 import threading
+import time
 
+from app.framing import FrameDecoder, FramedSocket, HEADER
+from app.jobs import CommandPool
+from app.msglog import MessageLog
+from app.outbound import Backpressure, OutboundQueue, ACCEPT, EVICT, FLUSH_BYTES, FLUSH_WINDOW
 from app.pyrc import PyRC
+from app.registry import SessionRegistry
+from app.relay import RelayHub, RelayClient
+from app.search import SearchIndex
+from app.dmstore import DMStore
+from app.timers import Heartbeat
 
 # Constants
 HOST = socket.gethostname()
 PORT = 5050
 ADDR = (HOST, PORT)
 BUFFER_MAX = 2048
-CLIENT_MAX = 10
+# how many not-yet-accepted connections the OS will queue (--backlog)
+LISTEN_BACKLOG = 1024
+# seconds a new client has to send its username before it's dropped
+HANDSHAKE_TIMEOUT = 10.0
 DEFAULT_ROOM_NAME = '#lobby'
+# per-client outbound queue limits (see app/outbound.py).
+# a client that stays above the high water mark for SLOW_CONSUMER_LAG
+# seconds gets SLOW_CONSUMER_POLICY applied ('drop' or 'disconnect')
+OUTBOUND_HIGH_WATER = 256 * 1024
+OUTBOUND_LOW_WATER = 64 * 1024
+OUTBOUND_MAX_BYTES = 1024 * 1024
+SLOW_CONSUMER_LAG = 10.0
+SLOW_CONSUMER_POLICY = 'disconnect'
+# write coalescing (--coalesce, threaded mode). queued messages are held 
+# until COALESCE_BYTES are waiting or COALESCE_WINDOW seconds have
+# passed, then written together in one vectored write
+COALESCE = False
+COALESCE_BYTES = FLUSH_BYTES
+COALESCE_WINDOW = FLUSH_WINDOW
+# a client that's been quiet for PING_INTERVAL seconds is sent a PING, 
+# and one that's been quiet for IDLE_TIMEOUT seconds is disconnected
+PING = b'/ping'
+PONG = b'/pong'
+PING_INTERVAL = 30.0
+IDLE_TIMEOUT = 90.0
+# jobs waiting per command pool worker (--pool N)
+POOL_MAX_QUEUE = 1000
+# seconds between command pool stats reports
+POOL_STATS_INTERVAL = 60
+# seconds a stored DM delivery waits for the event loop to run it (async mode)
+DISPATCH_TIMEOUT = 10.0
+# unix socket the worker processes use to reach each other (--workers N)
+RELAY_PATH = os.path.join(tempfile.gettempdir(), f'pyrc-relay-{PORT}.sock')
 
 # keeps track of active threads (individual users).
-# key is client (socket() object), value is thread() object
+# key is client fd (int), value is thread() object
 ACTIVE_THREADS = {}
 
 # Application instance.
 APP = PyRC()  
 
-# Server session info. 
+# Server session info. connected clients indexed by socket fd and by username.
 # This external constant needs to be accessed by multiple threads, 
 # otherwise it would be a field in the server() class
-SERVER_INFO = {
-    "Sockets": [],  # list of client_socket objects
-    "Users": [],    # list of tuples (client_socket object, client_username)
-}   
+SESSIONS = SessionRegistry()
 
-def find_user(client):
+# CommandPool() when commands run on a fixed pool of workers (--pool N).
+# None means each client's own thread/coroutine runs its commands.
+POOL = None
+
+
+def ping(fd):
+    '''
+    heartbeat. ask a quiet client if it's still there
     '''
-    finds a user_name associated with a client socket object.
+    session = SESSIONS.find(fd)
+    if session is not None:
+        session.client.send(PING)
 
-    parameters
-    ------------
-    - user_name = ''
-    
-    returns a tuple (user_socket (socket(), user_name (str)))
+
+def expire(fd):
+    '''
+    heartbeat. a client stopped answering. shutting its socket down makes
+    its reader see the disconnect and run disconnect(), same as a hang up.
     '''
-    user_list = SERVER_INFO["Users"]
-    index = [i for i, user_list in enumerate(user_list) if user_list[0] == client]
-    return SERVER_INFO["Users"][index[0]]
+    session = SESSIONS.find(fd)
+    if session is not None:
+        print(f'...{session.name} timed out...')
+        try:
+            session.client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# heartbeats for every connected client, on one timer wheel.
+# started by the servers, keyed by client fd.
+HEARTBEAT = Heartbeat(ping, expire, interval=PING_INTERVAL, timeout=IDLE_TIMEOUT)
+
+
+def make_backpressure():
+    '''
+    a Backpressure() object using the server's outbound settings
+    '''
+    return Backpressure(high_water=OUTBOUND_HIGH_WATER,
+                        low_water=OUTBOUND_LOW_WATER,
+                        max_lag=SLOW_CONSUMER_LAG,
+                        policy=SLOW_CONSUMER_POLICY,
+                        max_bytes=OUTBOUND_MAX_BYTES)
     
 
+def make_outbound(client):
+    '''
+    wraps a FramedSocket() in an OutboundQueue() using the server's 
+    outbound settings. with COALESCE on, Nagle's algorithm is turned off
+    explicitly, since the queue does its own batching.
+    '''
+    if not COALESCE:
+        return OutboundQueue(client, make_backpressure())
+    try:
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+    return OutboundQueue(client, make_backpressure(),
+                         flush_window=COALESCE_WINDOW, flush_bytes=COALESCE_BYTES)
+
+
+def run_job(user, func, *args):
+    '''
+    runs func(*args) for a user. right away if there's no POOL, otherwise
+    queued on the user's POOL worker, behind anything else they've sent.
+    '''
+    if POOL is None:
+        func(*args)
+    else:
+        POOL.submit(user, func, *args)
+
+
+def job_failed(user, error):
+    '''
+    a command blew up on a POOL worker. same as handle() would do inline:
+    drop the client. shutting the socket down lets its reader run disconnect().
+    '''
+    session = SESSIONS.find_user(user)
+    if session is not None:
+        try:
+            session.client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def start_pool(workers):
+    '''
+    create the global command POOL and print its stats now and then
+    '''
+    global POOL
+    POOL = CommandPool(workers, max_queue=POOL_MAX_QUEUE, on_error=job_failed)
+
+    def report():
+        while True:
+            time.sleep(POOL_STATS_INTERVAL)
+            print(f'...command pool: {POOL.stats()}')
+    threading.Thread(target=report, daemon=True).start()
+    return POOL
+
+
+def start_log(directory):
+    '''
+    give APP a MessageLog() so every room message is kept on disk
+    '''
+    APP.log = MessageLog(directory)
+    print(f'...logging messages to {directory}')
+    return APP.log
+
+
+def start_search():
+    '''
+    give APP a SearchIndex() so /search works
+    '''
+    APP.search = SearchIndex()
+    return APP.search
+
+
+def start_dmstore(path, dispatch=None):
+    '''
+    give APP a DMStore() so users who aren't connected still get their DMs.
+    in async mode, dispatch runs deliveries on the event loop (see
+    AsyncServer.call_wait()), where sends report whether they were dropped
+    '''
+    APP.dmstore = DMStore(path, dispatch=dispatch)
+    print(f'...keeping offline DMs in {path}')
+    return APP.dmstore
+
+
 class Server(threading.Thread):
     '''
     Class for handling everything server-related.
     '''
-    def __init__(self, host, port):
+    def __init__(self, host, port, reuse_port=False, backlog=None):
         # start a new thread for this server
         threading.Thread.__init__(self)
         self.running = True
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port
+        self.backlog = backlog if backlog is not None else LISTEN_BACKLOG
         self.socket = None
+        # set once the socket is listening
+        self.ready = threading.Event()
 
     def run(self):
         '''
@@ -69,11 +229,17 @@ class Server(threading.Thread):
         # Create a new socket using IPv4 address family (AF_INET),
         # and the TCP protocol (SOCK_STREAM)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind(ADDR)
-        self.socket.listen(CLIENT_MAX)
+        # worker processes all bind the same port and let the kernel
+        # spread new connections between them
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        HEARTBEAT.start()
+        self.ready.set()
 
         # self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, None)
-        print(f'\n...bound at host: {ADDR[0]}, port:{ADDR[1]}...')
+        print(f'\n...bound at host: {self.host}, port:{self.port}...')
         print('...listening...\n')
 
         while self.running:
@@ -82,32 +248,16 @@ class Server(threading.Thread):
                 # this is a BLOCKING process! might interfere
                 # with the KeyboardInterrupt exception...
                 client, address = self.socket.accept()
-                # new user!
-                if client not in SERVER_INFO["Sockets"]:
-                    # confirm connection to new user, and broadcast to app
-                    client.send('Connected to server'.encode('ascii'))
-
-                    # get user name since that's the first message
-                    new_user = client.recv(BUFFER_MAX).decode('ascii')
-                    print(f'...new user connected! name: {new_user}, addr: {str(address)}\n')
-
-                    # add user to instance (and default room) and update user dict
-                    # only start a new thread if this is *actually* a new user!
-                    if APP.add_user(new_user, client):
-                        # create a new thread for this client to handle message I/O
-                        ACTIVE_THREADS[client] = threading.Thread(target=handle, args=(client,))
-                        ACTIVE_THREADS[client].start()
-
-                        SERVER_INFO["Sockets"].append(client)
-                        SERVER_INFO["Users"].append((client, new_user)) # yes, i know clients are being saved twice
-                    else:
-                        ...
-
-                # message from existing user (handled in separate thread!)
-                else:
-                    ...
+                # everything else, including the handshake, happens in the
+                # client's own thread so a slow client can't hold up accept()
+                threading.Thread(target=connect, args=(client, address), daemon=True).start()
             except ConnectionResetError:
                 pass
+            except OSError:
+                # listening socket was closed by shut_down()
+                if not self.running:
+                    break
+                raise
             except KeyboardInterrupt:
                 self.shut_down()
 
@@ -122,39 +272,492 @@ class Server(threading.Thread):
         print("\nSERVER OFFLINE!\n")
 
 
-def handle(client):
+def register(fd, user_name, client):
+    '''
+    add a new client to SESSIONS, before APP announces them. returns their
+    Session(), or None (after telling the client why) if the name is taken
+    or the fd is still registered, i.e. it belonged to a client whose
+    disconnect() hasn't run yet. shared by the threaded and asyncio servers.
+
+    parameters
+    ------------
+    - fd = client's file descriptor (int)
+    - user_name = ''
+    - client = OutboundQueue() or StreamSocket() object
+    '''
+    if SESSIONS.add(fd, user_name, client):
+        return SESSIONS.find(fd)
+    if SESSIONS.find_user(user_name) is not None:
+        client.send(f'{user_name} is already in this instance!'.encode('ascii'))
+    else:
+        client.send('Error: the server is still closing an old connection, please reconnect'.encode('ascii'))
+    return None
+
+
+def connect(client, address):
+    '''
+    handshake for a newly accepted client, then hands off to handle().
+    runs in the client's own thread. a client that doesn't send its username
+    within HANDSHAKE_TIMEOUT seconds is dropped.
+
+    parameters
+    ------------
+    - client = socket() object straight from accept()
+    - address = (host, port)
+    '''
+    # every message in and out of this client is framed
+    client = FramedSocket(client)
+    fd = client.fileno()
+    try:
+        # confirm connection to new user, and broadcast to app
+        client.send('Connected to server'.encode('ascii'))
+
+        # get user name since that's the first message.
+        # anything sent right behind it is handed to handle()
+        # the deadline covers the whole handshake, not each recv()
+        messages = client.recv_messages(BUFFER_MAX, deadline=time.monotonic() + HANDSHAKE_TIMEOUT)
+        client.settimeout(None)
+        new_user = messages[0].decode('ascii') if messages else ''
+    except (OSError, ValueError):
+        new_user = ''
+    if not new_user:
+        client.close()
+        return
+    print(f'...new user connected! name: {new_user}, addr: {str(address)}\n')
+
+    # from here on sends are queued so a slow client can't block whoever 
+    # is sending to it
+    client = make_outbound(client)
+
+    # register before APP announces them, and before handling messages,
+    # since handle() looks them up right away. then add user to instance
+    # (and default room) and update user dict.
+    # only keep the connection if this is *actually* a new user!
+    session = register(fd, new_user, client)
+    if session is not None and APP.add_user(new_user, client):
+        ACTIVE_THREADS[fd] = threading.current_thread()
+        HEARTBEAT.watch(fd)
+        handle(client, fd, messages[1:])
+    else:
+        if session is not None:
+            SESSIONS.remove(fd, session)
+        # let the error go out first
+        client.flush(timeout=1.0)
+        client.close()
+
+
+def handle(client, fd, pending=()):
     '''
     handles messages from clients and sends them to PyRC to be parsed. 
     operates in it's own thread.
+
+    parameters
+    ------------
+    - client = OutboundQueue() object
+    - fd = client's file descriptor (int), its key in SESSIONS
+    - pending = list of messages (list[bytes]) that arrived with the handshake
     '''
+    messages = list(pending)
+    # the session associated with this client never changes, look it up once
+    session = SESSIONS.find(fd)
+    user = session.name
     while True:
         # case where the server receives a message from an existing client
         try:
-            message = client.recv(BUFFER_MAX).decode('ascii')
-            # search user list for the username associated with this client
-            user = find_user(client)[1]   
-            # parse message in app
-            APP.message_parser(message, user, client)
+            # parse message(s) in app. one read can hold several messages.
+            for message in messages:
+                # heartbeat replies never reach the app
+                if message == PONG:
+                    continue
+                run_job(user, APP.message_parser, message.decode('ascii'), user, client)
+            messages = client.recv_messages(BUFFER_MAX)
+            # an empty list means the client hung up
+            if not messages:
+                raise ConnectionResetError
+            HEARTBEAT.seen(fd)
 
-        # case where a user disconnects
+        # case where a user disconnects. 
+        # queued behind any of their commands that haven't run yet
         except:
-            print("\n***USER DISCONNECT***")
-            # search user list for the username associated with this client
-            user = find_user(client)[1]
-            # remove user from APP instance
-            APP.remove_user(user)
-            
-            # remove user info from SERVER_INFO instance, and close socket
-            SERVER_INFO["Sockets"].remove(client)
-            SERVER_INFO["Users"].remove((client, user))
-            client.shutdown(socket.SHUT_RDWR)
-            client.close()
-            print(f'{user} left the server!\n')
+            run_job(user, disconnect, session)
             break
 
 
+def disconnect(session):
+    '''
+    removes a client from the APP instance and SESSIONS, then closes
+    their socket. shared by the threaded and asyncio servers.
+
+    parameters
+    ------------
+    - session = the client's Session(), captured when the disconnect was queued
+    '''
+    # remove session first, so only one caller ever cleans up a client.
+    # it's removed by identity, since the fd may have been reused by now
+    fd = session.fd
+    if SESSIONS.remove(fd, session) is None:
+        return
+    print("\n***USER DISCONNECT***")
+    HEARTBEAT.forget(fd)
+    ACTIVE_THREADS.pop(fd, None)
+    # remove user from APP instance
+    APP.remove_user(session.name)
+
+    # close socket
+    try:
+        session.client.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    session.client.close()
+    print(f'{session.name} left the server!\n')
+
+
+class StreamSocket:
+    '''
+    socket()-like wrapper around an asyncio StreamWriter. frames every
+    message the same way FramedSocket() does.
+
+    PyRC and User() only ever call .send() and .send_many() on a client
+    socket, so handing them one of these lets the app run unchanged on
+    the event loop.
+    writes are buffered by the transport and never block the loop. the
+    transport's buffer gets the same watermarks and slow consumer policy
+    as OutboundQueue() in threaded mode.
+    '''
+    def __init__(self, writer, backpressure=None):
+        self.writer = writer
+        self.backpressure = backpressure if backpressure is not None else make_backpressure()
+        self.dropped = 0
+        self.evicted = False
+        # transports aren't thread-safe. sends from other threads 
+        # (POOL workers, other clients) are handed to the loop.
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        writer.transport.set_write_buffer_limits(high=self.backpressure.high_water,
+                                                 low=self.backpressure.low_water)
+
+    # off the loop a send can only be handed over, so it reports success.
+    # anything that needs to know whether it was dropped runs on the loop
+    def send(self, message):
+        if threading.get_ident() != self.loop_thread:
+            self.loop.call_soon_threadsafe(self.send, message)
+            return len(message)
+        if self.evicted:
+            return 0
+        transport = self.writer.transport
+        action = self.backpressure.check(transport.get_write_buffer_size(), len(message))
+        if action != ACCEPT:
+            self.dropped += 1
+            # slow consumer. abort() makes the reader see the disconnect
+            if action == EVICT:
+                self.evicted = True
+                transport.abort()
+            return 0
+        # header and message are handed over separately so the message
+        # bytes shared by a broadcast aren't copied per recipient
+        self.writer.writelines((HEADER.pack(len(message)), message))
+        return len(message)
+
+    def send_many(self, messages):
+        if threading.get_ident() != self.loop_thread:
+            self.loop.call_soon_threadsafe(self.send_many, messages)
+            return sum(map(len, messages))
+        if self.evicted:
+            return 0
+        transport = self.writer.transport
+        size = sum(map(len, messages))
+        action = self.backpressure.check(transport.get_write_buffer_size(), size)
+        if action != ACCEPT:
+            self.dropped += 1
+            if action == EVICT:
+                self.evicted = True
+                transport.abort()
+            return 0
+        buffers = []
+        for message in messages:
+            buffers.append(HEADER.pack(len(message)))
+            buffers.append(message)
+        self.writer.writelines(buffers)
+        return size
+
+    def fileno(self):
+        return self.writer.get_extra_info('socket').fileno()
+
+    def shutdown(self, how):
+        if threading.get_ident() != self.loop_thread:
+            self.loop.call_soon_threadsafe(self.shutdown, how)
+            return
+        if how == socket.SHUT_WR:
+            if self.writer.can_write_eof():
+                self.writer.write_eof()
+        else:
+            # like socket.shutdown() in threaded mode, this wakes the
+            # reader up so it runs disconnect()
+            self.writer.transport.abort()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncServer:
+    '''
+    asyncio version of Server(). every client is a coroutine on a single
+    event loop instead of its own thread, so idle connections only cost
+    a transport and a couple of buffers.
+    '''
+    def __init__(self, host, port, reuse_port=False, backlog=None):
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.backlog = backlog if backlog is not None else LISTEN_BACKLOG
+        self.server = None
+        self.loop = None
+
+    def run(self):
+        '''
+        starts the event loop and serves until interrupted
+        '''
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\nSERVER OFFLINE!\n")
+
+    def call_soon(self, func, *args):
+        '''
+        run func(*args) on the event loop from any thread
+        '''
+        # nothing else is touching APP before the loop is up
+        if self.loop is None:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def call_wait(self, func, *args, timeout=DISPATCH_TIMEOUT):
+        '''
+        run func(*args) on the event loop from another thread, and return
+        its result. raises TimeoutError (and func never runs) if the loop
+        doesn't get to it within timeout seconds
+        '''
+        if self.loop is None:
+            return func(*args)
+        future = concurrent.futures.Future()
+
+        def run():
+            # skipped once the caller has given up on it
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self.loop.call_soon_threadsafe(run)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            if future.cancel():
+                raise TimeoutError('the event loop never ran it')
+            return future.result()
+
+    async def start(self):
+        '''
+        binds the listening socket. returns the asyncio Server() object
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 backlog=self.backlog,
+                                                 reuse_port=self.reuse_port or None)
+        HEARTBEAT.start()
+        return self.server
+
+    async def serve(self):
+        '''
+        binds the listening socket and accepts clients forever
+        '''
+        print('\n***starting server (async)***')
+        await self.start()
+        print(f'\n...bound at host: {self.host}, port:{self.port}...')
+        print('...listening...\n')
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def read_messages(self, reader, decoder):
+        '''
+        read until at least one complete message arrives. 
+        returns an empty list if the client hangs up first.
+        '''
+        messages = []
+        while not messages:
+            data = await reader.read(BUFFER_MAX)
+            if not data:
+                break
+            messages = decoder.feed(data)
+        return messages
+
+    async def handle_client(self, reader, writer):
+        '''
+        async equivalent of the accept loop + handle().
+        does the username handshake, then feeds every message into PyRC.
+        '''
+        client = StreamSocket(writer)
+        decoder = FrameDecoder()
+        # confirm connection to new user, and broadcast to app
+        client.send('Connected to server'.encode('ascii'))
+        try:
+            # get user name since that's the first message.
+            # clients get HANDSHAKE_TIMEOUT seconds to send it.
+            messages = await asyncio.wait_for(self.read_messages(reader, decoder), HANDSHAKE_TIMEOUT)
+            new_user = messages[0].decode('ascii') if messages else ''
+        except (ConnectionError, ValueError, asyncio.TimeoutError):
+            new_user = ''
+        if not new_user:
+            client.close()
+            return
+        address = writer.get_extra_info('peername')
+        print(f'...new user connected! name: {new_user}, addr: {str(address)}\n')
+
+        # register before APP announces them, then add user to instance
+        # (and default room) and update user dict
+        fd = client.fileno()
+        session = register(fd, new_user, client)
+        if session is None or not APP.add_user(new_user, client):
+            if session is not None:
+                SESSIONS.remove(fd, session)
+            await writer.drain()
+            client.close()
+            return
+        HEARTBEAT.watch(fd)
+
+        # message loop. an empty read means the client hung up.
+        # anything sent right behind the username is parsed first.
+        try:
+            messages = messages[1:]
+            while True:
+                for message in messages:
+                    # heartbeat replies never reach the app
+                    if message == PONG:
+                        continue
+                    if POOL is None:
+                        APP.message_parser(message.decode('ascii'), new_user, client)
+                    else:
+                        # never block the loop on a full POOL queue
+                        job = (new_user, APP.message_parser, message.decode('ascii'), new_user, client)
+                        while not POOL.submit(*job, block=False):
+                            await asyncio.sleep(0.001)
+                await writer.drain()
+                data = await reader.read(BUFFER_MAX)
+                if not data:
+                    break
+                HEARTBEAT.seen(fd)
+                messages = decoder.feed(data)
+        except Exception:
+            pass
+        # queued behind any of their commands that haven't run yet
+        if POOL is None:
+            disconnect(session)
+        else:
+            while not POOL.submit(new_user, self.call_soon, disconnect, session, block=False):
+                await asyncio.sleep(0.001)
+
+
+def run_worker(mode, host, port, relay_path, pool=0, backlog=None, coalesce=False,
+               log_dir=None, search=False, dm_store=None):
+    '''
+    entry point for a single worker process. each worker has its own
+    PyRC() instance (APP) and shares the listening port with the others.
+    every worker delivers (and so logs) every room message, so each one
+    keeps a complete log in its own log_dir. a user can reconnect to any
+    worker, so they all share one dm_store database.
+    '''
+    global COALESCE
+    COALESCE = coalesce
+    if pool:
+        start_pool(pool)
+    if log_dir:
+        start_log(log_dir)
+    if search:
+        start_search()
+    if mode == 'async':
+        # relayed traffic and stored DMs have to be handled on the event loop thread
+        server = AsyncServer(host=host, port=port, reuse_port=True, backlog=backlog)
+        relay = RelayClient(relay_path, dispatch=server.call_soon)
+        if dm_store:
+            start_dmstore(dm_store, dispatch=server.call_wait)
+    else:
+        server = Server(host=host, port=port, reuse_port=True, backlog=backlog)
+        relay = RelayClient(relay_path)
+        if dm_store:
+            start_dmstore(dm_store)
+    relay.connect(APP)
+    server.run()
+
+
+def run_workers(workers, mode, host, port, pool=0, backlog=None, coalesce=False,
+                log_dir=None, search=False, dm_store=None):
+    '''
+    supervisor. starts the relay hub, then forks a worker process per core
+    (or however many were asked for) on the same port using SO_REUSEPORT.
+    '''
+    hub = RelayHub(RELAY_PATH)
+    hub.start()
+    print(f'\n***starting {workers} workers***')
+
+    processes = []
+    for index in range(workers):
+        worker_log = os.path.join(log_dir, f'worker{index}') if log_dir else None
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(mode, host, port, RELAY_PATH, pool, backlog, coalesce,
+                                                worker_log, search, dm_store))
+        process.start()
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    hub.stop()
+    print("\nSERVER OFFLINE!\n")
+
+
 #### DRIVER CODE ####
 if __name__ == '__main__':
 
-    server = Server(host=HOST, port=PORT)
-    server.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='PyRC server')
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread',
+                        help='thread-per-client (default) or a single asyncio event loop')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the port (0 = one per core)')
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG,
+                        help=f'listen backlog for pending connections (default {LISTEN_BACKLOG})')
+    parser.add_argument('--pool', type=int, default=0,
+                        help='run commands on a fixed pool of N worker threads (default: off)')
+    parser.add_argument('--coalesce', action='store_true',
+                        help='batch outbound messages per client into fewer writes (thread mode)')
+    parser.add_argument('--log-dir', default=None,
+                        help='keep every room message in append-only logs under this directory (default: off)')
+    parser.add_argument('--search', action='store_true',
+                        help='index room messages so users can /search them')
+    parser.add_argument('--dm-store', default=None,
+                        help='keep DMs for users who are offline in this SQLite database (default: off)')
+    args = parser.parse_args()
+
+    if args.workers != 1:
+        run_workers(args.workers or os.cpu_count(), args.mode, HOST, PORT, args.pool, args.backlog,
+                    args.coalesce, args.log_dir, args.search, args.dm_store)
+    else:
+        COALESCE = args.coalesce
+        if args.log_dir:
+            start_log(args.log_dir)
+        if args.search:
+            start_search()
+        if args.pool:
+            start_pool(args.pool)
+        if args.mode == 'async':
+            server = AsyncServer(host=HOST, port=PORT, backlog=args.backlog)
+            if args.dm_store:
+                start_dmstore(args.dm_store, dispatch=server.call_wait)
+        else:
+            server = Server(host=HOST, port=PORT, backlog=args.backlog)
+            if args.dm_store:
+                start_dmstore(args.dm_store)
+        server.run()
\ No newline at end of file
@@ -7,6 +7,22 @@ from time import time
 from tests.user_test import run_user_tests
 from tests.chatroom_test import run_chatroom_tests
 from tests.pyrc_test import run_PyRC_tests
+from tests.server_test import run_server_tests
+from tests.relay_test import run_relay_tests
+from tests.framing_test import run_framing_tests
+from tests.outbound_test import run_outbound_tests
+from tests.registry_test import run_registry_tests
+from tests.concurrency_test import run_concurrency_tests
+from tests.jobs_test import run_jobs_tests
+from tests.timers_test import run_timers_tests
+from tests.broadcast_test import run_broadcast_tests
+from tests.orderedset_test import run_orderedset_tests
+from tests.ids_test import run_ids_tests
+from tests.history_test import run_history_tests
+from tests.msglog_test import run_msglog_tests
+from tests.search_test import run_search_tests
+from tests.inbox_test import run_inbox_tests
+from tests.dmstore_test import run_dmstore_tests
 
 
 def run_tests():
@@ -17,6 +33,22 @@ def run_tests():
     run_user_tests()
     run_chatroom_tests()
     run_PyRC_tests()
+    run_server_tests()
+    run_relay_tests()
+    run_framing_tests()
+    run_outbound_tests()
+    run_registry_tests()
+    run_concurrency_tests()
+    run_jobs_tests()
+    run_timers_tests()
+    run_broadcast_tests()
+    run_orderedset_tests()
+    run_ids_tests()
+    run_history_tests()
+    run_msglog_tests()
+    run_search_tests()
+    run_inbox_tests()
+    run_dmstore_tests()
     
     print('\n**All tests passed!**\n')
 
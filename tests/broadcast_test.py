@@ -0,0 +1,173 @@
+'''
+/broadcast parser testing, with a seeded fuzz corpus
+'''
+
+import random
+from unittest import mock
+
+from app.framing import FrameDecoder, FramedSocket
+from app.pyrc import PyRC, parse_broadcast
+
+# words messages are built from. includes the ones that mean something
+# elsewhere in the syntax, since inside a message they're just words.
+VOCABULARY = ['hello', 'there', 'a', 'bit', 'longer', 'word', ':', '#not_a_room',
+              'x' * 40, 'ok!', '@someone', '12:30', 'end']
+
+
+def make_corpus(seed, rooms, words_per_room):
+    '''
+    builds a random, well formed /broadcast argument list.
+    returns (words, expected parse)
+    '''
+    rng = random.Random(seed)
+    words = []
+    expected = {"Rooms": [], "Messages": []}
+    for i in range(rooms):
+        room = f'#room{rng.randrange(rooms * 2)}'
+        text = [rng.choice(VOCABULARY) for _ in range(rng.randint(1, words_per_room))]
+        words += [room, ':'] + text
+        # end the message with a separate '/' or one stuck to the last word
+        if rng.random() < 0.5:
+            words.append('/')
+        else:
+            words[-1] += '/'
+        expected["Rooms"].append(room)
+        expected["Messages"].append(' '.join(text))
+    return words, expected
+
+
+def test_parse_broadcast():
+    print('testing /broadcast parsing...')
+    assert parse_broadcast('#a : hello there / #b : hi /'.split()) == \
+        {"Rooms": ['#a', '#b'], "Messages": ['hello there', 'hi']}
+    # '/' stuck to the last word (used to crash)
+    assert parse_broadcast('#a : hello there/ #b : hi/'.split()) == \
+        {"Rooms": ['#a', '#b'], "Messages": ['hello there', 'hi']}
+    # '#' and ':' inside a message are just words
+    assert parse_broadcast('#a : meet in #b at 12 : 30 /'.split()) == \
+        {"Rooms": ['#a'], "Messages": ['meet in #b at 12 : 30']}
+
+    # malformed
+    assert parse_broadcast('#a hello /'.split()) is None
+    assert parse_broadcast('a : hello /'.split()) is None
+    assert parse_broadcast('#a : hello / #b :'.split()) is None
+    assert parse_broadcast('#a : hello'.split()) is None
+    assert parse_broadcast([]) is None
+    print('...ok!')
+
+
+def test_fuzz_corpus():
+    print('testing /broadcast parsing against a fuzz corpus...')
+    for seed in range(200):
+        words, expected = make_corpus(seed, rooms=random.Random(seed).randint(1, 40), words_per_room=50)
+        assert parse_broadcast(words) == expected, seed
+
+        # damaged copies never raise, they parse or get rejected
+        rng = random.Random(seed)
+        for _ in range(10):
+            damaged = list(words)
+            index = rng.randrange(len(damaged))
+            if rng.random() < 0.5:
+                del damaged[index]
+            else:
+                damaged.insert(index, rng.choice(['/', ':', '#x', 'word/']))
+            result = parse_broadcast(damaged)
+            assert result is None or len(result["Rooms"]) == len(result["Messages"])
+    print('...ok!')
+
+
+def test_large_broadcast():
+    print('testing a multi-kilobyte /broadcast to dozens of rooms...')
+    test_app = PyRC()
+    test_socket = mock.Mock()
+    test_app.add_user('sender', test_socket)
+    rooms = [f'#room{i}' for i in range(48)]
+    sockets = {}
+    for room in rooms:
+        name = f'member_{room[1:]}'
+        sockets[room] = mock.Mock()
+        test_app.add_user(name, sockets[room])
+        test_app.leave_room('#lobby', name)
+        test_app.join_room(room, name)
+    for sock in sockets.values():
+        sock.reset_mock()
+    assert all(len(test_app.rooms[room].clients) == 1 for room in rooms)
+
+    text = ' '.join(['word'] * 1000)
+    message = '/broadcast ' + ' '.join(f'{room} : {text} /' for room in rooms)
+    assert len(message) > 200000
+
+    res = test_app.message_parser(message, 'sender', test_socket)
+
+    assert res["Rooms"] == rooms
+    assert res["Messages"] == [text] * len(rooms)
+    # each room gets its message once, in one piece
+    for room in rooms:
+        assert sockets[room].send.call_count == 1
+        assert sockets[room].send.call_args.args[0] == f'{room} sender : {text} '.encode('ascii')
+
+    # a big generated corpus parses exactly. how its time scales is
+    # measured in benchmarks/parser_bench.py
+    words, expected = make_corpus(0, rooms=40, words_per_room=2000)
+    assert parse_broadcast(words) == expected
+    print('...ok!')
+
+
+class CountingSocket:
+    '''
+    a socket that keeps everything written to it and counts the writes
+    '''
+    def __init__(self):
+        self.written = bytearray()
+        self.writes = 0
+
+    def sendmsg(self, buffers):
+        self.writes += 1
+        data = b''.join(buffers)
+        self.written += data
+        return len(data)
+
+    def messages(self):
+        return FrameDecoder().feed(bytes(self.written))
+
+
+def test_multi_room_message():
+    print('testing plain messages to several rooms...')
+    test_app = PyRC()
+    sockets = {name: CountingSocket() for name in ('sender', 'friend', 'stranger', 'blocker')}
+    for name, sock in sockets.items():
+        test_app.add_user(name, FramedSocket(sock))
+    for room in ('#a', '#b', '#c'):
+        test_app.join_room(room, 'sender')
+        test_app.join_room(room, 'friend')
+        test_app.join_room(room, 'blocker')
+    test_app.join_room('#c', 'stranger')
+    test_app.message_parser('/block @sender', 'blocker', sockets['blocker'])
+    test_app.message_parser('/mute #b', 'friend', sockets['friend'])
+    for sock in sockets.values():
+        sock.written.clear()
+        sock.writes = 0
+
+    test_app.message_parser('hello', 'sender', sockets['sender'])
+
+    # one write per recipient, holding a frame for every room they share
+    assert sockets['friend'].writes == 1
+    assert sockets['friend'].messages() == [b'#lobby sender : hello ', b'#a sender : hello ', b'#c sender : hello ']
+    assert sockets['sender'].writes == 1
+    assert len(sockets['sender'].messages()) == 4
+    assert sockets['stranger'].writes == 1
+    assert sockets['stranger'].messages() == [b'#lobby sender : hello ', b'#c sender : hello ']
+    assert sockets['blocker'].writes == 0
+    print('...ok!')
+
+
+def run_broadcast_tests():
+    print('\nStarting /broadcast tests...\n')
+    test_parse_broadcast()
+    test_fuzz_corpus()
+    test_large_broadcast()
+    test_multi_room_message()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_broadcast_tests()
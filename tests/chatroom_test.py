@@ -5,6 +5,7 @@ chatroom object testing
 
 from unittest import mock
 from app.chatroom import Chatroom
+from app.user import User
 
 
 def test_instance():
@@ -20,6 +21,7 @@ def test_add_new_client():
     test_user_object = mock.Mock()
     test_user_object.name = 'test_user'
     test_user_object.curr_rooms = []
+    test_user_object.blocked = []
     test_user_object.name = ''
 
     test_room.add_new_client_to_room(test_user_object)
@@ -35,6 +37,7 @@ def test_remove_client():
     test_user_object = mock.Mock()
     test_user_object.name = 'test_user'
     test_user_object.curr_rooms = []
+    test_user_object.blocked = []
     test_user_object.name = ''
     
     test_room.add_new_client_to_room(test_user_object)
@@ -47,11 +50,126 @@ def test_remove_client():
     assert len(test_room.clients) == 0
     print('...ok!')
 
+def test_message_all_clients():
+    print('testing message all clients....')
+    test_room = Chatroom(room_name='#test_room')
+    assert test_room.prefix == b'#test_room '
+
+    receivers = []
+    for name in ['user1', 'user2', 'user3']:
+        test_user_object = mock.Mock()
+        test_user_object.name = name
+        test_user_object.curr_rooms = []
+        test_user_object.blocked = []
+        test_user_object.has_blocked.return_value = False
+        # user3 muted the room
+        test_user_object.has_muted.return_value = name == 'user3'
+        test_room.add_new_client_to_room(test_user_object)
+        receivers.append(test_user_object)
+
+    test_room.message_all_clients('user1', 'hi all')
+    assert receivers[0].send.call_args.args[0] == b'hi all'
+    assert receivers[0].send.call_args.args[0] is receivers[1].send.call_args.args[0]
+    assert not receivers[2].send.called
+    print('...ok!')
+
+def test_compact_layout():
+    print('testing chatroom layout...')
+    test_room = Chatroom(room_name='test_room')
+    other_room = Chatroom(room_name='other_room')
+    assert not hasattr(test_room, '__dict__')
+    # nobody has blocked or left yet, so neither has been made
+    assert test_room.blocked_by is other_room.blocked_by
+    assert test_room.free_slots == ()
+
+    test_user_object = mock.Mock()
+    test_user_object.name = 'test_user'
+    test_user_object.curr_rooms = []
+    test_user_object.blocked = ['someone']
+    test_user_object.has_muted.return_value = False
+    test_room.add_new_client_to_room(test_user_object)
+    assert len(test_room.blocked_by) == 1 and len(other_room.blocked_by) == 0
+    test_room.remove_client_from_room('test_user')
+    assert test_room.free_slots == [0] and other_room.free_slots == ()
+    print('...ok!')
+
+def test_lazy_members():
+    print('testing the members snapshot...')
+    test_room = Chatroom(room_name='test_room')
+    users = []
+    for i in range(3):
+        user = User(f'member{i}', mock.Mock(), '#lobby')
+        users.append(user)
+        test_room.add_new_client_to_room(user)
+        # a join only marks the snapshot out of date
+        assert test_room._members is None
+    assert test_room.members == tuple(users)
+    # and it's reused until the next change
+    assert test_room.members is test_room.members
+    test_room.remove_client_from_room('member1')
+    assert test_room._members is None
+    assert test_room.members == (users[0], users[2])
+    print('...ok!')
+
+def test_lazy_recipients():
+    print('testing lazily rebuilt recipients...')
+    test_room = Chatroom(room_name='test_room')
+    users = [User(f'member{i}', mock.Mock(), '#lobby') for i in range(4)]
+    for user in users:
+        test_room.add_new_client_to_room(user)
+    # joins fill slots in place and only mark the snapshots out of date
+    assert test_room.slots == users
+    assert test_room._view is None and test_room._recipients is None
+    assert test_room.recipients == tuple(users)
+    assert test_room.view == (tuple(users), 0b1111)
+    snapshot = test_room.recipients
+    assert test_room.recipients is snapshot
+
+    users[2].mute('test_room')
+    test_room.set_muted(users[2], True)
+    assert test_room._recipients is None
+    assert test_room.recipients == (users[0], users[1], users[3])
+    # whoever held the old snapshot still has it, unchanged
+    assert snapshot == tuple(users)
+    print('...ok!')
+
+def test_incremental_removal():
+    print('testing incremental removal...')
+    test_room = Chatroom(room_name='test_room')
+    users = [User(f'member{i}', mock.Mock(), '#lobby') for i in range(5)]
+    for user in users:
+        test_room.add_new_client_to_room(user)
+    users[4].mute('test_room')
+    test_room.set_muted(users[4], True)
+    assert test_room.recipients == tuple(users[:4])
+
+    # a leave patches the current snapshot instead of throwing it away
+    test_room.remove_client_from_room('member1')
+    assert test_room._recipients == (users[0], users[2], users[3])
+    assert test_room._view is None
+    assert test_room.view == ((users[0], None, users[2], users[3], users[4]), 0b01101)
+
+    # someone who muted the room wasn't in it to begin with
+    snapshot = test_room.recipients
+    test_room.remove_client_from_room('member4')
+    assert test_room.recipients is snapshot
+
+    # a newcomer takes the free slot, and shows up in slot order
+    test_room.add_new_client_to_room(User('member5', mock.Mock(), '#lobby'))
+    assert [user.name for user in test_room.recipients] == ['member0', 'member2', 'member3', 'member5']
+    assert test_room.slot_of['member5'] == 4
+    print('...ok!')
+
 def run_chatroom_tests():
     print('\nStarting chatroom tests...\n')
     test_instance()
     test_add_new_client()
     test_remove_client() 
+    test_message_all_clients()
+    test_compact_layout()
+    test_lazy_members()
+    test_lazy_recipients()
+    test_incremental_removal()
     print("\n...done!")
 
 if __name__ == '__main__':
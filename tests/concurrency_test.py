@@ -0,0 +1,205 @@
+'''
+concurrency (stress) testing.
+
+the threaded server runs every client in its own thread, all sharing one
+PyRC() instance. these tests hammer the same rooms from many threads at
+once and fail if anything raises (i.e. "dictionary changed size during
+iteration") or if room membership ends up out of sync.
+'''
+
+import sys
+import threading
+from unittest import mock
+
+from app.pyrc import PyRC, message_broadcast
+
+
+def run_threads(targets, seconds=1.0):
+    '''
+    run every target(stop_event) in its own thread for a while.
+    returns a list of any exceptions they raised.
+    '''
+    errors = []
+    stop = threading.Event()
+
+    def wrapper(target):
+        try:
+            target(stop)
+        except Exception as e:
+            errors.append(e)
+
+    # switch threads as often as possible to shake out races
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=wrapper, args=(t,)) for t in targets]
+        for t in threads:
+            t.start()
+        stop.wait(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+    return errors
+
+
+def test_broadcast_while_joining_and_leaving():
+    print('testing broadcasts racing joins and leaves...')
+    test_app = PyRC()
+    for i in range(20):
+        test_app.add_user(f'user{i}', mock.Mock())
+    test_app.join_room('#stress', 'user0')
+
+    def churn(name):
+        def target(stop):
+            while not stop.is_set():
+                test_app.join_room('#stress', name)
+                test_app.leave_room('#stress', name)
+        return target
+
+    def talk(name):
+        def target(stop):
+            while not stop.is_set():
+                message_broadcast(test_app.rooms['#stress'], name, 'hello')
+                test_app.message_parser('hi all', name, test_app.users[name].socket)
+        return target
+
+    targets = [churn(f'user{i}') for i in range(1, 15)] + [talk(f'user{i}') for i in range(15, 20)]
+    errors = run_threads(targets)
+    assert errors == [], errors
+
+    # membership on both sides still agrees
+    for name in test_app.rooms['#stress'].clients:
+        assert '#stress' in test_app.users[name].curr_rooms
+    assert test_app.check_consistency() == []
+    print('...ok!')
+
+
+def test_concurrent_room_creation():
+    print('testing concurrent room creation...')
+    test_app = PyRC()
+    names = [f'user{i}' for i in range(10)]
+    for name in names:
+        test_app.add_user(name, mock.Mock())
+
+    def create(name):
+        def target(stop):
+            for i in range(200):
+                test_app.join_room(f'#room{i}', name)
+        return target
+
+    errors = run_threads([create(name) for name in names], seconds=0)
+    assert errors == [], errors
+
+    # nobody's join was lost to a room being created twice
+    for i in range(200):
+        room = test_app.rooms[f'#room{i}']
+        assert sorted(room.clients.keys()) == sorted(names)
+    assert test_app.check_consistency() == []
+    print('...ok!')
+
+
+def test_concurrent_users_and_dms():
+    print('testing concurrent connects, disconnects and dms...')
+    test_app = PyRC()
+    test_app.add_user('inbox', mock.Mock())
+
+    def connect(i):
+        def target(stop):
+            n = 0
+            while not stop.is_set():
+                name = f'user{i}_{n}'
+                test_app.add_user(name, mock.Mock())
+                test_app.send_dm(name, 'hi', 'inbox')
+                test_app.join_room(f'#room{n % 5}', name)
+                test_app.remove_user(name)
+                n += 1
+        return target
+
+    def listing(stop):
+        while not stop.is_set():
+            test_app.get_all_users()
+            test_app.list_all_rooms()
+            for room in list(test_app.rooms.values()):
+                room.get_users()
+
+    errors = run_threads([connect(i) for i in range(8)] + [listing])
+    assert errors == [], errors
+    assert list(test_app.users.keys()) == ['inbox']
+    assert test_app.check_consistency() == []
+    print('...ok!')
+
+
+class LeavingUsers(dict):
+    '''
+    a users dict whose receiver disconnects right after being checked for
+    '''
+    def __contains__(self, name):
+        found = dict.__contains__(self, name)
+        if name == 'rx':
+            self.pop('rx', None)
+        return found
+
+    def keys(self):
+        return self
+
+
+def test_receiver_leaves_mid_whisper_and_dm():
+    print('testing whispers and dms to a receiver who disconnects mid-send...')
+    test_app = PyRC()
+    test_app.add_user('tx', mock.Mock())
+    for send in (lambda: test_app.send_whisper('tx', 'psst', '@rx'),
+                 lambda: test_app.send_dm('tx', 'hello', 'rx'),
+                 lambda: test_app.relay_receive({'kind': 'whisper', 'sender': 'tx', 'receiver': 'rx', 'message': 'psst'}),
+                 lambda: test_app.relay_receive({'kind': 'dm', 'sender': 'tx', 'receiver': 'rx', 'message': 'hello'}),
+                 lambda: test_app.relay_receive({'kind': 'notice', 'receiver': 'rx', 'message': 'hi'})):
+        test_app.users = LeavingUsers(test_app.users)
+        test_app.users['rx'] = mock.Mock(**{'has_blocked.return_value': False})
+        # used to raise KeyError, which disconnected the sender
+        send()
+    print('...ok!')
+
+
+def test_mutes_and_blocks_during_broadcasts():
+    print('testing mutes and blocks racing broadcasts...')
+    test_app = PyRC()
+    names = [f'user{i}' for i in range(10)]
+    for name in names:
+        test_app.add_user(name, mock.Mock())
+        test_app.join_room('#stress', name)
+
+    def toggle(name):
+        def target(stop):
+            while not stop.is_set():
+                test_app.message_parser('/mute #stress', name, None)
+                test_app.message_parser('/block @user0 @user1', name, None)
+                test_app.join_room('#other', name)
+                test_app.message_parser('/unmute #stress', name, None)
+                test_app.message_parser('/unblock @user0', name, None)
+                test_app.leave_room('#other', name)
+        return target
+
+    def talk(name):
+        def target(stop):
+            while not stop.is_set():
+                message_broadcast(test_app.rooms['#stress'], name, 'hello')
+        return target
+
+    errors = run_threads([toggle(name) for name in names[2:]] + [talk('user0'), talk('user1')])
+    assert errors == [], errors
+    assert test_app.check_consistency() == []
+    print('...ok!')
+
+
+def run_concurrency_tests():
+    print('\nStarting concurrency tests...\n')
+    test_broadcast_while_joining_and_leaving()
+    test_concurrent_room_creation()
+    test_concurrent_users_and_dms()
+    test_receiver_leaves_mid_whisper_and_dm()
+    test_mutes_and_blocks_during_broadcasts()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_concurrency_tests()
@@ -0,0 +1,354 @@
+'''
+offline dm store testing
+'''
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from app import dmstore
+from app.dmstore import DMStore
+from app.pyrc import DM_FRAME_BYTES, DM_REPLAY_BYTES, PyRC
+
+
+def test_save_and_take():
+    print('testing dm store saves and takes...')
+    with tempfile.TemporaryDirectory() as directory:
+        store = DMStore(os.path.join(directory, 'dms.db'), flush_interval=60, ttl=None)
+        store.remember('away')
+        store.remember('other')
+        for i in range(500):
+            store.save('away', f'sender{i % 3}', f'message {i}', sent=1000.0 + i)
+        store.save('other', 'sender0', 'hi')
+        taken = []
+
+        def take_all(receiver, messages, waiting):
+            taken.append((receiver, messages, waiting))
+            return len(messages)
+
+        store.take('away', take_all)
+        store.take('nobody', take_all)
+        # nothing happens on the caller's thread
+        assert store.saved == 0 and taken == []
+
+        store.flush()
+        # every save went in as one transaction
+        assert store.saved == 501 and store.taken == 500
+        receiver, messages, waiting = taken[0]
+        assert receiver == 'away' and waiting == 0
+        assert messages[0] == ('sender0', 'message 0', 1000.0, False)
+        assert [message for _, message, _, _ in messages] == [f'message {i}' for i in range(500)]
+        # the callback hears about it when there's nothing stored
+        assert taken[1] == ('nobody', [], 0)
+        assert store.count('away') == 0 and store.count('other') == 1 and store.count() == 1
+        store.close()
+    print('...ok!')
+
+
+def test_partial_take():
+    print('testing that only handled dms are deleted...')
+    with tempfile.TemporaryDirectory() as directory:
+        store = DMStore(os.path.join(directory, 'dms.db'), flush_interval=60, take_limit=100)
+        store.remember('away')
+        for i in range(250):
+            store.save('away', 'sender', f'message {i}')
+        taken = []
+
+        def take_some(receiver, messages, waiting):
+            taken.append(([message for _, message, _, _ in messages], waiting))
+            return 30
+
+        # at most take_limit at a time, oldest first, with a count of the rest
+        store.take('away', take_some)
+        store.flush()
+        assert taken[0] == ([f'message {i}' for i in range(100)], 150)
+        # and only the ones the callback handled are gone
+        assert store.count('away') == 220 and store.taken == 30
+        store.take('away', take_some)
+        store.flush()
+        assert taken[1][0][0] == 'message 30'
+
+        # a callback that fails leaves them all
+        store.take('away', lambda receiver, messages, waiting: 1 / 0)
+        assert store.count('away') == 190
+        assert len(store.errors) == 1
+        store.close()
+    print('...ok!')
+
+
+def test_writer_thread():
+    print('testing the dm store writer thread...')
+    with tempfile.TemporaryDirectory() as directory:
+        store = DMStore(os.path.join(directory, 'dms.db'), flush_interval=60)
+        store.remember('away')
+        store.save('away', 'sender', 'hello')
+        done = threading.Event()
+        taken = []
+        store.take('away', lambda receiver, messages, waiting: (taken.append(threading.get_ident()), done.set(), 1)[2])
+        assert done.wait(2)
+        # a take() doesn't wait for flush_interval, and its callback
+        # runs on the writer, not here
+        assert taken == [store.writer.ident]
+
+        # a broken callback doesn't stop the writer
+        store.save('away', 'sender', 'again')
+        store.take('away', lambda receiver, messages, waiting: 1 / 0)
+        store.save('away', 'sender', 'still works')
+        assert store.count('away') == 2
+        assert len(store.errors) == 1 and isinstance(store.errors[0], ZeroDivisionError)
+        store.close()
+
+        # a dispatch decides where callbacks run, and its result counts
+        dispatched = []
+
+        def dispatch(callback, *args):
+            dispatched.append(args[0])
+            return callback(*args)
+
+        store = DMStore(os.path.join(directory, 'dispatched.db'), flush_interval=60, dispatch=dispatch)
+        store.remember('away')
+        store.save('away', 'sender', 'hello')
+        store.take('away', lambda receiver, messages, waiting: len(messages))
+        assert store.count('away') == 0 and dispatched == ['away']
+        store.close()
+    print('...ok!')
+
+
+def test_locked_database():
+    print('testing the dm store writer with another process holding the database...')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dms.db')
+        old_busy, old_retry = dmstore.BUSY_TIMEOUT, dmstore.RETRY_INTERVAL
+        dmstore.BUSY_TIMEOUT, dmstore.RETRY_INTERVAL = 50, 0.05
+        try:
+            store = DMStore(path, flush_interval=0.01)
+        finally:
+            dmstore.BUSY_TIMEOUT, dmstore.RETRY_INTERVAL = old_busy, old_retry
+        store.remember('away')
+        store.save('away', 'sender', 'before')
+        store.flush()
+
+        # another worker holds the write lock past busy_timeout
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute('BEGIN IMMEDIATE')
+        store.save('away', 'sender', 'during')
+        taken = []
+        store.take('away', lambda receiver, messages, waiting: taken.extend(messages) or len(messages))
+        for _ in range(200):
+            if store.errors:
+                break
+            time.sleep(0.01)
+        assert isinstance(store.errors[0], sqlite3.OperationalError)
+        assert taken == [] and store.writer.is_alive()
+
+        # once it lets go, the writer retries and nothing was lost
+        other.execute('ROLLBACK')
+        other.close()
+        for _ in range(200):
+            if taken:
+                break
+            time.sleep(0.01)
+        assert [message for _, message, _, _ in taken] == ['before', 'during']
+        assert store.count('away') == 0
+        store.close()
+    print('...ok!')
+
+
+def test_expiry_and_sharing():
+    print('testing dm expiry and sharing a store...')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dms.db')
+        store = DMStore(path, ttl=100)
+        store.remember('away')
+        store.save('away', 'sender', 'stale', sent=time.time() - 200)
+        store.save('away', 'sender', 'fresh')
+        assert store.count('away') == 2
+        # expired messages are never handed back, even before a sweep
+        taken = []
+        store.take('away', lambda receiver, messages, waiting: taken.extend(messages) or 0)
+        store.flush()
+        assert [message for _, message, _, _ in taken] == ['fresh']
+        # pretend the last sweep was a while ago
+        store.swept -= store.sweep_interval
+        assert store.count('away') == 1
+
+        # a second store (another worker) on the same file sees the same
+        # messages, and knows the same users
+        other = DMStore(path)
+        assert other.is_known('away') and not other.is_known('stranger')
+        taken = []
+        other.take('away', lambda receiver, messages, waiting: taken.extend(messages) or len(messages))
+        other.flush()
+        assert [message for _, message, _, _ in taken] == ['fresh']
+        assert store.count('away') == 0
+        # users remembered by one worker count on the other right away,
+        # without waiting for its next sweep
+        assert not store.is_known('newcomer')
+        other.remember('newcomer')
+        other.flush()
+        assert store.is_known('newcomer')
+        assert store.save('newcomer', 'sender', 'hello')
+        assert store.count('newcomer') == 1
+        other.close()
+        store.close()
+    print('...ok!')
+
+
+def test_store_bounds():
+    print('testing dm store bounds...')
+    with tempfile.TemporaryDirectory() as directory:
+        store = DMStore(os.path.join(directory, 'dms.db'), flush_interval=60, max_messages=50, ttl=100)
+        # nothing is kept for names the store has never seen
+        assert not store.save('stranger', 'sender', 'hello')
+        assert not store.save_many('stranger', [('sender', 'hello', time.time(), False)])
+        assert store.refused == 2 and store.count() == 0
+
+        # a receiver keeps only their newest max_messages
+        store.remember('away')
+        for i in range(120):
+            assert store.save('away', 'sender', f'message {i}')
+        assert store.count('away') == 50 and store.dropped == 70
+        taken = []
+        store.take('away', lambda receiver, messages, waiting: taken.extend(messages) or 0)
+        store.flush()
+        assert [message for _, message, _, _ in taken] == [f'message {i}' for i in range(70, 120)]
+
+        # users who haven't been seen for ttl are forgotten by the sweep
+        store.db.execute('UPDATE users SET seen = ?', (time.time() - 200,))
+        store.swept -= store.sweep_interval
+        store.flush()
+        assert not store.is_known('away') and not store.save('away', 'sender', 'too late')
+        store.close()
+    print('...ok!')
+
+
+def test_offline_delivery():
+    print('testing offline dm delivery...')
+    with tempfile.TemporaryDirectory() as directory:
+        test_app = PyRC()
+        test_app.dmstore = DMStore(os.path.join(directory, 'dms.db'), flush_interval=60)
+        sockets = {name: mock.Mock() for name in ('friend', 'away')}
+        test_app.add_user('friend', sockets['friend'])
+
+        # dms to someone who's never connected aren't kept
+        test_app.message_parser('/message @nobody hello?', 'friend', sockets['friend'])
+        assert sockets['friend'].send.call_args.args[0] == b'Error: nobody not in app instance!'
+        assert test_app.dmstore.count('nobody') == 0
+
+        # dms to someone who's been here before are kept for them
+        test_app.add_user('away', sockets['away'])
+        test_app.remove_user('away')
+        test_app.message_parser('/message @away are you there?', 'friend', sockets['friend'])
+        test_app.message_parser('/message @away guess not', 'friend', sockets['friend'])
+        assert sockets['friend'].send.call_args.args[0] == \
+            b'away is offline, they will get your message when they reconnect.'
+        assert test_app.dmstore.count('away') == 2
+
+        # and handed over in one message when they connect
+        test_app.add_user('away', sockets['away'])
+        sockets['away'].reset_mock()
+        test_app.dmstore.flush()
+        sockets['away'].send.assert_called_once_with(
+            b'2 new message(s) while you were away:\nfriend: are you there?\nfriend: guess not'
+            b'\nUse /dms to see all your conversations')
+        assert test_app.users['away'].dms['friend'] == ['are you there?', 'guess not']
+        assert test_app.dmstore.count('away') == 0
+
+        # their inbox outlives them disconnecting, and isn't announced again
+        test_app.message_parser('/message @away welcome back', 'friend', sockets['friend'])
+        test_app.remove_user('away')
+        assert test_app.dmstore.count('away') == 3
+        test_app.add_user('away', sockets['away'])
+        sockets['away'].reset_mock()
+        test_app.dmstore.flush()
+        sockets['away'].send.assert_not_called()
+        assert test_app.users['away'].dms['friend'] == ['are you there?', 'guess not', 'welcome back']
+
+        # if they leave before their messages arrive, they're kept for next time
+        test_app.remove_user('away')
+        test_app.dmstore.flush()
+        assert test_app.deliver_stored_dms('away', [('friend', 'late', time.time(), False)]) == 0
+        test_app.dmstore.close()
+    print('...ok!')
+
+
+def test_large_backlog():
+    print('testing a large offline dm backlog...')
+    with tempfile.TemporaryDirectory() as directory:
+        test_app = PyRC()
+        test_app.dmstore = DMStore(os.path.join(directory, 'dms.db'), flush_interval=60, max_messages=20000)
+        sockets = {name: mock.Mock() for name in ('friend', 'away')}
+        test_app.add_user('friend', sockets['friend'])
+        test_app.dmstore.remember('away')
+        for i in range(15000):
+            test_app.dmstore.save('away', 'friend', f'backlog message number {i:05} ' + 'x' * 40)
+        assert test_app.dmstore.count('away') == 15000
+
+        # only as much as fits in DM_REPLAY_BYTES is sent, in frames no
+        # bigger than DM_FRAME_BYTES, and only that is deleted
+        test_app.add_user('away', sockets['away'])
+        sockets['away'].reset_mock()
+        test_app.dmstore.flush()
+        frames = [call.args[0] for call in sockets['away'].send.call_args_list]
+        assert all(len(frame) <= DM_FRAME_BYTES + 100 for frame in frames)
+        assert sum(map(len, frames)) <= DM_REPLAY_BYTES + 100 * len(frames)
+        sent = [line for frame in frames for line in frame.decode('ascii').split('\n')
+                if line.startswith('friend: ')]
+        assert sent == [f'friend: backlog message number {i:05} ' + 'x' * 40 for i in range(len(sent))]
+        left = test_app.dmstore.count('away')
+        assert left + len(sent) == 15000
+        assert frames[-1].endswith(f'\n{left} more message(s) are waiting. Use /dms more to get them'.encode('ascii'))
+
+        # the rest come when asked for, starting where the last lot ended
+        sockets['away'].reset_mock()
+        test_app.message_parser('/dms more', 'away', sockets['away'])
+        test_app.dmstore.flush()
+        frames = [call.args[0] for call in sockets['away'].send.call_args_list]
+        assert frames[0] == b'Getting your waiting messages...'
+        assert frames[1].split(b'\n')[1] == f'friend: backlog message number {len(sent):05} '.encode('ascii') + b'x' * 40
+        assert test_app.dmstore.count('away') < left
+
+        # a frame the socket drops stays in the store
+        left = test_app.dmstore.count('away')
+        sockets['away'].reset_mock()
+        sockets['away'].send.return_value = 0
+        test_app.message_parser('/dms more', 'away', sockets['away'])
+        test_app.dmstore.flush()
+        assert test_app.dmstore.count('away') == left
+
+        # until there's nothing left
+        sockets['away'].send.return_value = None
+        while test_app.dmstore.count('away'):
+            test_app.message_parser('/dms more', 'away', sockets['away'])
+            test_app.dmstore.flush()
+        sockets['away'].reset_mock()
+        test_app.message_parser('/dms more', 'away', sockets['away'])
+        test_app.dmstore.flush()
+        assert sockets['away'].send.call_args.args[0] == b'No messages waiting!'
+        test_app.dmstore.close()
+
+    # nothing to get without a store
+    test_app = PyRC()
+    sock = mock.Mock()
+    test_app.add_user('friend', sock)
+    assert test_app.message_parser('/dms more', 'friend', sock) == 'Error: no messages are kept on this server!'
+    print('...ok!')
+
+
+def run_dmstore_tests():
+    print('\nStarting dm store tests...\n')
+    test_save_and_take()
+    test_partial_take()
+    test_writer_thread()
+    test_locked_database()
+    test_expiry_and_sharing()
+    test_store_bounds()
+    test_offline_delivery()
+    test_large_backlog()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_dmstore_tests()
@@ -0,0 +1,158 @@
+'''
+wire framing testing
+'''
+
+import socket
+import time
+
+from app.framing import (
+    FrameDecoder, FrameError, FramedSocket, encode_frame, send_buffers, HEADER
+)
+
+
+class TrickleSocket:
+    '''
+    a socket whose sendmsg() only ever writes a few bytes at a time
+    '''
+    def __init__(self, per_call=3):
+        self.per_call = per_call
+        self.written = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b''.join(bytes(buffer) for buffer in buffers)[:self.per_call]
+        self.written += data
+        return len(data)
+
+
+def test_round_trip():
+    print('testing frame round trip...')
+    decoder = FrameDecoder()
+    assert decoder.feed(encode_frame(b'hello')) == [b'hello']
+    assert decoder.feed(encode_frame(b'')) == [b'']
+    assert decoder.pending() == 0
+    print('...ok!')
+
+
+def test_coalesced_frames():
+    print('testing several frames in one read...')
+    decoder = FrameDecoder()
+    data = encode_frame(b'/join #a') + encode_frame(b'hi') + encode_frame(b'/rooms')
+    assert decoder.feed(data) == [b'/join #a', b'hi', b'/rooms']
+    print('...ok!')
+
+
+def test_split_frames():
+    print('testing a frame split across reads...')
+    decoder = FrameDecoder()
+    message = b'/broadcast #a : ' + b'y' * 5000 + b' /'
+    data = encode_frame(message) + encode_frame(b'next')
+    received = []
+    # worst case, a single byte at a time
+    for i in range(len(data)):
+        received.extend(decoder.feed(data[i:i + 1]))
+    assert received == [message, b'next']
+    assert decoder.pending() == 0
+    print('...ok!')
+
+
+def test_oversized_frame():
+    print('testing oversized frame...')
+    decoder = FrameDecoder(max_frame=16)
+    try:
+        decoder.feed(HEADER.pack(17) + b'z' * 17)
+        assert False
+    except FrameError:
+        pass
+    print('...ok!')
+
+
+def test_framed_socket():
+    print('testing framed socket...')
+    left, right = socket.socketpair()
+    sender, receiver = FramedSocket(left), FramedSocket(right)
+
+    big = b'm' * 10000
+    sender.send(b'one')
+    sender.send(big)
+    received = []
+    while len(received) < 2:
+        received.extend(receiver.recv_messages(2048))
+    assert received == [b'one', big]
+
+    # peer hanging up gives an empty list
+    sender.close()
+    assert receiver.recv_messages(2048) == []
+    receiver.close()
+    print('...ok!')
+
+
+def test_recv_deadline():
+    print('testing framed socket receive deadline...')
+    left, right = socket.socketpair()
+    receiver = FramedSocket(right)
+
+    # each byte beats a per recv() timeout, the frame as a whole doesn't
+    left.sendall(encode_frame(b'hello')[:3])
+    start = time.monotonic()
+    try:
+        receiver.recv_messages(2048, deadline=start + 0.1)
+        assert False, 'an unfinished frame should time out'
+    except socket.timeout:
+        pass
+    assert time.monotonic() - start >= 0.1
+
+    # a frame finished in time is returned as usual
+    left.sendall(encode_frame(b'hello')[3:])
+    assert receiver.recv_messages(2048, deadline=time.monotonic() + 2) == [b'hello']
+    left.close()
+    receiver.close()
+    print('...ok!')
+
+
+def test_send_buffers_partial_writes():
+    print('testing vectored sends with partial writes...')
+    sock = TrickleSocket(per_call=3)
+    buffers = [b'abc', b'', b'defgh', b'i', b'jklmnop']
+    send_buffers(sock, buffers)
+    assert bytes(sock.written) == b''.join(buffers)
+
+    # a socket that takes everything at once needs one call
+    sock = TrickleSocket(per_call=10000)
+    send_buffers(sock, [encode_frame(b'one'), encode_frame(b'two')])
+    assert sock.calls == 1
+    print('...ok!')
+
+
+def test_send_many():
+    print('testing several frames in one write...')
+    sock = TrickleSocket(per_call=10000)
+    framed = FramedSocket(sock)
+    messages = [b'#a sender : hi ', b'#b sender : hi ', b'#c sender : hi ']
+    assert framed.send_many(messages) == sum(map(len, messages))
+    assert sock.calls == 1
+    # the peer still sees separate messages
+    assert FrameDecoder().feed(bytes(sock.written)) == messages
+
+    # and partial writes still get everything out
+    sock = TrickleSocket(per_call=5)
+    FramedSocket(sock).send_many(messages)
+    assert FrameDecoder().feed(bytes(sock.written)) == messages
+    print('...ok!')
+
+
+def run_framing_tests():
+    print('\nStarting framing tests...\n')
+    test_round_trip()
+    test_coalesced_frames()
+    test_split_frames()
+    test_oversized_frame()
+    test_framed_socket()
+    test_recv_deadline()
+    test_send_buffers_partial_writes()
+    test_send_many()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_framing_tests()
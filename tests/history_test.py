@@ -0,0 +1,126 @@
+'''
+room history testing
+'''
+
+from unittest import mock
+
+from app.chatroom import Chatroom
+from app.history import RingBuffer
+from app.pyrc import PyRC, HISTORY_REPLAY
+
+
+def test_ring_buffer():
+    print('testing history ring buffer...')
+    ring = RingBuffer(capacity=5, max_bytes=1000)
+    assert ring.last() == [] and len(ring) == 0
+    for i in range(12):
+        ring.append(f'user{i}', f'line {i:02}'.encode('ascii'))
+    # only the newest 5 are kept, oldest first, and the slots never grow
+    assert len(ring) == 5 and len(ring.slots) == 5
+    assert [data for _, data in ring.last()] == [f'line {i:02}'.encode('ascii') for i in range(7, 12)]
+    assert ring.last(2) == [('user10', b'line 10'), ('user11', b'line 11')]
+    assert ring.last(0) == [] and len(ring.last(50)) == 5
+    assert ring.size == 5 * len(b'line 00')
+
+    # bytes are capped too
+    ring = RingBuffer(capacity=100, max_bytes=25)
+    for i in range(10):
+        ring.append('user', b'x' * 10)
+    assert len(ring) == 2 and ring.size == 20
+    ring.append('user', b'y' * 25)
+    assert ring.last() == [('user', b'y' * 25)]
+    # too big to ever fit, so it's not kept and nothing is dropped for it
+    ring.append('user', b'z' * 26)
+    assert ring.last() == [('user', b'y' * 25)]
+    ring.clear()
+    assert len(ring) == 0 and ring.size == 0
+    print('...ok!')
+
+
+def test_busy_room_stays_capped():
+    print('testing a busy room keeps a bounded history...')
+    test_app = PyRC()
+    test_app.add_user('chatty', mock.Mock())
+    room = test_app.rooms['#lobby']
+    for i in range(5000):
+        test_app.message_parser(f'message number {i} ' + 'x' * (i % 300), 'chatty', mock.Mock())
+    history = room.history
+    assert len(history) <= history.capacity
+    assert history.size <= history.max_bytes
+    assert history.last(1)[0][1].startswith(b'#lobby chatty : message number 4999 ')
+    print('...ok!')
+
+
+def test_replay_on_join():
+    print('testing history replay when joining a room...')
+    test_app = PyRC()
+    sockets = {name: mock.Mock() for name in ('talker', 'blocked', 'newcomer')}
+    for name, sock in sockets.items():
+        test_app.add_user(name, sock)
+    test_app.join_room('#chat', 'talker')
+    test_app.join_room('#chat', 'blocked')
+    for i in range(30):
+        test_app.message_parser(f'line {i}', 'talker', sockets['talker'])
+    test_app.message_parser('you cannot see me', 'blocked', sockets['blocked'])
+    test_app.message_parser('/block @blocked', 'newcomer', sockets['newcomer'])
+    sockets['newcomer'].reset_mock()
+
+    test_app.join_room('#chat', 'newcomer')
+    # one message with the last lines, before their own join notice
+    replay = sockets['newcomer'].send.call_args_list[0].args[0].decode('ascii')
+    lines = replay.split('\n')
+    assert lines[0] == '#chat history:'
+    assert len(lines) == 1 + HISTORY_REPLAY - 1
+    assert lines[-1] == '#chat talker : line 29 '
+    assert 'you cannot see me' not in replay
+    assert b'newcomer joined #chat!' in sockets['newcomer'].send.call_args_list[1].args[0]
+
+    # a brand new room has nothing to replay
+    sockets['newcomer'].reset_mock()
+    test_app.join_room('#empty', 'newcomer')
+    assert all(b'history' not in call.args[0] for call in sockets['newcomer'].send.call_args_list)
+    print('...ok!')
+
+
+def test_history_command():
+    print('testing /history...')
+    test_app = PyRC()
+    member, outsider = mock.Mock(), mock.Mock()
+    test_app.add_user('member', member)
+    test_app.add_user('outsider', outsider)
+    test_app.join_room('#quiet', 'member')
+    for i in range(5):
+        test_app.message_parser(f'hello {i}', 'member', member)
+
+    res = test_app.message_parser('/history #quiet 2', 'member', member)
+    assert res == '#quiet history:\n#quiet member : hello 3 \n#quiet member : hello 4 '
+    assert member.send.call_args.args[0] == res.encode('ascii')
+    # the default count, which here is everything including the join notice
+    res = test_app.message_parser('/history #quiet', 'member', member)
+    assert res.count('\n') == 6
+
+    assert test_app.message_parser('/history', 'member', member).startswith('Error: /history requires')
+    assert test_app.message_parser('/history quiet', 'member', member).startswith('Error: room name')
+    assert test_app.message_parser('/history #quiet zero', 'member', member).startswith('Error: number of lines')
+    assert test_app.message_parser('/history #quiet 0', 'member', member).startswith('Error: number of lines')
+    assert test_app.message_parser('/history #nope', 'member', member) == 'Error: #nope doesnt exist!'
+    assert test_app.message_parser('/history #quiet', 'outsider', outsider) == 'Error: you are not in #quiet!'
+
+    # a room nobody has said anything in yet
+    with test_app.rooms_lock:
+        test_app.rooms['#silent'] = Chatroom('#silent')
+    test_app.rooms['#silent'].add_new_client_to_room(test_app.users['member'])
+    assert test_app.message_parser('/history #silent', 'member', member) == 'No messages in #silent yet!'
+    print('...ok!')
+
+
+def run_history_tests():
+    print('\nStarting history tests...\n')
+    test_ring_buffer()
+    test_busy_room_stays_capped()
+    test_replay_on_join()
+    test_history_command()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_history_tests()
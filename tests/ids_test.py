@@ -0,0 +1,99 @@
+'''
+interned ids and bitmap testing
+'''
+
+from unittest import mock
+
+from app.chatroom import Chatroom
+from app.ids import Interner, USER_IDS, bits, select
+from app.user import User
+
+
+def test_interner():
+    print('testing Interner() ids...')
+    ids = Interner()
+    a = ids.acquire('alice')
+    b = ids.acquire('bob')
+    assert a != b
+    assert ids.acquire('alice') == a
+    assert ids.id_of('alice') == a and ids.name_of(a) == 'alice'
+    assert len(ids) == 2 and 'bob' in ids
+
+    # alice has two references, the id survives the first release
+    ids.release('alice')
+    assert ids.id_of('alice') == a
+    ids.release('alice')
+    assert 'alice' not in ids
+    assert ids.name_of(a) is None
+
+    # freed ids are reused, so they stay dense
+    assert ids.acquire('carol') == a
+    ids.release('nobody')
+    assert ids.id_of('nobody') is None
+    print('...ok!')
+
+
+def test_select():
+    print('testing bitmap select...')
+    items = [f'user{i}' for i in range(300)]
+    assert list(select(items, 0)) == []
+    assert list(select(items, 0b1011)) == ['user0', 'user1', 'user3']
+    mask = (1 << 299) | (1 << 150) | 1
+    assert list(select(items, mask)) == ['user0', 'user150', 'user299']
+    assert bits(mask) == [0, 150, 299]
+    assert bits(0) == []
+    print('...ok!')
+
+
+def test_room_slots():
+    print('testing chatroom slots and block bitmaps...')
+    room = Chatroom('#ids')
+    users = [User(f'ids_user{i}', mock.Mock(), '#lobby') for i in range(4)]
+    for user in users:
+        room.add_new_client_to_room(user)
+    assert room.member_mask == 0b1111
+    assert room.view[0] == tuple(users)
+
+    # a leaver's slot goes to the next user who joins
+    room.remove_client_from_room('ids_user1')
+    assert room.member_mask == 0b1101
+    assert room.view[0][1] is None
+    newcomer = User('ids_user4', mock.Mock(), '#lobby')
+    room.add_new_client_to_room(newcomer)
+    assert room.slot_of['ids_user4'] == 1
+    assert room.member_mask == 0b1111
+
+    # blocks are bitmaps keyed by the sender's interned id
+    users[2].block('ids_user0')
+    room.set_blocked(users[2], 'ids_user0', True)
+    users[3].block('ids_user0')
+    room.set_blocked(users[3], 'ids_user0', True)
+    id = USER_IDS.id_of('ids_user0')
+    assert room.blocked_by[id] == 0b1100
+    assert list(room.recipients_for('ids_user0')) == [users[0], newcomer]
+    assert room.blockers('ids_user0') == (users[2], users[3])
+
+    # mutes drop out of every sender's recipients
+    newcomer.mute('#ids')
+    room.set_muted(newcomer, True)
+    assert list(room.recipients_for('ids_user0')) == [users[0]]
+    assert newcomer not in room.recipients
+
+    # the id is released once nobody in the room blocks them
+    room.set_blocked(users[2], 'ids_user0', False)
+    room.remove_client_from_room('ids_user3')
+    assert id not in room.blocked_by
+    assert 'ids_user0' not in USER_IDS
+    assert room.recipients_for('ids_user0') == room.recipients
+    print('...ok!')
+
+
+def run_ids_tests():
+    print('\nStarting id and bitmap tests...\n')
+    test_interner()
+    test_select()
+    test_room_slots()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_ids_tests()
@@ -0,0 +1,109 @@
+'''
+dm inbox testing
+'''
+
+from unittest import mock
+
+from app.inbox import Inbox
+from app.pyrc import PyRC
+
+
+def test_conversation_cap():
+    print('testing messages kept per conversation...')
+    inbox = Inbox(max_messages=5, page_size=2)
+    for i in range(12):
+        inbox.add('sender', f'm{i}', now=i)
+    assert inbox['sender'] == ['m7', 'm8', 'm9', 'm10', 'm11']
+    assert inbox.size == len('m7m8m9m10m11')
+    assert inbox.pages('sender') == 3
+    assert inbox.page('sender', 1, now=12) == (['m10', 'm11'], 3)
+    assert inbox.page('sender', 3, now=12) == (['m7'], 3)
+    assert inbox.page('sender', 4, now=12) == ([], 3)
+    assert inbox.page('sender', 0, now=12) == ([], 3)
+    assert inbox.page('nobody', now=12) == ([], 0)
+    print('...ok!')
+
+
+def test_lru_eviction():
+    print('testing least recently used eviction...')
+    inbox = Inbox(max_bytes=30, max_conversations=3)
+    inbox.add('a', 'x' * 10, now=0)
+    inbox.add('b', 'x' * 10, now=1)
+    inbox.add('c', 'x' * 10, now=2)
+    # reading 'a' makes 'b' the least recently used
+    inbox.page('a', now=3)
+    inbox.add('d', 'y', now=4)
+    assert list(inbox) == ['c', 'a', 'd'] and inbox.evicted == 1
+    assert inbox.size == 21
+
+    # over the byte budget, old conversations go until it fits
+    inbox.add('d', 'y' * 18, now=5)
+    assert list(inbox) == ['a', 'd'] and inbox.size == 29 and inbox.evicted == 2
+
+    # a conversation too big by itself loses its oldest messages instead
+    inbox.add('d', 'z' * 20, now=6)
+    assert list(inbox) == ['d'] and inbox.evicted == 3
+    assert inbox['d'] == ['z' * 20] and inbox.size == 20
+    print('...ok!')
+
+
+def test_ttl_expiry():
+    print('testing dm expiry...')
+    inbox = Inbox(ttl=100, sweep_interval=200)
+    inbox.swept = 0
+    inbox.add('old', 'first', now=0)
+    inbox.add('old', 'second', now=60)
+    inbox.add('new', 'hello', now=150)
+    # reading a conversation drops what has expired in it
+    assert inbox.page('old', now=120) == (['second'], 1)
+    assert inbox.expired == 1 and inbox.size == len('second') + len('hello')
+
+    # new messages sweep the whole inbox, at most every sweep_interval
+    inbox.add('other', 'hi', now=165)
+    assert 'old' in inbox
+    inbox.add('other', 'hi again', now=205)
+    assert 'old' not in inbox and 'new' in inbox and inbox.expired == 2
+
+    # the summary never shows expired messages
+    assert inbox.summary(now=400) == []
+    assert len(inbox) == 0 and inbox.size == 0
+
+    forever = Inbox(ttl=None)
+    forever.add('a', 'hi', now=0)
+    assert forever.page('a', now=10 ** 9) == (['hi'], 1)
+    print('...ok!')
+
+
+def test_dms_command():
+    print('testing /dms pages...')
+    test_app = PyRC()
+    sockets = {name: mock.Mock() for name in ('reader', 'writer')}
+    for name, sock in sockets.items():
+        test_app.add_user(name, sock)
+    for i in range(12):
+        test_app.message_parser(f'/message @reader note {i}', 'writer', sockets['writer'])
+
+    res = test_app.message_parser('/dms @writer', 'reader', sockets['reader'])
+    assert res == 'writer (page 1 of 2): \n' + '\n'.join(f'note {i}' for i in range(2, 12))
+    res = test_app.message_parser('/dms @writer 2', 'reader', sockets['reader'])
+    assert res == 'writer (page 2 of 2): \nnote 0\nnote 1'
+    assert sockets['reader'].send.call_args.args[0] == res.encode('ascii')
+    res = test_app.message_parser('/dms', 'reader', sockets['reader'])
+    assert res.startswith('writer : 12 message(s), newest: note 11')
+
+    for bad in ('/dms @writer 0', '/dms @writer two', '/dms @writer 1 2'):
+        assert test_app.message_parser(bad, 'reader', sockets['reader']) == \
+            'Error: page number must be a positive number! \nex: /dms @user_name 2'
+    print('...ok!')
+
+
+def run_inbox_tests():
+    print('\nStarting inbox tests...\n')
+    test_conversation_cap()
+    test_lru_eviction()
+    test_ttl_expiry()
+    test_dms_command()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_inbox_tests()
@@ -0,0 +1,82 @@
+'''
+command pool testing
+'''
+
+import threading
+import time
+
+from app.jobs import CommandPool
+
+
+def test_per_user_ordering():
+    print('testing per-user ordering...')
+    pool = CommandPool(workers=4)
+    received = {}
+    lock = threading.Lock()
+
+    def record(user, n):
+        with lock:
+            received.setdefault(user, []).append(n)
+
+    users = [f'user{i}' for i in range(20)]
+    for n in range(200):
+        for user in users:
+            pool.submit(user, record, user, n)
+    pool.stop()
+
+    for user in users:
+        assert received[user] == list(range(200))
+    assert pool.stats()["Jobs Done"] == 20 * 200
+    print('...ok!')
+
+
+def test_bounded_queue():
+    print('testing bounded queue...')
+    gate = threading.Event()
+    pool = CommandPool(workers=1, max_queue=3)
+
+    # first job holds the only worker, the next three fill its queue
+    assert pool.submit('user', gate.wait)
+    time.sleep(0.05)
+    for _ in range(3):
+        assert pool.submit('user', lambda: None, block=False)
+    assert pool.submit('user', lambda: None, block=False) == False
+    assert pool.stats()["Queue Depth"] == [3]
+
+    gate.set()
+    pool.stop()
+    assert pool.stats()["Queue Depth"] == [0]
+    print('...ok!')
+
+
+def test_stats_and_errors():
+    print('testing stats and error handling...')
+    errors = []
+    pool = CommandPool(workers=2, on_error=lambda key, e: errors.append((key, e)))
+
+    def fail():
+        raise KeyError('nope')
+
+    pool.submit('bad_user', fail)
+    pool.submit('busy_user', time.sleep, 0.1)
+    pool.stop()
+
+    assert len(errors) == 1
+    assert errors[0][0] == 'bad_user'
+    stats = pool.stats()
+    assert stats["Workers"] == 2
+    assert stats["Jobs Done"] == 2
+    assert len(stats["Utilization"]) == 2
+    assert max(stats["Utilization"]) > 0
+    print('...ok!')
+
+
+def run_jobs_tests():
+    print('\nStarting command pool tests...\n')
+    test_per_user_ordering()
+    test_bounded_queue()
+    test_stats_and_errors()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_jobs_tests()
@@ -0,0 +1,265 @@
+'''
+message log testing
+'''
+
+import mmap
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from app.msglog import MessageLog, RECORD
+from app.pyrc import PyRC
+
+
+def test_append_and_read():
+    print('testing message log appends and reads...')
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory)
+        for i in range(10):
+            log.append('#room', f'user{i % 2}', f'#room user{i % 2} : message {i} '.encode('ascii'))
+        log.append('#other', 'someone', b'#other someone : hi ')
+        # reads only see what's been committed
+        log.flush()
+
+        records = log.tail('#room', 3)
+        assert [seq for seq, _, _, _ in records] == [7, 8, 9]
+        seq, stamp, sender, frame = records[-1]
+        assert bytes(sender) == b'user1' and bytes(frame) == b'#room user1 : message 9 '
+        assert stamp > 0
+        # served straight out of the mapped segment, not copied
+        assert isinstance(frame, memoryview) and isinstance(frame.obj, mmap.mmap)
+
+        assert [seq for seq, _, _, _ in log.read('#room', 4, 2)] == [4, 5]
+        assert len(log.read('#room', 0, 100)) == 10
+        assert log.read('#room', 50, 10) == []
+        assert [bytes(frame) for _, _, _, frame in log.tail('#other', 5)] == [b'#other someone : hi ']
+        assert log.tail('#never', 5) == []
+        log.close()
+    print('...ok!')
+
+
+def test_group_commit():
+    print('testing group commit...')
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory, flush_interval=0.05)
+        for i in range(2000):
+            log.append(f'#room{i % 4}', 'sender', b'x' * 50)
+        log.flush()
+        assert log.records == 2000
+        # many messages per write, not one each
+        assert log.commits < 20, log.commits
+        assert sum(len(log.tail(f'#room{i}', 1000)) for i in range(4)) == 2000
+
+        # a lone message is written by the writer thread, without a flush()
+        log.append('#room0', 'sender', b'late')
+        deadline = time.monotonic() + 2
+        while log.records < 2001 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert log.records == 2001
+        log.close()
+    print('...ok!')
+
+
+def test_read_during_fsync():
+    print('testing reads while a commit is syncing...')
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory)
+        log.append('#room', 'sender', b'committed')
+        log.flush()
+
+        # the next commit gets stuck in fsync
+        syncing = threading.Event()
+        unblock = threading.Event()
+        real_fsync = os.fsync
+
+        def slow_fsync(fd):
+            syncing.set()
+            unblock.wait(5)
+            real_fsync(fd)
+
+        log.append('#room', 'sender', b'syncing')
+        with mock.patch('app.msglog.os.fsync', slow_fsync):
+            flusher = threading.Thread(target=log.flush)
+            flusher.start()
+            assert syncing.wait(2)
+            # reads don't wait for it, and don't see it yet
+            reader = threading.Thread(target=lambda: read.extend(log.tail('#room', 10)))
+            read = []
+            reader.start()
+            reader.join(2)
+            stuck = reader.is_alive()
+            unblock.set()
+            flusher.join()
+        assert not stuck
+        assert [bytes(frame) for _, _, _, frame in read] == [b'committed']
+        assert [bytes(frame) for _, _, _, frame in log.tail('#room', 10)] == [b'committed', b'syncing']
+        log.close()
+    print('...ok!')
+
+
+def test_segments_and_index():
+    print('testing segment rollover and the sparse index...')
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory, segment_bytes=2000, index_every=8)
+        frames = [f'#seg user : message number {i:04} '.encode('ascii') for i in range(500)]
+        for frame in frames:
+            log.append('#seg', 'user', frame)
+        log.flush()
+
+        room = log.room('#seg')
+        assert len(room.segments) > 5
+        assert all(segment.size <= 2000 for segment in room.segments)
+        # every segment is named after its first record
+        for segment in room.segments:
+            assert os.path.basename(segment.path) == f'{segment.base:020}.log'
+            assert len(segment.index) == -(-segment.count // 8)
+        # reads cross segment boundaries
+        for start in (0, 1, 37, 255, 480):
+            records = log.read('#seg', start, 15)
+            assert [bytes(frame) for _, _, _, frame in records] == frames[start:start + 15]
+        log.close()
+    print('...ok!')
+
+
+def test_recovery():
+    print('testing message log recovery...')
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory, segment_bytes=4096)
+        for i in range(100):
+            log.append('#a/../b', 'user', f'message {i}'.encode('ascii'))
+        log.close()
+        # room names can't escape the log directory
+        assert os.listdir(directory) == ['%23a%2F..%2Fb']
+
+        # a crash in the middle of a record
+        room_dir = os.path.join(directory, '%23a%2F..%2Fb')
+        last = sorted(os.listdir(room_dir))[-1]
+        with open(os.path.join(room_dir, last), 'ab') as file:
+            file.write(RECORD.pack(100, 0.0, 4, 1000) + b'user' + b'cut off')
+
+        log = MessageLog(directory, segment_bytes=4096)
+        records = log.tail('#a/../b', 2)
+        assert [(seq, bytes(frame)) for seq, _, _, frame in records] == [(98, b'message 98'), (99, b'message 99')]
+        log.append('#a/../b', 'user', b'after the crash')
+        log.flush()
+        records = log.tail('#a/../b', 2)
+        assert [(seq, bytes(frame)) for seq, _, _, frame in records] == [(99, b'message 99'), (100, b'after the crash')]
+        log.close()
+    print('...ok!')
+
+
+def test_older():
+    print('testing reads from before what the caller already has...')
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory, flush_interval=3600.0)
+        for i in range(10):
+            log.append('#room', 'user', f'message {i}'.encode('ascii'))
+        log.flush()
+        # the caller has the newest 4, so the 3 before those
+        assert [seq for seq, _, _, _ in log.older('#room', 4, 3)] == [3, 4, 5]
+        assert [seq for seq, _, _, _ in log.older('#room', 8, 5)] == [0, 1]
+        assert log.older('#room', 10, 5) == []
+        assert log.older('#never', 0, 5) == []
+
+        # appends that aren't written yet count as the newest, but are
+        # never read, and reading doesn't write them
+        for i in range(10, 15):
+            log.append('#room', 'user', f'message {i}'.encode('ascii'))
+        assert [seq for seq, _, _, _ in log.older('#room', 8, 3)] == [4, 5, 6]
+        assert [seq for seq, _, _, _ in log.older('#room', 2, 5)] == [5, 6, 7, 8, 9]
+        assert log.records == 10
+        assert len(log.tail('#room', 100)) == 10
+        log.close()
+    print('...ok!')
+
+
+def test_open_file_limit():
+    print('testing the limit on open files and mappings...')
+    with tempfile.TemporaryDirectory() as directory:
+        def open_fds():
+            return len(os.listdir('/proc/self/fd'))
+
+        before = open_fds()
+        log = MessageLog(directory, segment_bytes=512, max_open=8)
+        # far more rooms (and segments) than there are descriptors to spare
+        for i in range(300):
+            for j in range(20):
+                log.append(f'#room{i}', 'user', f'room {i} message {j:02}'.encode('ascii'))
+        log.flush()
+        for i in range(300):
+            assert [bytes(frame) for _, _, _, frame in log.tail(f'#room{i}', 2)] == \
+                [f'room {i} message {j:02}'.encode('ascii') for j in (18, 19)]
+        assert len(log.handles) <= 8
+        assert log.handles.evicted > 0
+        assert open_fds() - before <= 8, open_fds() - before
+
+        # an evicted file is opened again when its room is written to
+        log.append('#room0', 'user', b'room 0 again')
+        log.flush()
+        assert bytes(log.tail('#room0', 1)[0][3]) == b'room 0 again'
+
+        log.close()
+        assert all(segment.map is None for room in log.rooms.values() for segment in room.segments)
+        assert all(room.file is None for room in log.rooms.values())
+        assert len(log.handles) == 0
+        assert open_fds() <= before
+    print('...ok!')
+
+
+def test_app_logging():
+    print('testing PyRC message logging and history from the log...')
+    with tempfile.TemporaryDirectory() as directory:
+        test_app = PyRC()
+        test_app.log = MessageLog(directory)
+        talker = mock.Mock()
+        test_app.add_user('talker', talker)
+        test_app.join_room('#logged', 'talker')
+        for i in range(150):
+            test_app.message_parser(f'line {i}', 'talker', talker)
+        test_app.message_parser('/broadcast #logged : broadcast line /', 'talker', talker)
+        test_app.log.flush()
+
+        # more than the room keeps in memory comes from the log
+        res = test_app.message_parser('/history #logged 120', 'talker', talker)
+        lines = res.split('\n')
+        assert len(lines) == 121
+        assert lines[-1] == '#logged talker : broadcast line '
+        assert lines[1] == '#logged talker : line 31 '
+
+        # what the room still has in memory doesn't touch the log
+        with mock.patch.object(test_app.log, 'read', side_effect=AssertionError('read the log')):
+            res = test_app.message_parser('/history #logged 100', 'talker', talker)
+        assert res.split('\n')[1] == '#logged talker : line 51 '
+        test_app.log.close()
+
+        # after a restart, joining the room replays what was logged
+        restarted = PyRC()
+        restarted.log = MessageLog(directory)
+        newcomer = mock.Mock()
+        restarted.add_user('newcomer', newcomer)
+        newcomer.reset_mock()
+        restarted.join_room('#logged', 'newcomer')
+        # before the join notices
+        replay = newcomer.send.call_args_list[0].args[0].decode('ascii')
+        assert replay.startswith('#logged history:\n')
+        assert replay.endswith('#logged talker : broadcast line ')
+        restarted.log.close()
+    print('...ok!')
+
+
+def run_msglog_tests():
+    print('\nStarting message log tests...\n')
+    test_append_and_read()
+    test_group_commit()
+    test_read_during_fsync()
+    test_segments_and_index()
+    test_recovery()
+    test_older()
+    test_open_file_limit()
+    test_app_logging()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_msglog_tests()
@@ -0,0 +1,71 @@
+'''
+ordered set testing
+'''
+
+from unittest import mock
+
+from app.orderedset import OrderedSet
+from app.user import User
+
+
+def test_ordered_set():
+    print('testing ordered set...')
+    rooms = OrderedSet(['#lobby'])
+    rooms.append('#a')
+    rooms.add('#b')
+    rooms.append('#a')  # already here, keeps its place
+
+    assert len(rooms) == 3
+    assert '#a' in rooms and '#z' not in rooms
+    assert list(rooms) == ['#lobby', '#a', '#b']
+    assert rooms[0] == '#lobby'
+    assert rooms[-1] == '#b'
+    assert rooms[1] == '#a'
+    assert ' '.join(rooms) == '#lobby #a #b'
+
+    rooms.remove('#a')
+    assert rooms == ['#lobby', '#b']
+    assert rooms != ['#b', '#lobby']
+    assert rooms == {'#b', '#lobby'}
+    try:
+        rooms.remove('#a')
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+    rooms.discard('#a')
+    assert OrderedSet() == []
+    assert not OrderedSet()
+    print('...ok!')
+
+
+def test_user_uses_ordered_sets():
+    print('testing User() block and mute sets...')
+    user = User('test_user', mock.Mock(), '#lobby')
+    for i in range(500):
+        user.block(f'user{i}')
+        user.mute(f'#room{i}')
+    user.block('user0')
+    user.mute('#room0')
+
+    assert len(user.blocked) == 500
+    assert len(user.muted_rooms) == 500
+    assert user.has_blocked('user499') and not user.has_blocked('user500')
+    assert user.has_muted('#room499') and not user.has_muted('#room500')
+    assert user.blocked[0] == 'user0' and user.blocked[-1] == 'user499'
+
+    user.unblock('user0')
+    user.unmute('#room0')
+    user.unmute('#room0')
+    assert not user.has_blocked('user0')
+    assert not user.has_muted('#room0')
+    print('...ok!')
+
+
+def run_orderedset_tests():
+    print('\nStarting ordered set tests...\n')
+    test_ordered_set()
+    test_user_uses_ordered_sets()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_orderedset_tests()
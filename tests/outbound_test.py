@@ -0,0 +1,238 @@
+'''
+outbound queue testing
+'''
+
+import socket
+import threading
+import time
+
+from app.framing import FramedSocket
+from app.outbound import (
+    Backpressure, OutboundQueue, ACCEPT, DROP, EVICT
+)
+
+
+class StuckSocket:
+    '''
+    a socket whose send() blocks until released, like a client that
+    stopped reading and has a full TCP window.
+    '''
+    def __init__(self):
+        self.release = threading.Event()
+        self.sent = []
+        self.was_shut_down = False
+
+    def send(self, message):
+        self.release.wait()
+        if self.was_shut_down:
+            raise OSError('socket was shut down')
+        self.sent.append(message)
+        return len(message)
+
+    def send_many(self, messages):
+        return sum(self.send(message) for message in messages)
+
+    def shutdown(self, how):
+        self.was_shut_down = True
+        self.release.set()
+
+    def close(self):
+        pass
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_backpressure_watermarks():
+    print('testing backpressure watermarks...')
+    bp = Backpressure(high_water=100, low_water=20, max_lag=1.0, policy='drop', max_bytes=1000)
+
+    assert bp.check(50, 10, now=0) == ACCEPT
+    assert not bp.is_behind()
+    # past high water, but not for long enough to matter
+    assert bp.check(100, 10, now=0) == ACCEPT
+    assert bp.is_behind()
+    # draining a little isn't enough, it has to get under low water
+    assert bp.check(50, 10, now=0.5) == ACCEPT
+    assert bp.is_behind()
+    assert bp.check(50, 10, now=2) == DROP
+    assert bp.check(10, 10, now=3) == ACCEPT
+    assert not bp.is_behind()
+    # hard limit
+    assert bp.check(995, 10, now=3) == DROP
+
+    bp = Backpressure(high_water=100, low_water=20, max_lag=1.0, policy='disconnect')
+    bp.check(200, 10, now=0)
+    assert bp.check(200, 10, now=2) == EVICT
+    print('...ok!')
+
+
+def test_queue_delivers_in_order():
+    print('testing outbound queue ordering...')
+    left, right = socket.socketpair()
+    queue = OutboundQueue(FramedSocket(left))
+    reader = FramedSocket(right)
+
+    expected = [f'message {i}'.encode('ascii') for i in range(500)]
+    for message in expected:
+        queue.send(message)
+    received = []
+    while len(received) < len(expected):
+        received.extend(reader.recv_messages(2048))
+    assert received == expected
+
+    queue.close()
+    right.close()
+    print('...ok!')
+
+
+def test_queue_send_many():
+    print('testing outbound queue grouped sends...')
+    left, right = socket.socketpair()
+    queue = OutboundQueue(FramedSocket(left))
+    reader = FramedSocket(right)
+
+    queue.send(b'first')
+    assert queue.send_many([b'second', b'third']) == len(b'secondthird')
+    queue.send(b'fourth')
+    received = []
+    while len(received) < 4:
+        received.extend(reader.recv_messages(2048))
+    assert received == [b'first', b'second', b'third', b'fourth']
+    assert wait_for(lambda: queue.pending() == 0)
+
+    # a group that doesn't fit is dropped as a whole
+    stuck = StuckSocket()
+    queue2 = OutboundQueue(stuck, Backpressure(high_water=10, low_water=5, max_lag=60,
+                                               policy='drop', max_bytes=20))
+    assert queue2.send_many([b'x' * 8, b'y' * 8]) == 16
+    assert queue2.send_many([b'z' * 4, b'z']) == 0
+    assert queue2.dropped == 1
+    stuck.release.set()
+    assert wait_for(lambda: stuck.sent == [b'x' * 8, b'y' * 8])
+    queue.close()
+    queue2.close()
+    right.close()
+    print('...ok!')
+
+
+def test_coalesced_writes():
+    print('testing write coalescing...')
+    left, right = socket.socketpair()
+    framed = FramedSocket(left)
+    # a window long enough that only the byte threshold can trigger a write
+    queue = OutboundQueue(framed, flush_window=3600.0, flush_bytes=1000)
+    reader = FramedSocket(right)
+    # the window is far longer than this, so getting everything at all
+    # means the byte threshold sent it
+    right.settimeout(30)
+
+    expected = [f'message {i:03}'.encode('ascii') for i in range(100)]
+    queue.send(expected[0])
+    queue.send_many(expected[1:50])
+    for message in expected[50:]:
+        queue.send(message)
+    received = []
+    while len(received) < len(expected):
+        received.extend(reader.recv_messages(1 << 16))
+    assert received == expected
+    assert wait_for(lambda: framed.messages_sent == 100)
+    assert framed.writes <= 2, framed.writes
+    queue.close()
+    right.close()
+
+    # below the byte threshold, the window flushes what's there
+    left, right = socket.socketpair()
+    framed = FramedSocket(left)
+    queue = OutboundQueue(framed, flush_window=0.05, flush_bytes=1 << 20)
+    reader = FramedSocket(right)
+    right.settimeout(30)
+    queue.send(b'one')
+    queue.send(b'two')
+    received = []
+    while len(received) < 2:
+        received.extend(reader.recv_messages(2048))
+    assert received == [b'one', b'two']
+    assert wait_for(lambda: framed.messages_sent == 2)
+    assert framed.writes == 1
+    queue.close()
+    right.close()
+    print('...ok!')
+
+
+def test_send_never_blocks_on_slow_client():
+    print('testing send with a stuck client...')
+    stuck = StuckSocket()
+    queue = OutboundQueue(stuck, Backpressure(high_water=1000, low_water=100, max_lag=60,
+                                              policy='disconnect', max_bytes=4000))
+    # the socket blocks until it's released, so these have to finish
+    # without ever waiting on it
+    sender = threading.Thread(target=lambda: [queue.send(b'x' * 100) for _ in range(100)])
+    sender.start()
+    sender.join(30)
+    assert not sender.is_alive()
+    assert not stuck.release.is_set()
+    # queue is bounded, so most of those were dropped
+    assert queue.pending() <= 4000
+    assert queue.dropped > 0
+
+    stuck.release.set()
+    assert wait_for(lambda: queue.pending() == 0)
+    queue.close()
+    print('...ok!')
+
+
+def test_slow_consumer_eviction():
+    print('testing slow consumer eviction...')
+    stuck = StuckSocket()
+    queue = OutboundQueue(stuck, Backpressure(high_water=100, low_water=10, max_lag=0.05,
+                                              policy='disconnect', max_bytes=10000))
+    for _ in range(5):
+        queue.send(b'y' * 50)
+    time.sleep(0.1)
+    assert queue.send(b'late') == 0
+    assert queue.evicted
+    assert stuck.was_shut_down
+    assert queue.send(b'later') == 0
+    print('...ok!')
+
+
+def test_slow_consumer_drop():
+    print('testing slow consumer drop policy...')
+    stuck = StuckSocket()
+    queue = OutboundQueue(stuck, Backpressure(high_water=100, low_water=10, max_lag=0.05,
+                                              policy='drop', max_bytes=10000))
+    for _ in range(5):
+        queue.send(b'z' * 50)
+    time.sleep(0.1)
+    assert queue.send(b'late') == 0
+    assert not queue.evicted
+
+    # once it catches up it gets messages again
+    stuck.release.set()
+    assert wait_for(lambda: queue.pending() == 0)
+    assert queue.send(b'caught up') == len(b'caught up')
+    assert wait_for(lambda: b'caught up' in stuck.sent)
+    queue.close()
+    print('...ok!')
+
+
+def run_outbound_tests():
+    print('\nStarting outbound queue tests...\n')
+    test_backpressure_watermarks()
+    test_queue_delivers_in_order()
+    test_queue_send_many()
+    test_coalesced_writes()
+    test_send_never_blocks_on_slow_client()
+    test_slow_consumer_eviction()
+    test_slow_consumer_drop()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_outbound_tests()
@@ -3,7 +3,8 @@ PyRC app testing
 '''
 
 from unittest import mock
-from app.pyrc import PyRC
+from app.chatroom import Chatroom
+from app.pyrc import PyRC, message_broadcast
 
 
 def test_instantiation():
@@ -412,6 +413,23 @@ def test_broadcast():
     print("...ok!")
 
 
+def test_broadcast_encodes_once():
+    print('testing broadcast shares one frame between recipients...')
+    test_app = PyRC()
+    sockets = [mock.Mock() for _ in range(5)]
+    for i, sock in enumerate(sockets):
+        test_app.add_user(f'user{i}', sock)
+        sock.reset_mock()
+
+    message_broadcast(test_app.rooms['#lobby'], 'user0', 'hello everyone')
+
+    frames = [sock.send.call_args.args[0] for sock in sockets]
+    assert frames[0] == b'#lobby user0 : hello everyone '
+    # every recipient got the very same bytes object
+    assert all(frame is frames[0] for frame in frames)
+    print('...ok!')
+
+
 def test_parser_with_bad_input():
     print('testing parser with bad commands...')
     irc = PyRC()
@@ -475,6 +493,124 @@ def test_parser_with_bad_input():
     print('...ok!')
 
 
+def test_parser_dispatch():
+    print('testing parser command dispatch...')
+    irc = PyRC()
+    test_user = 'test_user1'
+    test_socket = mock.Mock()
+    irc.add_user(test_user, test_socket)
+
+    # every server side command has a handler. /help, /clear and /quit 
+    # are handled by the client
+    for command in ['/join', '/create', '/leave', '/rooms', '/myrooms', '/users', '/broadcast',
+                    '/mute', '/unmute', '/message', '/dms', '/whisper', '/block', '/unblock']:
+        assert command in PyRC.COMMANDS
+
+    # the message is only split once, whatever the command
+    class CountingStr(str):
+        splits = 0
+        def split(self, *args):
+            CountingStr.splits += 1
+            return super().split(*args)
+    irc.message_parser(CountingStr('/unmute all #lobby #a #b'), test_user, test_socket)
+    irc.message_parser(CountingStr('/broadcast #lobby : hi there /'), test_user, test_socket)
+    assert CountingStr.splits == 2
+
+    # used to raise IndexError
+    test_socket.reset_mock()
+    irc.message_parser('/mute', test_user, test_socket)
+    test_socket.send.assert_called_with('Error: must include at least one room name argument. \nex: /mute #roomname'.encode('ascii'))
+
+    # commands are matched on the whole first word
+    assert irc.message_parser('/joined #room', test_user, test_socket) == '/joined is not a valid command!'
+    assert irc.message_parser('/', test_user, test_socket) == '/ is not a valid command!'
+    print('...ok!')
+
+
+def test_user_room_index():
+    print('testing user to room index...')
+    test_app = PyRC()
+    for i in range(5000):
+        test_app.rooms[f'#empty{i}'] = Chatroom(f'#empty{i}')
+    for name in ['user1', 'user2']:
+        test_app.add_user(name, mock.Mock())
+        for room in ['#a', '#b', '#c']:
+            test_app.join_room(room, name)
+    assert test_app.check_consistency() == []
+    assert list(test_app.users['user1'].curr_rooms) == ['#lobby', '#a', '#b', '#c']
+
+    test_app.leave_room('#b', 'user1')
+    assert '#b' not in test_app.users['user1'].curr_rooms
+    assert test_app.check_consistency() == []
+
+    test_app.leave_all('user2')
+    assert list(test_app.users['user2'].curr_rooms) == ['#lobby']
+    assert test_app.check_consistency() == []
+
+    # removing a user only looks at the rooms they're in
+    with mock.patch.object(Chatroom, 'has_user') as has_user, \
+         mock.patch.object(Chatroom, 'remove_client_from_room', autospec=True,
+                           side_effect=Chatroom.remove_client_from_room) as remove:
+        test_app.remove_user('user1')
+    assert not has_user.called
+    assert sorted(call.args[0].name for call in remove.call_args_list) == ['#a', '#c', '#lobby']
+    assert 'user1' not in test_app.rooms['#a'].clients
+    assert test_app.check_consistency() == []
+
+    # and the checker does notice when they disagree
+    test_app.users['user2'].curr_rooms.append('#c')
+    del test_app.rooms['#lobby'].clients['user2']
+    assert len(test_app.check_consistency()) == 4
+    print('...ok!')
+
+
+def test_recipient_lists():
+    print('testing precomputed room recipients...')
+    test_app = PyRC()
+    sockets = {}
+    for name in ['user1', 'user2', 'user3']:
+        sockets[name] = mock.Mock()
+        test_app.add_user(name, sockets[name])
+        test_app.join_room('#room', name)
+    room = test_app.rooms['#room']
+
+    def heard(message):
+        # who got this message in #room
+        frame = f'#room user1 : {message} '.encode('ascii')
+        return sorted(name for name, sock in sockets.items()
+                      if any(call.args[0] == frame for call in sock.send.call_args_list))
+
+    test_app.message_parser('/mute #room', 'user2', sockets['user2'])
+    test_app.message_parser('/block @user1', 'user3', sockets['user3'])
+    assert room.recipients == (test_app.users['user1'], test_app.users['user3'])
+    assert room.blockers('user1') == (test_app.users['user3'],)
+    assert test_app.check_consistency() == []
+    message_broadcast(room, 'user1', 'first')
+    assert heard('first') == ['user1']
+
+    test_app.message_parser('/unmute #room', 'user2', sockets['user2'])
+    test_app.message_parser('/unblock @user1', 'user3', sockets['user3'])
+    assert room.blocked_by == {}
+    assert test_app.check_consistency() == []
+    message_broadcast(room, 'user1', 'second')
+    assert heard('second') == ['user1', 'user2', 'user3']
+
+    # blocks and mutes follow users into rooms they join later, and 
+    # leave with them
+    test_app.block('user3', 'user1')
+    test_app.mute('user2', '#later')
+    for name in ['user2', 'user3']:
+        test_app.join_room('#later', name)
+    assert test_app.rooms['#later'].recipients == (test_app.users['user3'],)
+    assert test_app.rooms['#later'].blockers('user1') == (test_app.users['user3'],)
+    test_app.leave_room('#later', 'user3')
+    assert test_app.rooms['#later'].blocked_by == {}
+    test_app.remove_user('user3')
+    assert room.blocked_by == {}
+    assert test_app.check_consistency() == []
+    print('...ok!')
+
+
 def run_PyRC_tests():
     print('\nStarting IRC application tests...\n')
 
@@ -495,7 +631,11 @@ def run_PyRC_tests():
     test_block_user()
     test_unblock_user()
     test_broadcast()
+    test_broadcast_encodes_once()
     test_parser_with_bad_input()
+    test_parser_dispatch()
+    test_user_room_index()
+    test_recipient_lists()
     
     print('\n...done!')
 
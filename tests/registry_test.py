@@ -0,0 +1,80 @@
+'''
+session registry testing
+'''
+
+from unittest import mock
+
+from app.registry import SessionRegistry
+
+
+def test_add_and_find():
+    print('testing registry add and find...')
+    registry = SessionRegistry()
+    client = mock.Mock()
+
+    assert registry.add(7, 'test_user', client)
+    assert len(registry) == 1
+    assert 7 in registry
+    assert registry.find(7).name == 'test_user'
+    assert registry.find(7).client is client
+    assert registry.find_user('test_user').fd == 7
+    assert registry.find(8) is None
+    assert registry.find_user('nobody') is None
+    print('...ok!')
+
+
+def test_duplicates_rejected():
+    print('testing registry duplicates...')
+    registry = SessionRegistry()
+    registry.add(7, 'test_user', mock.Mock())
+
+    assert registry.add(7, 'other_user', mock.Mock()) == False
+    assert registry.add(8, 'test_user', mock.Mock()) == False
+    assert len(registry) == 1
+    print('...ok!')
+
+
+def test_remove():
+    print('testing registry remove...')
+    registry = SessionRegistry()
+    for fd in range(1000):
+        registry.add(fd, f'user{fd}', mock.Mock())
+
+    session = registry.remove(500)
+    assert session.name == 'user500'
+    assert registry.find(500) is None
+    assert registry.find_user('user500') is None
+    assert len(registry) == 999
+    # removing twice is harmless
+    assert registry.remove(500) is None
+    # the fd and name can be reused
+    assert registry.add(500, 'user500', mock.Mock())
+    print('...ok!')
+
+
+def test_remove_by_identity():
+    print('testing registry remove by identity...')
+    registry = SessionRegistry()
+    registry.add(7, 'old_user', mock.Mock())
+    old = registry.remove(7)
+    # the fd is handed to a new client before old_user's cleanup runs
+    registry.add(7, 'new_user', mock.Mock())
+
+    assert registry.remove(7, old) is None
+    assert registry.find(7).name == 'new_user'
+    assert registry.find_user('new_user').fd == 7
+    assert registry.remove(7, registry.find(7)).name == 'new_user'
+    assert len(registry) == 0
+    print('...ok!')
+
+
+def run_registry_tests():
+    print('\nStarting session registry tests...\n')
+    test_add_and_find()
+    test_duplicates_rejected()
+    test_remove()
+    test_remove_by_identity()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_registry_tests()
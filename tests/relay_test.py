@@ -0,0 +1,237 @@
+'''
+relay (multi-worker) testing
+'''
+
+import os
+import socket
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from app.dmstore import DMStore
+from app.pyrc import PyRC
+from app.relay import RelayHub, RelayClient, encode_record
+
+
+def wait_for(condition, timeout=2):
+    '''
+    relay traffic is delivered on a background thread, so poll for it
+    '''
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def sent_to(mock_socket):
+    '''
+    everything a mock socket has been asked to send, as one string
+    '''
+    return ' '.join(c.args[0].decode('ascii') for c in mock_socket.send.call_args_list)
+
+
+def make_workers():
+    '''
+    one hub and two "workers" (PyRC instances) connected to it
+    '''
+    path = os.path.join(tempfile.mkdtemp(), 'relay.sock')
+    hub = RelayHub(path)
+    hub.start()
+    app_a, app_b = PyRC(), PyRC()
+    RelayClient(path).connect(app_a)
+    RelayClient(path).connect(app_b)
+    assert wait_for(lambda: len(hub.workers) == 2)
+    return hub, app_a, app_b
+
+
+def test_presence():
+    print('testing relay presence...')
+    hub, app_a, app_b = make_workers()
+    socket_a = mock.Mock()
+    app_a.add_user('user_a', socket_a)
+
+    assert wait_for(lambda: app_b.is_remote_user('user_a'))
+    assert 'user_a' in app_b.get_all_users().split()
+
+    # same name on another worker is rejected
+    socket_dup = mock.Mock()
+    assert app_b.add_user('user_a', socket_dup) == False
+
+    app_a.remove_user('user_a')
+    assert wait_for(lambda: not app_b.is_remote_user('user_a'))
+    hub.stop()
+    print('...ok!')
+
+
+def test_room_fan_out():
+    print('testing relayed room messages...')
+    hub, app_a, app_b = make_workers()
+    socket_a, socket_b = mock.Mock(), mock.Mock()
+    app_a.add_user('user_a', socket_a)
+    app_b.add_user('user_b', socket_b)
+    assert wait_for(lambda: app_a.is_remote_user('user_b'))
+
+    app_a.message_parser('hello from a', 'user_a', socket_a)
+    assert wait_for(lambda: '#lobby user_a : hello from a' in sent_to(socket_b))
+    # the sender's own worker doesn't get it twice
+    time.sleep(0.05)
+    assert sent_to(socket_a).count('hello from a') == 1
+    hub.stop()
+    print('...ok!')
+
+
+def test_room_users():
+    print('testing /users across workers...')
+    hub, app_a, app_b = make_workers()
+    socket_a, socket_b = mock.Mock(), mock.Mock()
+    app_a.add_user('user_a', socket_a)
+    app_b.add_user('user_b', socket_b)
+    app_a.message_parser('/join #dnd', 'user_a', socket_a)
+    app_b.message_parser('/join #dnd', 'user_b', socket_b)
+    assert wait_for(lambda: app_a.relay.room_users('#dnd') == ['user_b'])
+    app_a.message_parser('/users #dnd', 'user_a', socket_a)
+    assert '#dnd users: user_a user_b' in sent_to(socket_a)
+
+    # a worker that connects later is caught up too
+    app_c = PyRC()
+    RelayClient(hub.path).connect(app_c)
+    assert wait_for(lambda: app_c.relay.room_users('#dnd') == ['user_a', 'user_b'])
+    socket_c = mock.Mock()
+    app_c.add_user('user_c', socket_c)
+    app_c.message_parser('/users #dnd', 'user_c', socket_c)
+    assert '#dnd users: user_a user_b' in sent_to(socket_c)
+
+    # leaving the room, or the server, takes them off the list
+    app_b.message_parser('/leave #dnd', 'user_b', socket_b)
+    assert wait_for(lambda: app_c.relay.room_users('#dnd') == ['user_a'])
+    app_a.remove_user('user_a')
+    assert wait_for(lambda: app_c.relay.room_users('#dnd') == [])
+    app_c.message_parser('/users #dnd', 'user_c', socket_c)
+    assert 'Error: #dnd doesnt exist!' in sent_to(socket_c)
+    hub.stop()
+    print('...ok!')
+
+
+def test_whisper_and_dm():
+    print('testing relayed whispers and dms...')
+    hub, app_a, app_b = make_workers()
+    socket_a, socket_b = mock.Mock(), mock.Mock()
+    app_a.add_user('user_a', socket_a)
+    app_b.add_user('user_b', socket_b)
+    assert wait_for(lambda: app_a.is_remote_user('user_b'))
+
+    app_a.message_parser('/whisper @user_b psst', 'user_a', socket_a)
+    assert wait_for(lambda: '/whisper @user_a: psst' in sent_to(socket_b))
+
+    app_a.message_parser('/message @user_b hi there', 'user_a', socket_a)
+    assert wait_for(lambda: 'user_a' in app_b.users['user_b'].dms.keys())
+
+    # blocked whispers come back as an error for the sender
+    app_b.block('user_b', 'user_a')
+    app_a.message_parser('/whisper @user_b psst again', 'user_a', socket_a)
+    assert wait_for(lambda: 'Error: you were blocked by user_b!' in sent_to(socket_a))
+    hub.stop()
+    print('...ok!')
+
+
+def test_dm_to_user_who_left():
+    print('testing relayed dms to a user who just left...')
+    path = os.path.join(tempfile.mkdtemp(), 'relay.sock')
+    hub = RelayHub(path)
+    hub.start()
+    apps = [PyRC() for _ in range(3)]
+    for app in apps:
+        # every worker shares one dm store
+        app.dmstore = DMStore(os.path.join(os.path.dirname(path), 'dms.db'))
+        app.dmstore.remember('gone')
+        RelayClient(path).connect(app)
+    assert wait_for(lambda: len(hub.workers) == 3)
+    apps[0].add_user('user_a', mock.Mock())
+
+    # sent while user_a's worker still thought 'gone' was on another one
+    apps[0].relay.publish('dm', sender='user_a', receiver='gone', message='hi')
+    # only the sender's worker stores it
+    assert wait_for(lambda: apps[0].dmstore.count('gone') == 1)
+    time.sleep(0.1)
+    assert apps[0].dmstore.count('gone') == 1
+    hub.stop()
+    for app in apps:
+        app.dmstore.close()
+    print('...ok!')
+
+
+def test_stuck_worker():
+    print('testing that a stuck worker does not stall the relay...')
+    path = os.path.join(tempfile.mkdtemp(), 'relay.sock')
+    hub = RelayHub(path, max_queued=2 * 1024 * 1024)
+    hub.start()
+    # one worker that reads everything, and one that never reads anything
+    healthy = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    healthy.connect(path)
+    received = []
+
+    def drain():
+        while True:
+            data = healthy.recv(1 << 16)
+            if not data:
+                break
+            received.append(len(data))
+    threading.Thread(target=drain, daemon=True).start()
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stuck.connect(path)
+    assert wait_for(lambda: len(hub.workers) == 2)
+
+    # far more than fits in the stuck worker's socket buffers. routing
+    # only queues, so it never waits on the stuck worker
+    record = {'kind': 'notice', 'receiver': 'nobody', 'message': 'x' * 1000}
+
+    def route():
+        for i in range(5000):
+            hub.route(None, record)
+            # let the healthy worker keep up
+            if i % 50 == 0:
+                time.sleep(0.001)
+    router = threading.Thread(target=route)
+    router.start()
+    router.join(30)
+    assert not router.is_alive()
+    # the healthy worker got every record
+    size = len(encode_record(record)) * 5000
+    assert wait_for(lambda: sum(received) == size, timeout=30)
+    # once its queue filled up, the stuck worker was cut off
+    assert wait_for(lambda: len(hub.workers) == 1)
+
+    # publishing doesn't wait on the hub either
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path + '.stuck')
+    server.listen()
+    client = RelayClient(path + '.stuck')
+    client.connect(mock.Mock())
+    publisher = threading.Thread(target=lambda: [client.publish('notice', receiver='nobody', message='x' * 1000)
+                                                 for _ in range(5000)])
+    publisher.start()
+    publisher.join(30)
+    assert not publisher.is_alive()
+    client.close()
+    server.close()
+    healthy.close()
+    stuck.close()
+    hub.stop()
+    print('...ok!')
+
+
+def run_relay_tests():
+    print('\nStarting relay tests...\n')
+    test_presence()
+    test_room_fan_out()
+    test_room_users()
+    test_whisper_and_dm()
+    test_dm_to_user_who_left()
+    test_stuck_worker()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_relay_tests()
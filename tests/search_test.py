@@ -0,0 +1,220 @@
+'''
+full-text search testing
+'''
+
+import random
+import tempfile
+from unittest import mock
+
+from app.msglog import MessageLog
+from app.pyrc import PyRC, SEARCH_LIMIT
+from app.search import PostingList, RoomIndex, SearchIndex, tokenize
+
+
+def test_tokenize():
+    print('testing search tokenizer...')
+    assert tokenize('Hello, hello WORLD! it\'s 12:30') == ['hello', 'world', 'it', 's', '12', '30']
+    assert tokenize('  ...  ') == []
+    print('...ok!')
+
+
+def test_posting_lists():
+    print('testing compressed posting lists...')
+    numbers = [0, 1, 2, 130, 131, 20000, 20001, 5000000, 5000002]
+    postings = PostingList()
+    for number in numbers:
+        postings.append(number)
+    assert list(postings) == numbers and len(postings) == len(numbers)
+
+    # gaps under 128 take one byte each
+    dense = PostingList()
+    for number in range(0, 10000, 3):
+        dense.append(number)
+    assert len(dense.data) == len(dense)
+    assert list(dense) == list(range(0, 10000, 3))
+    print('...ok!')
+
+
+def test_intersection():
+    print('testing search term intersection...')
+    rng = random.Random(7)
+    vocabulary = [f'word{i}' for i in range(40)]
+    room = RoomIndex()
+    messages = []
+    for i in range(3000):
+        # a few common words and a long tail of rare ones
+        words = tokenize(' '.join(rng.choice(vocabulary[:rng.choice((5, 40))]) for _ in range(6)))
+        messages.append(set(words))
+        room.add(words, f'#r u : message {i} '.encode('ascii'))
+    for _ in range(200):
+        query = rng.sample(vocabulary, rng.randint(1, 3))
+        expected = [i for i, words in enumerate(messages) if all(word in words for word in query)]
+        assert room.match(query) == expected, query
+    assert room.match(['word0', 'missing']) == []
+    assert room.frame(2999) == b'#r u : message 2999 '
+    assert room.frame(0) == b'#r u : message 0 '
+    print('...ok!')
+
+
+def test_batched_indexing():
+    print('testing batched background indexing...')
+    index = SearchIndex(batch_interval=60)
+    for i in range(100):
+        index.add('#room', f'message {i} about apples', f'#room u : message {i} about apples '.encode('ascii'))
+    # nothing is indexed on the sending side, or by a search
+    assert index.indexed == 0
+    assert index.search('#room', 'apples') == []
+    assert index.indexed == 0
+    # the background batch indexes them all at once
+    index.flush()
+    results = index.search('#room', 'APPLES message', limit=3)
+    assert results == [f'#room u : message {i} about apples '.encode('ascii') for i in (97, 98, 99)]
+    assert index.indexed == 100 and index.batches == 1
+    assert index.search('#room', 'apples 42') == [b'#room u : message 42 about apples ']
+    assert index.search('#room', 'pears') == []
+    assert index.search('#elsewhere', 'apples') == []
+    assert index.search('#room', '!!!') == []
+    # left out frames don't count towards the limit
+    assert index.search('#room', 'apples', limit=2, keep=lambda frame: b'7' in frame) == \
+        [b'#room u : message 87 about apples ', b'#room u : message 97 about apples ']
+    assert index.search('#room', 'apples', limit=0) == []
+    stats = index.stats()
+    assert stats["Messages"] == 100 and stats["Postings"] == 400
+    index.close()
+    print('...ok!')
+
+
+def test_bounded_index():
+    print('testing that room indexes stop growing...')
+    room = RoomIndex(chunk_messages=100, max_chunks=3)
+    for i in range(1000):
+        room.add(tokenize(f'message {i} even' if i % 2 == 0 else f'message {i}'), f'#r u : message {i} '.encode('ascii'))
+    # only the newest 3 chunks are left, postings and frames alike
+    assert len(room.chunks) == 3 and len(room) == 300 and room.dropped == 700
+    assert room.match(['even']) == list(range(700, 1000, 2))
+    assert room.match(['message', '5']) == [] and room.match(['999']) == [999]
+    assert room.frame(700) == b'#r u : message 700 '
+    try:
+        room.frame(699)
+        assert False, 'expected IndexError'
+    except IndexError:
+        pass
+
+    index = SearchIndex(batch_interval=60, chunk_messages=50, max_chunks=2)
+    for i in range(1000):
+        index.add('#room', f'apples {i}', f'#room u : apples {i} '.encode('ascii'))
+    index.flush()
+    stats = index.stats()
+    assert stats["Messages"] == 1000 and stats["Kept"] == 100
+    assert stats["Postings"] == 200 and stats["Frame Bytes"] == sum(len(f'#room u : apples {i} ') for i in range(900, 1000))
+    assert index.search('#room', 'apples', limit=2) == [b'#room u : apples 998 ', b'#room u : apples 999 ']
+    assert index.search('#room', 'apples 10') == []
+    # searches walk the chunks newest first, across chunk boundaries
+    assert index.search('#room', 'apples', limit=60)[0] == b'#room u : apples 940 '
+    assert len(index.search('#room', 'apples', limit=500)) == 100
+    index.close()
+    print('...ok!')
+
+
+def test_search_command():
+    print('testing /search...')
+    test_app = PyRC()
+    sockets = {name: mock.Mock() for name in ('mod', 'troll', 'outsider')}
+    for name, sock in sockets.items():
+        test_app.add_user(name, sock)
+
+    # search isn't on by default
+    assert test_app.message_parser('/search #lobby hi', 'mod', sockets['mod']) == \
+        'Error: search is not enabled on this server!'
+
+    test_app.search = SearchIndex()
+    test_app.join_room('#dnd', 'mod')
+    test_app.join_room('#dnd', 'troll')
+    test_app.message_parser('the dragon drops some loot', 'mod', sockets['mod'])
+    test_app.message_parser('no loot for you', 'troll', sockets['troll'])
+    test_app.message_parser('/broadcast #dnd : dragon loot is cursed /', 'troll', sockets['troll'])
+    test_app.search.flush()
+
+    res = test_app.message_parser('/search #dnd Dragon loot', 'mod', sockets['mod'])
+    assert res == 'Results for "Dragon loot" in #dnd:\n' \
+                  '#dnd mod : the dragon drops some loot \n#dnd troll : dragon loot is cursed '
+    assert sockets['mod'].send.call_args.args[0] == res.encode('ascii')
+
+    # blocked users don't show up in results
+    test_app.message_parser('/block @troll', 'mod', sockets['mod'])
+    res = test_app.message_parser('/search #dnd loot', 'mod', sockets['mod'])
+    assert 'troll' not in res and 'the dragon drops some loot' in res
+    # even when they've said more than a page of results since
+    for i in range(SEARCH_LIMIT + 5):
+        test_app.message_parser(f'more loot {i}', 'troll', sockets['troll'])
+    test_app.search.flush()
+    res = test_app.message_parser('/search #dnd loot', 'mod', sockets['mod'])
+    assert res == 'Results for "loot" in #dnd:\n#dnd mod : the dragon drops some loot '
+
+    assert test_app.message_parser('/search #dnd unicorn', 'mod', sockets['mod']) == 'No results for "unicorn" in #dnd'
+    assert test_app.message_parser('/search #dnd', 'mod', sockets['mod']).startswith('Error: /search requires')
+    assert test_app.message_parser('/search dnd loot', 'mod', sockets['mod']).startswith('Error: room name')
+    assert test_app.message_parser('/search #nope loot', 'mod', sockets['mod']) == 'Error: #nope doesnt exist!'
+    assert test_app.message_parser('/search #dnd loot', 'outsider', sockets['outsider']) == 'Error: you are not in #dnd!'
+    test_app.search.close()
+    print('...ok!')
+
+
+def test_search_past_the_index():
+    print('testing /search past what the index holds...')
+    test_app = PyRC()
+    sock = mock.Mock()
+    test_app.add_user('mod', sock)
+    test_app.join_room('#dnd', 'mod')
+    test_app.search = SearchIndex(batch_interval=60, chunk_messages=10, max_chunks=2)
+    for i in range(100):
+        test_app.message_parser(f'roll {i}' if i != 3 else 'the dragon wakes', 'mod', sock)
+    test_app.search.flush()
+    assert test_app.search.coverage('#dnd') == (20, 80)
+
+    # without a log, the reply says how far back it looked
+    assert test_app.message_parser('/search #dnd dragon', 'mod', sock) == \
+        'No results for "dragon" in #dnd\n(only the newest 20 messages in #dnd were searched)'
+    test_app.search.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # after a restart, the index starts out empty but the log doesn't
+        test_app.log = MessageLog(directory)
+        test_app.search = SearchIndex(batch_interval=60, chunk_messages=10, max_chunks=2)
+        for i in range(100):
+            test_app.message_parser(f'roll {i}' if i != 3 else 'the dragon wakes', 'mod', sock)
+        test_app.log.flush()
+        test_app.search.close()
+        test_app.search = SearchIndex(batch_interval=60, chunk_messages=10, max_chunks=2)
+        test_app.message_parser('a new dragon', 'mod', sock)
+        test_app.log.flush()
+        test_app.search.flush()
+
+        # the log covers what the index doesn't, in order and without repeats
+        assert test_app.message_parser('/search #dnd dragon', 'mod', sock) == \
+            'Results for "dragon" in #dnd:\n#dnd mod : the dragon wakes \n#dnd mod : a new dragon '
+        res = test_app.message_parser('/search #dnd roll', 'mod', sock)
+        assert res.splitlines()[1:] == [f'#dnd mod : roll {i} ' for i in range(80, 100)]
+
+        # the log is only read so far back
+        with mock.patch('app.pyrc.SEARCH_LOG_MESSAGES', 50):
+            assert test_app.message_parser('/search #dnd wakes', 'mod', sock) == \
+                'No results for "wakes" in #dnd\n(only the newest 51 messages in #dnd were searched)'
+        test_app.search.close()
+        test_app.log.close()
+    print('...ok!')
+
+
+def run_search_tests():
+    print('\nStarting search tests...\n')
+    test_tokenize()
+    test_posting_lists()
+    test_intersection()
+    test_batched_indexing()
+    test_bounded_index()
+    test_search_command()
+    test_search_past_the_index()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_search_tests()
@@ -0,0 +1,514 @@
+'''
+server testing
+'''
+
+import asyncio
+import socket
+import threading
+import time
+from unittest import mock
+
+import server
+from server import AsyncServer
+from app.framing import FrameDecoder, FramedSocket, encode_frame
+from app.outbound import Backpressure
+from app.timers import Heartbeat, TimerWheel
+
+
+async def read_until(reader, text, timeout=2):
+    '''
+    keep reading messages from the server until text shows up in one of them
+    '''
+    decoder = FrameDecoder()
+    received = []
+    while not any(text in message for message in received):
+        data = await asyncio.wait_for(reader.read(2048), timeout)
+        if not data:
+            break
+        received.extend(message.decode('ascii') for message in decoder.feed(data))
+    return '\n'.join(received)
+
+
+def send(writer, message):
+    writer.write(encode_frame(message.encode('ascii')))
+
+
+def test_async_server_session():
+    print('testing async server session...')
+
+    async def session():
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        assert 'Connected to server' in await read_until(reader, 'Connected to server')
+
+        send(writer, 'async_user')
+        assert 'async_user joined #lobby!' in await read_until(reader, 'joined #lobby!')
+        assert 'async_user' in server.APP.users.keys()
+
+        send(writer, '/rooms')
+        assert '#lobby' in await read_until(reader, 'Active rooms')
+
+        # hanging up should run the same cleanup as handle()
+        writer.close()
+        for _ in range(100):
+            if 'async_user' not in server.APP.users.keys():
+                break
+            await asyncio.sleep(0.01)
+        assert 'async_user' not in server.APP.users.keys()
+        assert len(server.SESSIONS) == 0
+
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(session())
+    print('...ok!')
+
+
+def test_async_server_stale_fd():
+    print('testing async server with a new client on a stale fd...')
+
+    async def session():
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        watcher_reader, watcher_writer = await asyncio.open_connection('127.0.0.1', port)
+        await read_until(watcher_reader, 'Connected to server')
+        send(watcher_writer, 'watcher')
+        await read_until(watcher_reader, 'watcher joined #lobby!')
+
+        # the new client's fd still belongs to someone whose disconnect hasn't run
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await read_until(reader, 'Connected to server')
+        with mock.patch.object(server.SESSIONS, 'add', return_value=False):
+            send(writer, 'late_user')
+            assert 'please reconnect' in await read_until(reader, 'please reconnect')
+        # they were never announced, or added
+        assert await reader.read(2048) == b''
+        assert 'late_user' not in server.APP.users.keys()
+        send(watcher_writer, 'still here')
+        assert 'late_user' not in await read_until(watcher_reader, 'still here')
+
+        watcher_writer.close()
+        writer.close()
+        for _ in range(100):
+            if 'watcher' not in server.APP.users.keys():
+                break
+            await asyncio.sleep(0.01)
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(session())
+    print('...ok!')
+
+
+def test_async_server_many_idle_clients():
+    print('testing async server with many idle clients...')
+
+    async def session():
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        clients = []
+        for i in range(200):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await read_until(reader, 'Connected to server')
+            send(writer, f'idle_{i}')
+            clients.append((reader, writer))
+
+        for _ in range(200):
+            if len(server.APP.users) == 200:
+                break
+            await asyncio.sleep(0.01)
+        assert len(server.APP.users) == 200
+
+        for reader, writer in clients:
+            writer.close()
+        for _ in range(200):
+            if len(server.APP.users) == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert len(server.APP.users) == 0
+
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(session())
+    print('...ok!')
+
+
+def test_async_server_framing():
+    print('testing async server framing...')
+
+    async def session():
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await read_until(reader, 'Connected to server')
+
+        # username and two commands in a single write
+        long_message = 'x' * 5000
+        writer.write(encode_frame(b'framed_user') + encode_frame(b'/join #big') +
+                     encode_frame(long_message.encode('ascii')))
+        received = await read_until(reader, long_message)
+        assert 'Joined #big!' in received or 'framed_user joined #big!' in received
+        assert f'#lobby framed_user : {long_message} ' in received
+
+        writer.close()
+        for _ in range(100):
+            if 'framed_user' not in server.APP.users.keys():
+                break
+            await asyncio.sleep(0.01)
+        assert 'framed_user' not in server.APP.users.keys()
+        del server.APP.rooms['#big']
+
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(session())
+    print('...ok!')
+
+
+def test_async_server_with_pool():
+    print('testing async server with a command pool...')
+
+    async def session():
+        server.start_pool(2)
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await read_until(reader, 'Connected to server')
+        send(writer, 'pool_user')
+        for i in range(50):
+            send(writer, f'message {i}')
+        received = await read_until(reader, 'message 49')
+        # commands ran on the pool, in the order they were sent
+        positions = [received.index(f'pool_user : message {i} ') for i in range(50)]
+        assert positions == sorted(positions)
+
+        writer.close()
+        for _ in range(100):
+            if 'pool_user' not in server.APP.users.keys():
+                break
+            await asyncio.sleep(0.01)
+        assert 'pool_user' not in server.APP.users.keys()
+        assert len(server.SESSIONS) == 0
+
+        listener.close()
+        await listener.wait_closed()
+
+    try:
+        asyncio.run(session())
+    finally:
+        server.POOL.stop()
+        server.POOL = None
+    print('...ok!')
+
+
+def test_async_stored_dms_run_on_the_loop():
+    print('testing async stored dm delivery to a client that drops it...')
+
+    async def session():
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await read_until(reader, 'Connected to server')
+        send(writer, 'dm_user')
+        await read_until(reader, 'joined #lobby!')
+        # every send to dm_user is dropped from here on
+        client = server.SESSIONS.find_user('dm_user').client
+        client.backpressure = Backpressure(high_water=0, low_water=0, max_lag=60, policy='drop', max_bytes=0)
+
+        # the DMStore() writer thread hands deliveries to the loop, where
+        # a dropped send is seen, so nothing is counted as handled
+        stored = [('sender', 'hello', time.time(), False)]
+        loop = asyncio.get_running_loop()
+        handled = await loop.run_in_executor(None, test_server.call_wait, server.APP.deliver_stored_dms,
+                                             'dm_user', stored, 0)
+        assert handled == 0
+        assert client.dropped == 1
+
+        writer.close()
+        for _ in range(100):
+            if 'dm_user' not in server.APP.users.keys():
+                break
+            await asyncio.sleep(0.01)
+        listener.close()
+        await listener.wait_closed()
+
+    asyncio.run(session())
+    print('...ok!')
+
+
+def test_async_server_stalled_handshake():
+    print('testing async server with a client that never sends a username...')
+
+    async def session():
+        old_timeout = server.HANDSHAKE_TIMEOUT
+        server.HANDSHAKE_TIMEOUT = 0.2
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            # connects, then says nothing
+            stalled_reader, stalled_writer = await asyncio.open_connection('127.0.0.1', port)
+            await read_until(stalled_reader, 'Connected to server')
+
+            # everyone else still gets in
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await read_until(reader, 'Connected to server')
+            send(writer, 'prompt_user')
+            assert 'prompt_user joined #lobby!' in await read_until(reader, 'joined #lobby!')
+
+            # and the stalled client is dropped once its time is up
+            assert await asyncio.wait_for(stalled_reader.read(), 2) == b''
+            writer.close()
+            stalled_writer.close()
+            for _ in range(100):
+                if 'prompt_user' not in server.APP.users.keys():
+                    break
+                await asyncio.sleep(0.01)
+            assert len(server.SESSIONS) == 0
+        finally:
+            server.HANDSHAKE_TIMEOUT = old_timeout
+            listener.close()
+            await listener.wait_closed()
+
+    asyncio.run(session())
+    print('...ok!')
+
+
+def test_threaded_server_stalled_handshake():
+    print('testing threaded server with a client that never sends a username...')
+    old_timeout = server.HANDSHAKE_TIMEOUT
+    server.HANDSHAKE_TIMEOUT = 0.2
+    test_server = server.Server('127.0.0.1', 0)
+    test_server.daemon = True
+    test_server.start()
+    assert test_server.ready.wait(2)
+    address = test_server.socket.getsockname()
+    try:
+        # connects, then says nothing
+        stalled = FramedSocket(socket.create_connection(address))
+        stalled.settimeout(2)
+        assert stalled.recv_messages(2048) == [b'Connected to server']
+
+        # used to hang in accept()'s thread until the stalled client spoke
+        client = FramedSocket(socket.create_connection(address))
+        client.settimeout(2)
+        assert client.recv_messages(2048) == [b'Connected to server']
+        client.send(b'threaded_user')
+        assert b'threaded_user joined #lobby!' in client.recv_messages(2048)[0]
+
+        # the stalled client is dropped once its time is up
+        assert stalled.recv_messages(2048) == []
+
+        # a client trickling in a frame one byte at a time never finishes
+        # it, and is dropped all the same
+        trickle = FramedSocket(socket.create_connection(address))
+        trickle.settimeout(2)
+        assert trickle.recv_messages(2048) == [b'Connected to server']
+        dropped = False
+        for byte in encode_frame(b'x' * 100):
+            try:
+                trickle.socket.sendall(bytes([byte]))
+            except OSError:
+                dropped = True
+                break
+            time.sleep(server.HANDSHAKE_TIMEOUT / 4)
+        if not dropped:
+            assert trickle.recv_messages(2048) == []
+        trickle.close()
+        client.close()
+        stalled.close()
+        for _ in range(100):
+            if 'threaded_user' not in server.APP.users.keys():
+                break
+            time.sleep(0.01)
+        assert len(server.SESSIONS) == 0
+    finally:
+        server.HANDSHAKE_TIMEOUT = old_timeout
+        test_server.shut_down()
+    print('...ok!')
+
+
+def test_threaded_server_coalescing():
+    print('testing threaded server with write coalescing...')
+    server.COALESCE = True
+    test_server = server.Server('127.0.0.1', 0)
+    test_server.daemon = True
+    test_server.start()
+    assert test_server.ready.wait(2)
+    address = test_server.socket.getsockname()
+    try:
+        client = FramedSocket(socket.create_connection(address))
+        client.settimeout(2)
+        assert client.recv_messages(2048) == [b'Connected to server']
+        client.send(b'coalesced_user')
+        assert b'coalesced_user joined #lobby!' in client.recv_messages(2048)[0]
+
+        session = server.SESSIONS.find_user('coalesced_user')
+        assert session.client.flush_window == server.COALESCE_WINDOW
+        assert session.client.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+        # a burst of replies still all arrive, in order
+        for _ in range(20):
+            client.send(b'/myrooms')
+        received = []
+        while len(received) < 20:
+            received.extend(client.recv_messages(2048))
+        assert received == [b'#lobby'] * 20
+        client.close()
+        for _ in range(100):
+            if len(server.SESSIONS) == 0:
+                break
+            time.sleep(0.01)
+        assert len(server.SESSIONS) == 0
+    finally:
+        server.COALESCE = False
+        test_server.shut_down()
+    print('...ok!')
+
+
+def fast_heartbeat():
+    '''
+    swap in a heartbeat that pings after 0.1s and gives up after 0.4s.
+    returns the old one
+    '''
+    old = server.HEARTBEAT
+    server.HEARTBEAT = Heartbeat(server.ping, server.expire, interval=0.1, timeout=0.4,
+                                 wheel=TimerWheel(tick=0.02))
+    return old
+
+
+def test_threaded_server_heartbeat():
+    print('testing threaded server heartbeat and idle reaping...')
+    old_heartbeat = fast_heartbeat()
+    test_server = server.Server('127.0.0.1', 0)
+    test_server.daemon = True
+    test_server.start()
+    assert test_server.ready.wait(2)
+    address = test_server.socket.getsockname()
+    try:
+        silent = FramedSocket(socket.create_connection(address))
+        silent.settimeout(2)
+        silent.recv_messages(2048)
+        silent.send(b'silent_user')
+        answering = FramedSocket(socket.create_connection(address))
+        answering.settimeout(2)
+        answering.recv_messages(2048)
+        answering.send(b'answering_user')
+
+        # the other one answers every ping
+        def answer():
+            try:
+                while True:
+                    messages = answering.recv_messages(2048)
+                    if not messages:
+                        break
+                    for message in messages:
+                        if message == b'/ping':
+                            answering.send(b'/pong')
+            except OSError:
+                pass
+        answerer = threading.Thread(target=answer, daemon=True)
+        answerer.start()
+
+        # the silent client is pinged, never answers, and is dropped
+        received = []
+        while True:
+            messages = silent.recv_messages(2048)
+            if not messages:
+                break
+            received.extend(messages)
+        assert b'/ping' in received
+        time.sleep(0.5)
+
+        for _ in range(100):
+            if 'silent_user' not in server.APP.users.keys():
+                break
+            time.sleep(0.01)
+        assert 'silent_user' not in server.APP.users.keys()
+        assert 'answering_user' in server.APP.users.keys()
+        assert server.SESSIONS.find_user('answering_user') is not None
+        assert len(server.HEARTBEAT) == 1
+
+        answering.shutdown(socket.SHUT_RDWR)
+        answering.close()
+        answerer.join()
+        silent.close()
+        for _ in range(100):
+            if len(server.SESSIONS) == 0 and len(server.HEARTBEAT) == 0:
+                break
+            time.sleep(0.01)
+        assert len(server.SESSIONS) == 0
+        assert len(server.HEARTBEAT) == 0
+    finally:
+        server.HEARTBEAT.wheel.stop()
+        server.HEARTBEAT = old_heartbeat
+        test_server.shut_down()
+    print('...ok!')
+
+
+def test_async_server_heartbeat():
+    print('testing async server idle reaping...')
+
+    async def session():
+        test_server = AsyncServer(host='127.0.0.1', port=0)
+        listener = await test_server.start()
+        port = listener.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await read_until(reader, 'Connected to server')
+        send(writer, 'idle_async_user')
+        assert '/ping' in await read_until(reader, '/ping')
+        # never answers, so the server hangs up
+        while await asyncio.wait_for(reader.read(2048), 2):
+            pass
+        for _ in range(100):
+            if 'idle_async_user' not in server.APP.users.keys():
+                break
+            await asyncio.sleep(0.01)
+        assert 'idle_async_user' not in server.APP.users.keys()
+        assert len(server.SESSIONS) == 0
+        writer.close()
+
+        listener.close()
+        await listener.wait_closed()
+
+    old_heartbeat = fast_heartbeat()
+    try:
+        asyncio.run(session())
+    finally:
+        server.HEARTBEAT.wheel.stop()
+        server.HEARTBEAT = old_heartbeat
+    print('...ok!')
+
+
+def run_server_tests():
+    print('\nStarting server tests...\n')
+    test_async_server_session()
+    test_async_server_stale_fd()
+    test_async_server_many_idle_clients()
+    test_async_server_framing()
+    test_async_server_with_pool()
+    test_async_stored_dms_run_on_the_loop()
+    test_async_server_stalled_handshake()
+    test_threaded_server_stalled_handshake()
+    test_threaded_server_coalescing()
+    test_threaded_server_heartbeat()
+    test_async_server_heartbeat()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_server_tests()
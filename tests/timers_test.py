@@ -0,0 +1,107 @@
+'''
+timer wheel and heartbeat testing
+'''
+
+import time
+
+from app.timers import Heartbeat, TimerWheel
+
+
+def test_timers_fire_when_due():
+    print('testing timer wheel firing...')
+    wheel = TimerWheel(tick=1.0, slots=8)
+    fired = []
+    start = wheel.origin
+    wheel.schedule('a', 2, fired.append, 'a', now=start)
+    wheel.schedule('b', 5, fired.append, 'b', now=start)
+    # more than one lap away
+    wheel.schedule('c', 20, fired.append, 'c', now=start)
+
+    assert wheel.advance(start + 1.5) == 0
+    assert wheel.advance(start + 2.0) == 1
+    assert fired == ['a']
+    wheel.advance(start + 10)
+    assert fired == ['a', 'b']
+    assert 'c' in wheel
+    wheel.advance(start + 20)
+    assert fired == ['a', 'b', 'c']
+    assert len(wheel) == 0
+    print('...ok!')
+
+
+def test_cancel_and_reschedule():
+    print('testing timer wheel cancel and reschedule...')
+    wheel = TimerWheel(tick=1.0, slots=8)
+    fired = []
+    start = wheel.origin
+    wheel.schedule('a', 2, fired.append, 'first', now=start)
+    # same key replaces the old timer
+    wheel.schedule('a', 4, fired.append, 'second', now=start)
+    assert len(wheel) == 1
+    wheel.advance(start + 3)
+    assert fired == []
+    wheel.advance(start + 4)
+    assert fired == ['second']
+
+    wheel.schedule('b', 2, fired.append, 'b', now=start + 4)
+    assert wheel.cancel('b')
+    assert not wheel.cancel('b')
+    wheel.advance(start + 10)
+    assert fired == ['second']
+    print('...ok!')
+
+
+def test_many_timers():
+    print('testing timer wheel with 100k timers...')
+    wheel = TimerWheel(tick=1.0, slots=512)
+    fired = []
+    start = wheel.origin
+    for key in range(100000):
+        wheel.schedule(key, key % 90 + 1, fired.append, key, now=start)
+    for key in range(0, 100000, 2):
+        wheel.cancel(key)
+    assert len(wheel) == 50000
+    wheel.advance(start + 91)
+    assert len(fired) == 50000
+    assert len(wheel) == 0
+    print('...ok!')
+
+
+def test_heartbeat():
+    print('testing heartbeat ping and expire...')
+    pinged = []
+    expired = []
+    wheel = TimerWheel(tick=0.01)
+    heartbeat = Heartbeat(pinged.append, expired.append, interval=0.05, timeout=0.15, wheel=wheel)
+    heartbeat.watch('quiet')
+    heartbeat.watch('chatty')
+    heartbeat.start()
+    try:
+        deadline = time.monotonic() + 2
+        while not expired and time.monotonic() < deadline:
+            heartbeat.seen('chatty')
+            time.sleep(0.01)
+    finally:
+        wheel.stop()
+
+    # only the quiet client was pinged, then dropped
+    assert expired == ['quiet']
+    assert 'quiet' in pinged
+    assert 'chatty' not in pinged
+    assert len(heartbeat) == 1
+    heartbeat.forget('chatty')
+    assert len(heartbeat) == 0
+    assert len(wheel) == 0
+    print('...ok!')
+
+
+def run_timers_tests():
+    print('\nStarting timer tests...\n')
+    test_timers_fire_when_due()
+    test_cancel_and_reschedule()
+    test_many_timers()
+    test_heartbeat()
+    print("\n...done!")
+
+if __name__ == '__main__':
+    run_timers_tests()
@@ -30,7 +30,11 @@ def test_get_dm_from_unblocked_user():
     test_user.get_dm(sender, message)
     assert sender not in test_user.blocked
     assert sender in test_user.dms.keys()
-    assert test_user.dms[sender] == message
+    assert test_user.dms[sender] == [message]
+
+    # a second dm from the same sender is kept after the first
+    test_user.get_dm(sender, 'another one')
+    assert test_user.dms[sender] == [message, 'another one']
     print('...ok!')
 
 def test_get_dm_from_blocked_user():
@@ -61,17 +65,80 @@ def test_read_dm():
     test_user.get_dm(sender, message)
 
     res = test_user.read_dm(sender)
-    assert res == f'{sender}: \n{test_user.dms[sender]}'
+    assert res == f'{sender} (page 1 of 1): \n{message}'
     assert res != f'No messages from {sender}!'
     assert res != 'No messages!'
     print('...ok!')
 
+def test_read_dm_pages():
+    print('testing paged dms...')
+    mock_socket = mock.Mock()
+    test_user = User(name = 'test_user', 
+                     socket = mock_socket, 
+                     curr_room = 'test_room')
+    for i in range(25):
+        test_user.get_dm('chatty', f'message {i}')
+    test_user.get_dm('quiet', 'hello')
+
+    # page 1 is the newest messages, oldest first
+    res = test_user.read_dm('chatty')
+    assert res == 'chatty (page 1 of 3): \n' + '\n'.join(f'message {i}' for i in range(15, 25))
+    assert mock_socket.send.call_args.args[0] == res.encode('ascii')
+    assert test_user.read_dm('chatty', 3) == 'chatty (page 3 of 3): \n' + '\n'.join(f'message {i}' for i in range(5))
+    assert test_user.read_dm('chatty', 4) == 'No page 4 of messages from chatty! There are 3.'
+    assert test_user.read_dm('nobody') == 'No messages from nobody!'
+
+    # the summary lists conversations, most recently used first, not every message
+    res = test_user.read_all_dms()
+    assert res == 'chatty : 25 message(s), newest: message 24\n' \
+                  'quiet : 1 message(s), newest: hello\n' \
+                  'Use /dms @user_name (opt) <page> to read'
+    print('...ok!')
+
+def test_compact_layout():
+    print('testing user layout and lazy containers...')
+    test_user = User('test_user', mock.Mock(), 'test_room')
+    other_user = User('other_user', mock.Mock(), 'test_room')
+    assert not hasattr(test_user, '__dict__')
+    try:
+        test_user.nickname = 'nope'
+        assert False, 'expected AttributeError'
+    except AttributeError:
+        pass
+
+    # nothing is made until it's needed, and the empty stand-ins are shared
+    assert test_user._blocked is None and test_user._muted_rooms is None and test_user._dms is None
+    assert test_user.blocked is other_user.blocked
+    # the shared stand-in can't be changed through one user
+    for change in (lambda: test_user.blocked.append('mallory'), lambda: test_user.muted_rooms.add('#room'),
+                   lambda: test_user.blocked.discard('mallory')):
+        try:
+            change()
+            assert False, 'expected TypeError'
+        except TypeError:
+            pass
+    assert other_user.blocked == [] and other_user.muted_rooms == []
+    assert not test_user.has_blocked('someone') and not test_user.has_muted('#room')
+    test_user.unmute('#room')
+    test_user.unblock('someone')
+    assert test_user._muted_rooms is None and test_user._blocked is None
+
+    test_user.block('someone')
+    test_user.mute('#room')
+    test_user.get_dm('friend', 'hi')
+    assert test_user.has_blocked('someone') and test_user.has_muted('#room')
+    assert list(test_user.dms.keys()) == ['friend'] and test_user.dms['friend'] == ['hi']
+    assert other_user.blocked == [] and other_user.muted_rooms == [] and other_user.dms == {}
+    print('...ok!')
+
 def run_user_tests():
     print('\nStarting user tests...\n')
     test_instance()
     test_get_dm_from_unblocked_user()
     test_get_dm_from_blocked_user()
     test_read_dm()
+    test_read_dm_pages()
+    test_compact_layout()
     print("\n...done!")
 
 if __name__ == '__main__':